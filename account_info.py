@@ -1,10 +1,84 @@
+from datetime import date
+
+from consumption_store import Readings
 from tariff import Tariff
 
 
+class ExportInfo:
+    """The account's export meter and what it exported on the latest day it has all the readings for."""
+
+    def __init__(self, tariff_code: str, mpan: str, serial_number: str, readings: Readings,
+                 current_tariff: Tariff = None, day: date = None):
+        self.tariff_code = tariff_code
+        self.mpan = mpan
+        self.serial_number = serial_number
+        self.readings = readings  # Exported watt-hours per half hour
+        self.current_tariff = current_tariff  # None if it's not a known export tariff
+        self.day = day  # The day the readings are for, often before the import's since exports lag
+
+    def as_dict(self) -> dict:
+        return {"tariff_code": self.tariff_code, "mpan": self.mpan, "serial_number": self.serial_number,
+                "readings": self.readings.as_dict(),
+                "current_tariff": self.current_tariff.id if self.current_tariff else None,
+                "day": str(self.day) if self.day else None}
+
+    @classmethod
+    def from_dict(cls, data, tariff_for):
+        """Build from `as_dict`, with `tariff_for` turning a tariff ID back into a Tariff."""
+        current_tariff = tariff_for(data["current_tariff"]) if data["current_tariff"] else None
+        day = date.fromisoformat(data["day"]) if data.get("day") else None
+        return cls(data["tariff_code"], data["mpan"], data["serial_number"], Readings.from_dict(data["readings"]),
+                   current_tariff, day)
+
+
 class AccountInfo:
-    def __init__(self, current_tariff: Tariff, standing_charge: float, region_code: str, consumption, mpan: str):
+    def __init__(self, current_tariff: Tariff, standing_charge: float, region_code: str, consumption: Readings, mpan: str,
+                 device_id: str = None, tariff_code: str = None, export: ExportInfo = None):
         self.current_tariff = current_tariff
         self.standing_charge = standing_charge
         self.region_code = region_code
         self.consumption = consumption
         self.mpan = mpan
+        self.device_id = device_id
+        self.tariff_code = tariff_code
+        self.export = export  # None without an export meter
+
+    @property
+    def dual_register(self) -> bool:
+        """Whether the import meter has day and night registers (Economy 7), from its E-2R- tariff code."""
+        return self.tariff_code is not None and self.tariff_code.upper().startswith("E-2R-")
+
+    def as_dict(self) -> dict:
+        """Everything fetched for the account, so a resumed run can price it without fetching it again."""
+        return {"current_tariff": self.current_tariff.id, "standing_charge": self.standing_charge,
+                "region_code": self.region_code, "consumption": self.consumption.as_dict(), "mpan": self.mpan,
+                "device_id": self.device_id, "tariff_code": self.tariff_code,
+                "export": self.export.as_dict() if self.export else None}
+
+    @classmethod
+    def from_dict(cls, data, tariff_for):
+        """Build from `as_dict`, with `tariff_for` turning a tariff ID back into a Tariff."""
+        export = ExportInfo.from_dict(data["export"], tariff_for) if data["export"] else None
+        return cls(tariff_for(data["current_tariff"]), data["standing_charge"], data["region_code"],
+                   Readings.from_dict(data["consumption"]), data["mpan"], data["device_id"], data["tariff_code"],
+                   export)
+
+
+class Account:
+    """An Octopus account the bot runs for, and the state it keeps between runs."""
+
+    def __init__(self, acc_number: str, api_key: str, tariff_ids: str, label: str = None,
+                 export_tariff_ids: str = ""):
+        self.acc_number = acc_number
+        self.api_key = api_key
+        self.tariff_ids = tariff_ids
+        self.export_tariff_ids = export_tariff_ids
+        self.label = label or acc_number  # Shown in notifications when running several accounts
+        self.query_service = None
+        self.tariffs = []
+        self.export_tariffs = []
+        self.device_id = None  # The meter's device ID once we've seen it, so later runs can batch queries
+        self.outcome = None  # One line summary of the last run
+        self.result = None  # The last comparison's costs, see compare_and_switch
+        self.finished_at = None  # When the last run finished, as epoch seconds
+        self.running_totals = None  # Today's costs so far, so each run only prices the new readings
@@ -0,0 +1,97 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from account_info import Account
+from async_pricing import prewarm_regions
+from cache import get_cache
+from main import poll_intraday, run_tariff_compare
+from metrics import metrics, span
+from notification import send_notification, send_batch_notification, set_notification_label
+from tariff import get_registry
+
+accounts = []
+
+
+def load_accounts(path: str):
+    """Read the accounts to run from a JSON list of {"acc_number", "api_key", "tariffs", "label", "export_tariffs"}
+    objects."""
+    with open(path) as file:
+        entries = json.load(file)
+
+    loaded = []
+    for entry in entries:
+        if not entry.get("acc_number") or not entry.get("api_key"):
+            raise ValueError(f"Each account in {path} needs an acc_number and api_key")
+        loaded.append(Account(entry["acc_number"], entry["api_key"], entry.get("tariffs", config.TARIFFS),
+                              entry.get("label"), entry.get("export_tariffs", config.EXPORT_TARIFFS)))
+    return loaded
+
+
+def run_account(account: Account):
+    set_notification_label(account.label)
+    started = time.monotonic()
+    try:
+        succeeded = run_tariff_compare(account, standalone=False)
+    finally:
+        set_notification_label(None)
+    return succeeded, time.monotonic() - started
+
+
+def run_all_accounts(only=None) -> bool:
+    """Run the comparison for every account in ACCOUNTS_FILE, several at once, then send a summary of the results.
+
+    Each account keeps its own login, tariffs and state. They share the HTTP connection pool, the API rate limit
+    and the rate cache, so public product and rate lookups for the same region are only fetched once.
+    `only` limits the run to the given account numbers.
+    """
+    global accounts
+    if not accounts:
+        accounts = load_accounts(config.ACCOUNTS_FILE)
+    selected = [account for account in accounts if only is None or account.acc_number in only]
+
+    metrics.start_run()
+    if config.PREWARM_REGIONS:
+        # The accounts' regions aren't known until they're queried, so fetch every region up front
+        tariff_ids = {tariff_id.strip().lower() for account in selected for tariff_id in account.tariff_ids.split(",")}
+        with span("prewarm"):
+            prewarm_regions([tariff for tariff in get_registry().tariffs if tariff.id in tariff_ids])
+
+    with ThreadPoolExecutor(max_workers=config.ACCOUNT_CONCURRENCY) as executor:
+        results = list(executor.map(run_account, selected))
+    all_succeeded = all(succeeded for succeeded, _ in results)
+    metrics.finish_run(all_succeeded)
+
+    summary = f"Results for {len(selected)} accounts:\n"
+    for account, (succeeded, duration) in zip(selected, results):
+        status = account.outcome if succeeded else f"FAILED: {account.outcome or 'unknown error'}"
+        summary += f"{account.label}: {status} ({duration:.1f}s)\n"
+    send_notification(summary)
+
+    cache = get_cache()
+    if cache is not None:
+        print(cache.stats())
+    if config.BATCH_NOTIFICATIONS:
+        send_batch_notification()
+    return all_succeeded
+
+
+def poll_account(account: Account):
+    set_notification_label(account.label)
+    try:
+        poll_intraday(account)
+    except Exception as e:
+        print(f"Checking today's usage so far for {account.label} failed. {e}")
+    finally:
+        set_notification_label(None)
+
+
+def poll_all_accounts():
+    """Bring every account's running totals for today up to date, several at once."""
+    global accounts
+    if not accounts:
+        accounts = load_accounts(config.ACCOUNTS_FILE)
+
+    with ThreadPoolExecutor(max_workers=config.ACCOUNT_CONCURRENCY) as executor:
+        list(executor.map(poll_account, accounts))
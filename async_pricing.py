@@ -0,0 +1,220 @@
+import asyncio
+import atexit
+import json
+import threading
+import time
+from datetime import date
+from typing import TYPE_CHECKING
+
+import config
+from cache import CATALOGUE_TTL, get_cache, ttl_for
+from consumption_store import day_bounds
+from cost_engine import RateSchedule, parse_night_hours
+from products import (ProductCatalogue, cached_catalogue, catalogue_url, store_catalogue, unit_rates_range_url,
+                      unit_rates_url)
+from metrics import metrics, span
+from query_service import rate_limiter, rest_endpoint_name, retry_delay
+from rate_store import REGIONS, SingleFlight, rate_store
+
+if TYPE_CHECKING:
+    import aiohttp  # Imported where a session is opened, so loading this module doesn't pay for it
+
+
+# Concurrent requests for the same URL share one fetch
+url_flight = SingleFlight()
+# When Economy 7 meters charge the night rate, as seconds after midnight UTC
+NIGHT_WINDOW = parse_night_hours(config.NIGHT_HOURS)
+# How long an idle pooled connection is kept open for the next run or poll
+KEEPALIVE_TIMEOUT = 300
+
+# One event loop for the whole process, running in the background, so the HTTP session and its pooled
+# connections outlive each comparison instead of being opened and closed every time
+_loop = None
+_loop_lock = threading.Lock()
+_session = None
+
+
+def run_async(coroutine):
+    """Run a coroutine on the process's pricing event loop and wait for its result. Safe to call from any thread
+    other than the loop's own."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="pricing-loop", daemon=True).start()
+            atexit.register(close_session)
+    return asyncio.run_coroutine_threadsafe(coroutine, _loop).result()
+
+
+async def get_session() -> "aiohttp.ClientSession":
+    """Return the shared session, opening it on first use. Only call on the pricing event loop."""
+    global _session
+    if _session is None or _session.closed:
+        import aiohttp
+        _session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60),
+                                         connector=aiohttp.TCPConnector(keepalive_timeout=KEEPALIVE_TIMEOUT))
+    return _session
+
+
+def close_session():
+    if _session is not None and not _session.closed:
+        asyncio.run_coroutine_threadsafe(_session.close(), _loop).result(timeout=5)
+
+
+async def fetch_json(session: "aiohttp.ClientSession", semaphore: asyncio.Semaphore, url: str):
+    cache = get_cache()
+    if cache is not None:
+        data = cache.get(url)
+        if data is not None:
+            return data
+
+    async def fetch():
+        # Retried by the same policy as HttpClient.request
+        import aiohttp
+        endpoint = rest_endpoint_name(url)
+        attempt = 0
+        while True:
+            response = None
+            error = None
+            async with semaphore:
+                if rate_limiter is not None:
+                    await asyncio.sleep(rate_limiter.reserve())
+                started = time.monotonic()
+                try:
+                    async with session.get(url) as response:
+                        body = await response.read()
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = e
+                    response = None
+            if response is not None:
+                metrics.record_request(endpoint, time.monotonic() - started, response.status, len(body))
+                if response.ok:
+                    return json.loads(body)
+            else:
+                metrics.record_request(endpoint, time.monotonic() - started, type(error).__name__)
+
+            delay = retry_delay(endpoint, attempt, response.status if response is not None else None, response, error)
+            if delay is None:
+                if error is not None:
+                    raise error
+                raise Exception(f"ERROR: rest_query failed querying `{url}` with {response.status}")
+
+            attempt += 1
+            # Sleep without holding a slot, so other requests carry on meanwhile
+            await asyncio.sleep(delay)
+
+    data = await url_flight.do(url, fetch)
+    if cache is not None:
+        cache.set(url, data, ttl_for(url))
+    return data
+
+
+async def fetch_paged(session: "aiohttp.ClientSession", semaphore: asyncio.Semaphore, url: str):
+    results = []
+    while url:
+        page = await fetch_json(session, semaphore, url)
+        results.extend(page.get('results', []))
+        url = page.get('next')
+    return results
+
+
+async def fetch_catalogue(session: "aiohttp.ClientSession", semaphore: asyncio.Semaphore) -> ProductCatalogue:
+    catalogue = cached_catalogue()
+    if catalogue is None:
+        products = await fetch_paged(session, semaphore, catalogue_url(config.BASE_URL))
+        catalogue = store_catalogue(products, CATALOGUE_TTL)
+    return catalogue
+
+
+def load_catalogue() -> ProductCatalogue:
+    """Return the products catalogue index, fetching it if it isn't cached."""
+    async def fetch():
+        return await fetch_catalogue(await get_session(), asyncio.Semaphore(config.PRICING_CONCURRENCY))
+
+    return cached_catalogue() or run_async(fetch())
+
+
+async def fetch_tariff_rates(session, semaphore, catalogue: ProductCatalogue, tariff, region_code, day: date,
+                             dual_register: bool = False):
+    """Fetch a tariff's standing charge, unit rates and product code for a region and day.
+
+    With `dual_register`, a product that has an Economy 7 version is priced on its day and night rates,
+    combined into one schedule using NIGHT_HOURS. Products without one use their standard rates.
+    """
+    product_code, product_link = catalogue.find_product(tariff.api_display_name, tariff.direction)
+
+    async def fetch():
+        if not catalogue.has_details(product_code):
+            catalogue.add_details(product_code, await fetch_json(session, semaphore, product_link))
+        dual_region_tariff = catalogue.dual_region_tariff(product_code, region_code) if dual_register else None
+        if dual_region_tariff is not None:
+            standing_charge_inc_vat, day_rates_link, night_rates_link = dual_region_tariff
+            day_rates, night_rates = await asyncio.gather(
+                fetch_paged(session, semaphore, unit_rates_url(day_rates_link, day)),
+                fetch_paged(session, semaphore, unit_rates_url(night_rates_link, day)))
+            start, end = day_bounds(day)
+            schedule = RateSchedule.time_of_use(RateSchedule.from_api(day_rates), RateSchedule.from_api(night_rates),
+                                                *NIGHT_WINDOW, start, end)
+            return standing_charge_inc_vat, schedule, product_code
+
+        standing_charge_inc_vat, unit_rates_link = catalogue.region_tariff(product_code, region_code)
+        unit_rates = await fetch_paged(session, semaphore, unit_rates_url(unit_rates_link, day))
+        # Parsed once here, so every account pricing against these rates shares the schedule
+        return standing_charge_inc_vat, RateSchedule.from_api(unit_rates), product_code
+
+    # Dual-register rates are kept apart from the same product's single-register ones
+    key = (product_code, region_code, day, 2) if dual_register else (product_code, region_code, day)
+    with span("rates", tariff=tariff.id, region=region_code):
+        return await rate_store.get_or_fetch(key, fetch)
+
+
+async def fetch_rates(tariffs, regions, day: date, dual_register: bool = False):
+    """Fetch every tariff in every region, returning a dict keyed by (tariff, region). Runs on the pricing
+    event loop, see run_async."""
+    keys = [(tariff, region_code) for region_code in regions for tariff in tariffs]
+    semaphore = asyncio.Semaphore(config.PRICING_CONCURRENCY)
+    session = await get_session()
+
+    try:
+        catalogue = await fetch_catalogue(session, semaphore)
+    except Exception as e:
+        return {key: e for key in keys}
+
+    results = await asyncio.gather(
+        *(fetch_tariff_rates(session, semaphore, catalogue, tariff, region_code, day, dual_register)
+          for tariff, region_code in keys),
+        return_exceptions=True)
+
+    return dict(zip(keys, results))
+
+
+async def fetch_rate_range(session, semaphore, catalogue: ProductCatalogue, tariff, region_code, start: date, end: date):
+    """Fetch a tariff's standing charge and its unit rates for every day from `start` to `end` in a region.
+
+    The unit rates are returned as the API's raw results, so they can be parsed wherever they're priced.
+    """
+    product_code, product_link = catalogue.find_product(tariff.api_display_name, tariff.direction)
+    if not catalogue.has_details(product_code):
+        catalogue.add_details(product_code, await fetch_json(session, semaphore, product_link))
+    standing_charge_inc_vat, unit_rates_link = catalogue.region_tariff(product_code, region_code)
+
+    with span("rates", tariff=tariff.id, region=region_code):
+        return standing_charge_inc_vat, await fetch_paged(session, semaphore,
+                                                          unit_rates_range_url(unit_rates_link, start, end))
+
+
+def get_all_tariff_rates(tariffs, region_code, day: date = None, dual_register: bool = False):
+    """Fetch the standing charge, unit rates and product code of every tariff concurrently.
+
+    Returns a dict keyed by tariff. A tariff that couldn't be priced maps to the exception
+    raised while fetching it, so one failure doesn't stop the others.
+    """
+    results = run_async(fetch_rates(tariffs, [region_code], day or date.today(), dual_register))
+    return {tariff: result for (tariff, _), result in results.items()}
+
+
+def prewarm_regions(tariffs, day: date = None):
+    """Fetch the rates of every tariff in all 14 regions in one go, so accounts find them already in the rate store."""
+    results = run_async(fetch_rates(tariffs, REGIONS, day or date.today()))
+    failed = sum(isinstance(result, Exception) for result in results.values())
+    print(f"Pre-warmed {len(results) - failed} of {len(results)} tariff rates across {len(REGIONS)} regions")
@@ -0,0 +1,143 @@
+"""Replay the min-max decision over a range of past days for every supported tariff.
+
+Run from the repository root with the usual environment variables set:
+    python backtest.py --days 90
+    python backtest.py --start 2024-01-01 --end 2024-03-31 --tariffs go,agile,flexible
+"""
+import argparse
+from datetime import date, timedelta
+
+import config
+import main
+from account_info import Account, AccountInfo
+from async_pricing import get_all_tariff_rates, load_catalogue
+from cost_engine import calculate_costs
+from query_service import QueryService
+from tariff import get_registry
+
+# Same buffer compare_and_switch uses before it decides a switch is worth it
+SWITCH_THRESHOLD = 2
+
+
+class BacktestResult:
+    def __init__(self, start_date: date, end_date: date, starting_tariff):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.starting_tariff = starting_tariff
+        self.days_priced = 0
+        self.days_skipped = 0
+        self.minmax_cost = 0.0  # pence
+        self.baseline_costs = {}  # key: Tariff, value: total cost in pence had we stayed on it
+        self.switches = []  # (day, from Tariff, to Tariff, saving in pence)
+
+    def summary(self) -> str:
+        summary = f"Backtest {self.start_date} to {self.end_date}: {self.days_priced} days priced"
+        if self.days_skipped:
+            summary += f", {self.days_skipped} skipped"
+        summary += f"\nMin-max cost starting on {self.starting_tariff.display_name}: £{self.minmax_cost / 100:.2f}\n"
+
+        for tariff, cost in sorted(self.baseline_costs.items(), key=lambda item: item[1]):
+            summary += f"Staying on {tariff.display_name}: £{cost / 100:.2f} " \
+                       f"(min-max saves £{(cost - self.minmax_cost) / 100:.2f})\n"
+
+        summary += f"{len(self.switches)} switches:\n"
+        for day, from_tariff, to_tariff, saving in self.switches:
+            summary += f"  {day}: {from_tariff.display_name} -> {to_tariff.display_name} (£{saving / 100:.2f})\n"
+        return summary
+
+
+def daterange(start_date: date, end_date: date):
+    day = start_date
+    while day <= end_date:
+        yield day
+        day += timedelta(days=1)
+
+
+def price_day(consumption, tariffs, account_info: AccountInfo, day: date):
+    """Price one day of consumption on every tariff. Only that day's rates are held in memory.
+
+    An Economy 7 meter is priced on each tariff's day and night rates where it has them.
+    """
+    costs = {}
+    all_tariff_rates = get_all_tariff_rates(tariffs, account_info.region_code, day, account_info.dual_register)
+    for tariff, tariff_rates in all_tariff_rates.items():
+        if isinstance(tariff_rates, Exception):
+            print(f"Error pricing {tariff.id} on {day}. {tariff_rates}")
+            continue
+        standing_charge, unit_rates, _ = tariff_rates
+        _, consumption_cost = calculate_costs(consumption, unit_rates)
+        costs[tariff] = consumption_cost + standing_charge
+    return costs
+
+
+def run_backtest(account: Account, start_date: date, end_date: date) -> BacktestResult:
+    account_info = main.get_acc_info(account, start_date)
+    current_tariff = account_info.current_tariff
+
+    tariffs = list(account.tariffs)
+    if current_tariff not in tariffs:
+        tariffs.append(current_tariff)
+
+    # Products that aren't in the catalogue can't be priced on any day, so leave them out rather than skip every day
+    catalogue = load_catalogue()
+    for tariff in list(tariffs):
+        try:
+            catalogue.find_product(tariff.api_display_name, tariff.direction)
+        except Exception as e:
+            print(f"Error finding product details for tariff: {tariff.id}. {e}")
+            tariffs.remove(tariff)
+
+    # Note the standing charge is today's, not the one in force on each past day
+    result = BacktestResult(start_date, end_date, current_tariff)
+    result.baseline_costs = {tariff: 0.0 for tariff in tariffs}
+
+    for day in daterange(start_date, end_date):
+        if day == start_date:
+            consumption = account_info.consumption
+        else:
+            consumption = main.get_consumption(account, account_info.device_id, day)
+
+        costs = price_day(consumption, tariffs, account_info, day) if consumption else {}
+        if current_tariff not in costs or len(costs) != len(tariffs):
+            print(f"Skipping {day}: missing consumption or rates")
+            result.days_skipped += 1
+            continue
+
+        for tariff, cost in costs.items():
+            result.baseline_costs[tariff] += cost
+
+        switchable_tariffs = {t: cost for t, cost in costs.items() if t.switchable}
+        cheapest_tariff = min(switchable_tariffs, key=switchable_tariffs.get, default=current_tariff)
+        savings = costs[current_tariff] - costs[cheapest_tariff]
+
+        if cheapest_tariff != current_tariff and savings > SWITCH_THRESHOLD:
+            result.switches.append((day, current_tariff, cheapest_tariff, savings))
+            current_tariff = cheapest_tariff
+
+        result.minmax_cost += costs[current_tariff]
+        result.days_priced += 1
+
+    return result
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replay the min-max tariff decision over past days.")
+    parser.add_argument("--days", type=int, default=90, help="Number of days to replay, ending yesterday")
+    parser.add_argument("--start", type=date.fromisoformat, help="First day to replay (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last day to replay (YYYY-MM-DD)")
+    parser.add_argument("--tariffs", default=",".join(tariff.id for tariff in get_registry().tariffs
+                                                      if tariff.direction == "IMPORT"),
+                        help="Comma-separated tariff IDs to compare. Defaults to every built in tariff and any in "
+                             "TARIFFS_FILE")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    end_date = args.end or date.today() - timedelta(days=1)
+    start_date = args.start or end_date - timedelta(days=args.days - 1)
+
+    account = main.get_default_account()
+    account.query_service = QueryService(account.api_key, config.BASE_URL, main.http_client)
+    main.load_tariffs_from_ids(account, args.tariffs)
+    print(run_backtest(account, start_date, end_date).summary())
@@ -0,0 +1,111 @@
+"""Micro-benchmark for the cost engine against the original linear-scan implementation.
+
+Run from the repository root:
+    python benchmarks/bench_cost_engine.py --days 1 30 365 --tariffs 4
+
+`engine` includes parsing the rates, `priced` reuses an already parsed RateSchedule as the bot does with
+rates from the rate store. The legacy implementation is only timed up to --legacy-max-days as it's quadratic.
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from consumption_store import Readings  # noqa: E402
+from cost_engine import RateSchedule, calculate_costs  # noqa: E402
+
+
+def legacy_calculate_potential_costs(consumption_data, rate_data):
+    """The original `main.calculate_potential_costs`, kept here as the reference."""
+    period_costs = []
+    for consumption in consumption_data:
+        read_time = consumption['readAt'].replace('+00:00', 'Z')
+        matching_rate = next(
+            rate for rate in rate_data
+            if rate['valid_from'] <= read_time <= (rate.get('valid_to') or "9999-12-31T23:59:59Z")
+            and rate['payment_method'] in [None, "DIRECT_DEBIT"]
+        )
+
+        consumption_kwh = float(consumption['consumptionDelta']) / 1000
+        cost = float("{:.4f}".format(consumption_kwh * matching_rate['value_inc_vat']))
+
+        period_costs.append({
+            'period_end': read_time,
+            'consumption_kwh': consumption_kwh,
+            'rate': matching_rate['value_inc_vat'],
+            'calculated_cost': cost,
+        })
+    return period_costs
+
+
+def _iso(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def make_fixture(days, seed=0):
+    """Build `days` of half-hourly telemetry and Agile-style rates, newest rate first like the API."""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    periods = days * 48
+
+    consumption = [{
+        'readAt': (start + timedelta(minutes=30 * (i + 1))).isoformat(),
+        'consumptionDelta': f"{rng.uniform(0, 1500):.1f}",
+        'costDeltaWithTax': None,
+    } for i in range(periods)]
+
+    rates = [{
+        'value_exc_vat': 0,
+        'value_inc_vat': round(rng.uniform(-5, 45), 4),
+        'valid_from': _iso(start + timedelta(minutes=30 * i)),
+        'valid_to': _iso(start + timedelta(minutes=30 * (i + 1))),
+        'payment_method': None,
+    } for i in reversed(range(periods + 1))]
+
+    return consumption, rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, nargs="+", default=[1, 30, 365])
+    parser.add_argument("--tariffs", type=int, default=4, help="Number of tariffs priced per run")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--legacy-max-days", type=int, default=30)
+    args = parser.parse_args()
+
+    print(f"{'days':>6} {'legacy (s)':>12} {'engine (s)':>12} {'priced (s)':>12} {'readings/s':>12} {'speed-up':>10}")
+    for days in args.days:
+        consumption, rates = make_fixture(days)
+        readings = Readings.from_telemetry(consumption)
+        schedule = RateSchedule.from_api(rates)
+
+        engine = min(timeit.repeat(
+            lambda: [calculate_costs(readings, rates) for _ in range(args.tariffs)],
+            number=1, repeat=args.repeat))
+        priced = min(timeit.repeat(
+            lambda: [calculate_costs(readings, schedule) for _ in range(args.tariffs)],
+            number=1, repeat=args.repeat))
+        throughput = len(readings) * args.tariffs / priced
+
+        if days > args.legacy_max_days:
+            print(f"{days:>6} {'-':>12} {engine:>12.4f} {priced:>12.4f} {throughput:>12,.0f} {'-':>10}")
+            continue
+
+        legacy_total = sum(p['calculated_cost'] for p in legacy_calculate_potential_costs(consumption, rates))
+        _, engine_total = calculate_costs(readings, schedule)
+        if legacy_total != engine_total:
+            raise SystemExit(f"Totals differ for {days} days: {legacy_total} != {engine_total}")
+
+        legacy = min(timeit.repeat(
+            lambda: [legacy_calculate_potential_costs(consumption, rates) for _ in range(args.tariffs)],
+            number=1, repeat=args.repeat))
+        print(f"{days:>6} {legacy:>12.4f} {engine:>12.4f} {priced:>12.4f} {throughput:>12,.0f} "
+              f"{legacy / engine:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""End-to-end benchmark of `run_tariff_compare` against the fake Octopus API.
+
+Run from the repository root:
+    python benchmarks/bench_end_to_end.py --runs 5 --latency 0.05
+    python benchmarks/bench_end_to_end.py --error-rate 0.1 --switch
+    python benchmarks/bench_end_to_end.py --export-tariffs agile-outgoing,outgoing --dual-register
+
+The first run starts cold. Later runs reuse whatever the bot keeps between runs (the token, the device ID,
+the response cache and the stored readings), so they show the steady state of a long running container.
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fake_octopus import FakeOctopus  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the fake API adds to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of API requests that fail")
+    parser.add_argument("--tariffs", default="go,agile,flexible,cosy")
+    parser.add_argument("--export-tariffs", default="",
+                        help="Give the account an export meter on the first of these, and compare them all")
+    parser.add_argument("--dual-register", action="store_true", help="An Economy 7 import meter")
+    parser.add_argument("--switch", action="store_true", help="Go through with the switch instead of a dry run")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot's own output")
+    args = parser.parse_args()
+
+    export_tariffs = [tariff_id for tariff_id in args.export_tariffs.split(",") if tariff_id]
+    fake = FakeOctopus(latency=args.latency, error_rate=args.error_rate, dual_register=args.dual_register,
+                       export_tariff=export_tariffs[0] if export_tariffs else None).start()
+
+    # config reads the environment on import, so set it up before importing the bot
+    os.environ.update({
+        "BASE_URL": fake.base_url,
+        "ACC_NUMBER": "A-BENCH",
+        "API_KEY": "sk_bench",
+        "TARIFFS": args.tariffs,
+        "EXPORT_TARIFFS": args.export_tariffs,
+        "DRY_RUN": "false" if args.switch else "true",
+        "DATA_DIR": tempfile.mkdtemp(prefix="minmax-bench-"),
+        "NOTIFICATION_URLS": "",
+    })
+    import main as bot
+    bot.SWITCH_POLL_INITIAL = 0
+
+    print(f"{'run':>4} {'seconds':>9} {'calls':>6} {'errors':>7} {'result':>7}")
+    durations = []
+    for run in range(1, args.runs + 1):
+        calls, errors = fake.total_calls(), fake.errors
+        output = io.StringIO()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+            succeeded = bot.run_tariff_compare()
+        durations.append(time.perf_counter() - started)
+        print(f"{run:>4} {durations[-1]:>9.3f} {fake.total_calls() - calls:>6} {fake.errors - errors:>7} "
+              f"{'ok' if succeeded else 'failed':>7}")
+
+    print(f"\nCold run {durations[0]:.3f}s", end="")
+    if len(durations) > 1:
+        warm = sorted(durations[1:])
+        print(f", warm median {warm[len(warm) // 2]:.3f}s", end="")
+    print(f", {fake.total_calls() / args.runs:.1f} API calls per run")
+    for name, count in sorted(fake.calls.items()):
+        print(f"  {name}: {count}")
+
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Benchmark of a tariff sweep against the fake Octopus API, first with an empty cache and then with the rates cached.
+
+Run from the repository root:
+    python benchmarks/bench_sweep.py --days 365 --workers 8
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fake_octopus import FakeOctopus  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--regions", default="ABCDEFGHJKLMNP")
+    parser.add_argument("--profiles", type=int, default=1, help="How many flat profiles to price")
+    parser.add_argument("--workers", type=int, help="Worker processes. Defaults to one per CPU")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the fake API adds to every response")
+    args = parser.parse_args()
+
+    fake = FakeOctopus(latency=args.latency).start()
+
+    # config reads the environment on import, so set it up before importing the bot
+    os.environ.update({
+        "BASE_URL": fake.base_url,
+        "DATA_DIR": tempfile.mkdtemp(prefix="minmax-bench-"),
+        "NOTIFICATION_URLS": "",
+    })
+    from forecast import LoadProfile
+    from sweep import run_sweep
+    from tariff import TARIFFS
+
+    end = date.today() - timedelta(days=1)
+    start = end - timedelta(days=args.days - 1)
+    regions = list(args.regions)
+    profiles = {f"flat {kwh} kWh": LoadProfile.flat(kwh * 1000) for kwh in range(4, 4 + 4 * args.profiles, 4)}
+
+    print(f"{'cache':>6} {'seconds':>9} {'calls':>6} {'costs/s':>10}")
+    for cache in ("cold", "warm"):
+        calls = fake.total_calls()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = run_sweep(TARIFFS, regions, start, end, profiles, args.workers)
+        duration = time.perf_counter() - started
+        print(f"{cache:>6} {duration:>9.3f} {fake.total_calls() - calls:>6} {len(result.costs) / duration:>10.0f}")
+
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""A local stand-in for the Octopus API, for benchmarking without touching the live service.
+
+Serves the GraphQL operations and REST endpoints the bot uses with generated but deterministic data,
+counts every call, and can add latency and fail a fraction of requests. Run it on its own with:
+    python benchmarks/fake_octopus.py --port 8770 --latency 0.05 --error-rate 0.1
+then point the bot at it with BASE_URL=http://127.0.0.1:8770/v1.
+"""
+import argparse
+import base64
+import functools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+REGIONS = "ABCDEFGHJKLMNP"
+PRODUCT_CODES = {
+    "go": "GO-VAR-22-10-14",
+    "agile": "AGILE-24-10-01",
+    "cosy": "COSY-22-12-08",
+    "flexible": "VAR-22-11-01",
+    # Not one of the bot's built in tariffs, so it has to be discovered from the catalogue
+    "intelligent-octopus-go": "INTELLI-VAR-24-10-29",
+}
+DISPLAY_NAMES = {
+    "go": "Octopus Go",
+    "agile": "Agile Octopus",
+    "cosy": "Cosy Octopus",
+    "flexible": "Flexible Octopus",
+    "intelligent-octopus-go": "Intelligent Octopus Go",
+}
+# Export products are in the catalogue too, but are never import tariffs
+EXPORT_PRODUCT_CODES = {
+    "outgoing": "OUTGOING-VAR-24-10-26",
+    "agile-outgoing": "AGILE-OUTGOING-19-05-13",
+}
+EXPORT_DISPLAY_NAMES = {
+    "outgoing": "Outgoing Octopus",
+    "agile-outgoing": "Agile Outgoing Octopus",
+}
+IMPORT_MPAN = "1000000000000"
+EXPORT_MPAN = "1000000000001"
+EXPORT_SERIAL = "21E0000001"
+
+
+def _iso(moment: datetime) -> str:
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _jwt(expires_at: float) -> str:
+    payload = base64.urlsafe_b64encode(json.dumps({"exp": int(expires_at)}).encode()).decode().rstrip("=")
+    return f"header.{payload}.signature"
+
+
+class FakeOctopus:
+    """The fake API's data and behaviour, shared by every request the server handles.
+
+    `latency` seconds are added to every response, and `error_rate` of requests fail with `error_status`.
+    """
+
+    def __init__(self, port: int = 0, latency: float = 0.0, error_rate: float = 0.0, error_status: int = 503,
+                 region: str = "C", current_tariff: str = "agile", seed: int = 0, dual_register: bool = False,
+                 export_tariff: str = None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.region = region
+        self.current_product = PRODUCT_CODES[current_tariff]
+        self.dual_register = dual_register  # An Economy 7 meter, with an E-2R- tariff code
+        self.export_product = EXPORT_PRODUCT_CODES[export_tariff] if export_tariff else None
+        self.calls = Counter()  # key: GraphQL operation name or REST endpoint
+        self.errors = 0
+        self._seed = seed
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+        handler = type("Handler", (_Handler,), {"fake": self})
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.server.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="fake-octopus", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def record(self, name: str) -> bool:
+        """Count a call and decide whether it should fail."""
+        with self._lock:
+            self.calls[name] += 1
+            failed = self._rng.random() < self.error_rate
+            if failed:
+                self.errors += 1
+        return failed
+
+    # GraphQL
+
+    def graphql(self, operation: str, variables: dict, query: str = "") -> dict:
+        if operation in ("ObtainKrakenToken", "RefreshKrakenToken"):
+            return {"obtainKrakenToken": {"token": _jwt(time.time() + 3600), "refreshToken": "refresh",
+                                          "refreshExpiresIn": int(time.time()) + 7 * 24 * 3600}}
+
+        data = {}
+        if operation in ("Account", "AccountWithConsumption", "Agreements"):
+            data["account"] = self.account(query)
+        if operation in ("Consumption", "AccountWithConsumption"):
+            data["smartMeterTelemetry"] = self.telemetry(variables["start"], variables["end"])
+        if operation == "TermsVersion":
+            data["termsAndConditionsForProduct"] = {"name": "Terms", "version": "1.2"}
+        if operation == "AcceptTermsAndConditions":
+            data["acceptTermsAndConditions"] = {"acceptedVersion": "1.2"}
+        if operation == "StartOnboardingProcess":
+            data["startOnboardingProcess"] = {"productEnrolment": {"id": "enrolment-1"},
+                                              "onboardingProcess": {"id": "onboarding-1"}}
+        if operation == "ProductEnrolments":
+            data["productEnrolments"] = [{
+                "id": "enrolment-1", "status": "COMPLETED", "product": {"code": self.current_product},
+                "stages": [{"name": "Switch", "status": "COMPLETED", "steps": []}],
+            }]
+        return data
+
+    def account(self, query: str) -> dict:
+        """The account's agreements. Like the real API, an agreement's tariff only has fields if the query has a
+        fragment for its type: DayNightTariff for Economy 7, StandardTariff for fixed rate exports, otherwise
+        HalfHourlyTariff."""
+        def tariff(type_name: str, fields: dict) -> dict:
+            return fields if f"... on {type_name}" in query else {}
+
+        registers = 2 if self.dual_register else 1
+        import_fields = {"id": "1", "tariffCode": f"E-{registers}R-{self.current_product}-{self.region}",
+                         "standingCharge": 45.0, "productCode": self.current_product}
+        agreements = [{
+            "validFrom": f"{date.today()}T00:00:00+00:00",
+            "validTo": None,
+            "meterPoint": {"direction": "IMPORT", "mpan": IMPORT_MPAN,
+                           "meters": [{"serialNumber": "21L0000001",
+                                       "smartDevices": [{"deviceId": "00-00-00-00-00-00-00-00"}]}]},
+            "tariff": (tariff("DayNightTariff", {**import_fields, "dayRate": 30.0, "nightRate": 15.0})
+                       if self.dual_register else tariff("HalfHourlyTariff", import_fields)),
+        }]
+        if self.export_product:
+            export_fields = {"id": "2", "tariffCode": f"E-1R-{self.export_product}-{self.region}",
+                             "standingCharge": 0.0, "productCode": self.export_product}
+            agreements.append({
+                "validFrom": f"{date.today()}T00:00:00+00:00",
+                "validTo": None,
+                "meterPoint": {"direction": "EXPORT", "mpan": EXPORT_MPAN,
+                               "meters": [{"serialNumber": EXPORT_SERIAL, "smartDevices": []}]},
+                "tariff": (tariff("HalfHourlyTariff", export_fields) if "AGILE" in self.export_product
+                           else tariff("StandardTariff", {**export_fields, "unitRate": 15.0})),
+            })
+        return {"electricityAgreements": agreements}
+
+    def telemetry(self, start: str, end: str) -> list:
+        start_time = datetime.fromisoformat(start.replace("Z", "+00:00"))
+        # Like a real meter, there are no readings for the future
+        end_time = min(datetime.fromisoformat(end.replace("Z", "+00:00")), datetime.now(timezone.utc))
+        readings = []
+        read_at = start_time
+        while read_at <= end_time:
+            rng = random.Random(f"{self._seed}{read_at}")
+            readings.append({"readAt": read_at.isoformat(), "consumptionDelta": f"{rng.uniform(0, 800):.1f}",
+                             "costDeltaWithTax": f"{rng.uniform(0, 20):.2f}"})
+            read_at += timedelta(minutes=30)
+        return readings
+
+    # REST
+
+    def products(self) -> dict:
+        products = [(code, DISPLAY_NAMES[tariff_id], "IMPORT") for tariff_id, code in PRODUCT_CODES.items()]
+        products += [(code, EXPORT_DISPLAY_NAMES[tariff_id], "EXPORT") for tariff_id, code in EXPORT_PRODUCT_CODES.items()]
+        return {"count": len(products), "next": None, "results": [{
+            "code": code,
+            "display_name": display_name,
+            "direction": direction,
+            "links": [{"rel": "self", "href": f"{self.base_url}/products/{code}/"}],
+        } for code, display_name, direction in products]}
+
+    def product(self, code: str) -> dict:
+        standing_charge = 40 + sum(map(ord, code)) % 20
+        details = {"code": code, "single_register_electricity_tariffs": {f"_{region}": {"direct_debit_monthly": {
+            "standing_charge_inc_vat": standing_charge,
+            "links": [{"rel": "standard_unit_rates",
+                       "href": f"{self.base_url}/products/{code}/electricity-tariffs/E-1R-{code}-{region}/"
+                               f"standard-unit-rates/"}],
+        }} for region in REGIONS}}
+        if code.startswith("VAR-"):
+            # Flexible also comes in an Economy 7 version, with day and night rates
+            details["dual_register_electricity_tariffs"] = {f"_{region}": {"direct_debit_monthly": {
+                "standing_charge_inc_vat": standing_charge,
+                "links": [{"rel": f"{kind}_unit_rates",
+                           "href": f"{self.base_url}/products/{code}/electricity-tariffs/E-2R-{code}-{region}/"
+                                   f"{kind}-unit-rates/"} for kind in ("day", "night")],
+            }} for region in REGIONS}
+        return details
+
+    @functools.lru_cache(maxsize=64)
+    def _rates(self, tariff_code: str, kind: str, first_day: str, last_day: str) -> list:
+        if kind != "standard":
+            # Economy 7 day and night rates are fixed, like Flexible's
+            return [{"value_inc_vat": 12.0 if kind == "night" else 27.0, "valid_from": "2024-01-01T00:00:00Z",
+                     "valid_to": None, "payment_method": "DIRECT_DEBIT"}]
+        if tariff_code.startswith("E-1R-VAR-"):
+            # Flexible has one open-ended rate per payment method
+            return [{"value_inc_vat": 24.5, "valid_from": "2024-01-01T00:00:00Z", "valid_to": None,
+                     "payment_method": "DIRECT_DEBIT"},
+                    {"value_inc_vat": 25.8, "valid_from": "2024-01-01T00:00:00Z", "valid_to": None,
+                     "payment_method": "NON_DIRECT_DEBIT"}]
+
+        # Half-hourly rates, newest first like the real API. Each day's rates are the same whatever
+        # period they're asked for in
+        results = []
+        day = datetime.fromisoformat(first_day).replace(tzinfo=timezone.utc)
+        while day.date() <= date.fromisoformat(last_day):
+            rng = random.Random(f"{self._seed}{tariff_code}{day.date()}")
+            results[:0] = [{"value_inc_vat": round(rng.uniform(5, 35), 3),
+                            "valid_from": _iso(day + timedelta(minutes=30 * i)),
+                            "valid_to": _iso(day + timedelta(minutes=30 * (i + 1))),
+                            "payment_method": None} for i in reversed(range(48))]
+            day += timedelta(days=1)
+        return results
+
+    def unit_rates(self, url: str, tariff_code: str, kind: str, query: dict) -> dict:
+        period_from = query.get("period_from", [f"{date.today()}T00:00:00Z"])[0]
+        period_to = query.get("period_to", [period_from])[0]
+        return self._paginate(url, query, self._rates(tariff_code, kind, period_from[:10], period_to[:10]))
+
+    def exports(self, url: str, query: dict) -> dict:
+        """Half-hourly exports from a few solar panels. Oldest first, as asked for with order_by=period.
+
+        Like the real consumption endpoint, it lags: there's nothing for today until tomorrow.
+        """
+        start = datetime.fromisoformat(query["period_from"][0].replace("Z", "+00:00"))
+        end = datetime.fromisoformat(query["period_to"][0].replace("Z", "+00:00"))
+        reported_to = datetime.combine(date.today(), datetime.min.time(), timezone.utc)
+        results = []
+        interval_start = start
+        while interval_start < end and interval_start + timedelta(minutes=30) <= reported_to:
+            rng = random.Random(f"{self._seed}export{interval_start}")
+            exported = rng.uniform(0, 1.5) if 9 <= interval_start.hour < 17 else 0.0
+            results.append({"consumption": round(exported, 3), "interval_start": _iso(interval_start),
+                            "interval_end": _iso(interval_start + timedelta(minutes=30))})
+            interval_start += timedelta(minutes=30)
+        return self._paginate(url, query, results)
+
+    def _paginate(self, url: str, query: dict, results: list) -> dict:
+        # Paginated like the real API, 100 results a page unless asked for up to 1500
+        page = int(query.get("page", ["1"])[0])
+        page_size = min(int(query.get("page_size", ["100"])[0]), 1500)
+        next_url = None
+        if page * page_size < len(results):
+            next_query = urlencode({**{key: values[0] for key, values in query.items()}, "page": page + 1})
+            next_url = f"{url}?{next_query}"
+        return {"count": len(results), "next": next_url,
+                "results": results[(page - 1) * page_size:page * page_size]}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake: FakeOctopus = None
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, body, status: int = 200):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _handle(self, name: str, respond):
+        failed = self.fake.record(name)
+        if self.fake.latency:
+            time.sleep(self.fake.latency)
+        if failed:
+            self._respond({"detail": "Injected error"}, self.fake.error_status)
+        else:
+            respond()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        operation = body.get("operationName") or "unknown"
+        variables = body.get("variables") or {}
+        self._handle(f"graphql:{operation}",
+                     lambda: self._respond({"data": self.fake.graphql(operation, variables, body.get("query", ""))}))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+
+        if path == "/v1/products/":
+            return self._handle("rest:products", lambda: self._respond(self.fake.products()))
+
+        match = re.fullmatch(r"/v1/products/([^/]+)/electricity-tariffs/([^/]+)/(standard|day|night)-unit-rates/", path)
+        if match:
+            return self._handle(f"rest:{match.group(3)}-unit-rates", lambda: self._respond(
+                self.fake.unit_rates(f"{self.fake.base_url[:-3]}{path}", match.group(2), match.group(3), query)))
+
+        if path == f"/v1/electricity-meter-points/{EXPORT_MPAN}/meters/{EXPORT_SERIAL}/consumption/":
+            if not self.headers.get("Authorization", "").startswith("Basic "):
+                return self._respond({"detail": "Authentication credentials were not provided."}, 401)
+            return self._handle("rest:consumption", lambda: self._respond(
+                self.fake.exports(f"{self.fake.base_url[:-3]}{path}", query)))
+
+        match = re.fullmatch(r"/v1/products/([^/]+)/", path)
+        if match:
+            return self._handle("rest:product", lambda: self._respond(self.fake.product(match.group(1))))
+
+        self._respond({"detail": "Not found."}, 404)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8770)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of the injected failures")
+    parser.add_argument("--tariff", default="agile", choices=sorted(PRODUCT_CODES), help="The account's current tariff")
+    parser.add_argument("--dual-register", action="store_true", help="Give the account an Economy 7 meter")
+    parser.add_argument("--export-tariff", choices=sorted(EXPORT_PRODUCT_CODES),
+                        help="Give the account an export meter on this tariff")
+    args = parser.parse_args()
+
+    fake = FakeOctopus(args.port, args.latency, args.error_rate, args.error_status, current_tariff=args.tariff,
+                       dual_register=args.dual_register, export_tariff=args.export_tariff)
+    print(f"Serving a fake Octopus API at {fake.base_url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print(dict(fake.calls))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs
+
+import config
+
+# Seconds to keep each kind of response. None means keep forever (until evicted for space).
+CATALOGUE_TTL = 6 * 60 * 60
+PRODUCT_TTL = 6 * 60 * 60
+CURRENT_RATES_TTL = 30 * 60
+
+
+def ttl_for(url: str):
+    """Work out how long a REST response can be cached for, based on what the URL points at.
+
+    Returns the TTL in seconds, None for responses that never change, or 0 if the response shouldn't be cached.
+    """
+    parsed = urlparse(url)
+    path = parsed.path.rstrip('/')
+
+    if path.endswith('/products'):
+        return CATALOGUE_TTL
+
+    if path.endswith('-unit-rates') or path.endswith('/standing-charges'):
+        # Rates for a period that has already ended are never revised
+        period_to = parse_qs(parsed.query).get('period_to')
+        if period_to:
+            end = datetime.fromisoformat(period_to[0].replace('Z', '+00:00'))
+            if end < datetime.now(timezone.utc):
+                return None
+        return CURRENT_RATES_TTL
+
+    if '/products/' in path:
+        return PRODUCT_TTL
+
+    return 0
+
+
+class ResponseCache:
+    """SQLite backed cache of JSON responses keyed by URL, with per-entry expiry and LRU eviction."""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Every hit updates last_used, so don't wait for the disk on each commit. WAL keeps the cache consistent
+        # through a crash, at worst losing the last few updates
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            body TEXT NOT NULL,
+            expires_at REAL,
+            last_used REAL NOT NULL
+        )""")
+        self._conn.commit()
+
+    def get(self, url: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body FROM responses WHERE url = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (url, now)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE url = ?", (now, url))
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, url: str, data, ttl):
+        if ttl == 0:
+            return
+
+        now = time.time()
+        expires_at = None if ttl is None else now + ttl
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (url, body, expires_at, last_used) VALUES (?, ?, ?, ?)",
+                (url, json.dumps(data), expires_at, now))
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float):
+        self._conn.execute("DELETE FROM responses WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        self._conn.execute("""DELETE FROM responses WHERE url IN (
+            SELECT url FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+        )""", (self.max_entries,))
+
+    def stats(self) -> str:
+        return f"Cache: {self.hits} hits, {self.misses} misses"
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the shared response cache, or None if caching is disabled."""
+    global _cache
+    with _cache_lock:
+        if _cache is None and config.CACHE_ENABLED:
+            _cache = ResponseCache(os.path.join(config.DATA_DIR, "cache.sqlite"), config.CACHE_MAX_ENTRIES)
+    return _cache
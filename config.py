@@ -17,9 +17,61 @@ EXECUTION_TIME = os.getenv("EXECUTION_TIME", "23:00")
 
 # List of tariff IDs to compare
 TARIFFS = os.getenv("TARIFFS", "go,agile,flexible")
+# JSON file of tariffs to add to or change the built in ones, see TariffRegistry.load_overrides
+TARIFFS_FILE = os.getenv("TARIFFS_FILE", "")
+# List of export tariff IDs to price exported electricity on. Empty means don't price exports
+EXPORT_TARIFFS = os.getenv("EXPORT_TARIFFS", "")
+# When an Economy 7 (dual register) meter charges the night rate, in UTC
+NIGHT_HOURS = os.getenv("NIGHT_HOURS", "00:30-07:30")
 
 # Whether to just run immediately and exit
 ONE_OFF_RUN = os.getenv("ONE_OFF", "false") in ["true", "True", "1"]
 
 # Whether to notify the user of a switch but not actually switch
 DRY_RUN = os.getenv("DRY_RUN", "false") in ["true", "True", "1"]
+
+
+# Directory for files the bot keeps between runs, such as the response cache
+DATA_DIR = os.getenv("DATA_DIR", "data")
+
+# Whether to cache product and rate lookups on disk, and how many responses to keep
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true") in ["true", "True", "1"]
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "5000"))
+
+# How many tariff lookups to run against the API at the same time
+PRICING_CONCURRENCY = int(os.getenv("PRICING_CONCURRENCY", "4"))
+
+# Whether to save the API token in DATA_DIR so restarts can reuse it instead of logging in again
+PERSIST_TOKEN = os.getenv("PERSIST_TOKEN", "false") in ["true", "True", "1"]
+
+# Maximum requests per second to the Octopus API across all accounts. 0 means no limit
+API_RATE_LIMIT = float(os.getenv("API_RATE_LIMIT", "0"))
+
+# A JSON file listing several accounts to run, instead of ACC_NUMBER and API_KEY.
+# e.g. [{"acc_number": "A-1234", "api_key": "sk_live_...", "tariffs": "go,agile", "label": "Home"}]
+ACCOUNTS_FILE = os.getenv("ACCOUNTS_FILE", "")
+# How many accounts to run at the same time
+ACCOUNT_CONCURRENCY = int(os.getenv("ACCOUNT_CONCURRENCY", "4"))
+# Whether to fetch every tariff's rates for all 14 regions before running the accounts
+PREWARM_REGIONS = os.getenv("PREWARM_REGIONS", "false") in ["true", "True", "1"]
+
+# Port for the control API, to trigger a comparison and read the last results over HTTP. 0 means don't serve it
+CONTROL_PORT = int(os.getenv("CONTROL_PORT", "0"))
+# Address the control API listens on. Only this machine by default, use 0.0.0.0 to reach it from outside a container
+CONTROL_HOST = os.getenv("CONTROL_HOST", "127.0.0.1")
+# Bearer token POST /run and GET /result need. Without one the control API only listens on a loopback address
+CONTROL_TOKEN = os.getenv("CONTROL_TOKEN", "")
+
+# Minutes between checks of the day's usage so far, between the scheduled comparisons. 0 means don't check
+INTRADAY_POLL_MINUTES = int(os.getenv("INTRADAY_POLL_MINUTES", "0"))
+# Send an alert when another tariff is this many pence cheaper so far today. 0 means never alert
+INTRADAY_ALERT_MARGIN = float(os.getenv("INTRADAY_ALERT_MARGIN", "100"))
+
+# Days of history to build a consumption profile from, which is priced against tomorrow's rates when they're
+# published to help decide the switch. 0 means only look at today
+FORECAST_DAYS = int(os.getenv("FORECAST_DAYS", "0"))
+
+# Port to serve Prometheus metrics on at /metrics. 0 means don't serve them
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# File to append a JSON line to after every run, with the timing of each phase and the API calls made
+RUN_LOG = os.getenv("RUN_LOG", "")
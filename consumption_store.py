@@ -0,0 +1,149 @@
+import os
+import sqlite3
+import threading
+import time as clock
+from array import array
+from datetime import date, datetime, time, timedelta, timezone
+
+import config
+from cost_engine import to_epoch
+
+# Smart meters report half-hourly, so the next reading is due this long after the last one
+INTERVAL = 30 * 60
+
+
+def day_bounds(day: date):
+    """Return the epoch seconds of the start of `day` (UTC) and of the next day."""
+    start = datetime.combine(day, time(), timezone.utc)
+    return start.timestamp(), (start + timedelta(days=1)).timestamp()
+
+
+class Readings:
+    """Half-hourly readings held as parallel typed columns, sorted by time.
+
+    `read_at` is in epoch seconds, `consumption_wh` in watt-hours and `cost` in pence (0 if Octopus didn't price it).
+    """
+
+    def __init__(self, read_at=None, consumption_wh=None, cost=None):
+        self.read_at = read_at if read_at is not None else array('d')
+        self.consumption_wh = consumption_wh if consumption_wh is not None else array('d')
+        self.cost = cost if cost is not None else array('d')
+
+    @classmethod
+    def from_telemetry(cls, telemetry):
+        """Build from the `smartMeterTelemetry` entries returned by the API."""
+        parsed = sorted((to_epoch(entry['readAt']), float(entry['consumptionDelta']), float(entry['costDeltaWithTax'] or 0))
+                        for entry in telemetry)
+        return cls(array('d', (reading[0] for reading in parsed)),
+                   array('d', (reading[1] for reading in parsed)),
+                   array('d', (reading[2] for reading in parsed)))
+
+    @classmethod
+    def from_consumption(cls, results):
+        """Build from the `results` of a meter's REST consumption endpoint, which are in kWh and unpriced."""
+        parsed = sorted((to_epoch(entry['interval_start']), float(entry['consumption']) * 1000) for entry in results)
+        return cls(array('d', (reading[0] for reading in parsed)),
+                   array('d', (reading[1] for reading in parsed)),
+                   array('d', [0.0]) * len(parsed))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build from the columns saved by `as_dict`."""
+        return cls(array('d', data['read_at']), array('d', data['consumption_wh']), array('d', data['cost']))
+
+    def as_dict(self) -> dict:
+        return {"read_at": list(self.read_at), "consumption_wh": list(self.consumption_wh), "cost": list(self.cost)}
+
+    def __len__(self):
+        return len(self.read_at)
+
+    def total_wh(self) -> float:
+        return sum(self.consumption_wh)
+
+    def total_cost(self) -> float:
+        return sum(self.cost)
+
+
+class ConsumptionStore:
+    """Append-only SQLite store of half-hourly readings per meter, so each interval is only fetched once.
+
+    Only readings for half hours that have ended are stored, since the meter reports the one in progress with
+    what it has used so far.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS readings (
+            device_id TEXT NOT NULL,
+            read_at REAL NOT NULL,
+            consumption_wh REAL NOT NULL,
+            cost REAL NOT NULL,
+            PRIMARY KEY (device_id, read_at)
+        ) WITHOUT ROWID""")
+        self._conn.commit()
+
+    def missing_from(self, device_id: str, day: date):
+        """Return the epoch seconds of the first half hour of `day` that isn't stored, or None if it's all stored.
+
+        Fetching from there fills any gap the meter reported late, as well as the readings since.
+        """
+        start, end = day_bounds(day)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT read_at FROM readings WHERE device_id = ? AND read_at >= ? AND read_at < ? ORDER BY read_at",
+                (device_id, start, end)).fetchall()
+        next_reading = start
+        for read_at, in rows:
+            if read_at > next_reading:
+                break
+            next_reading = read_at + INTERVAL
+        return next_reading if next_reading < end else None
+
+    def append(self, device_id: str, readings: Readings):
+        # Readings of finished half hours never change, so keep the first copy of each. The half hour in progress
+        # is left out, to be fetched again once it's over.
+        finished_before = clock.time() - INTERVAL
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO readings (device_id, read_at, consumption_wh, cost) VALUES (?, ?, ?, ?)",
+                ((device_id, read_at, wh, cost)
+                 for read_at, wh, cost in zip(readings.read_at, readings.consumption_wh, readings.cost)
+                 if read_at <= finished_before))
+            self._conn.commit()
+
+    def readings(self, device_id: str, start: float, end: float) -> Readings:
+        """Return the stored readings in [start, end)."""
+        readings = Readings()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT read_at, consumption_wh, cost FROM readings "
+                "WHERE device_id = ? AND read_at >= ? AND read_at < ? ORDER BY read_at",
+                (device_id, start, end))
+            for read_at, wh, cost in rows:
+                readings.read_at.append(read_at)
+                readings.consumption_wh.append(wh)
+                readings.cost.append(cost)
+        return readings
+
+    def day_readings(self, device_id: str, day: date) -> Readings:
+        return self.readings(device_id, *day_bounds(day))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_consumption_store() -> ConsumptionStore:
+    """Return the shared consumption store."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ConsumptionStore(os.path.join(config.DATA_DIR, "consumption.sqlite"))
+    return _store
@@ -0,0 +1,194 @@
+import hmac
+import ipaddress
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from metrics import metrics
+
+
+class ComparisonRunning(Exception):
+    """Raised instead of waiting when a comparison is already running."""
+
+
+class Controller:
+    """Runs comparisons one at a time, whether they come from the schedule or the control API.
+
+    `run` runs the comparison and returns whether it succeeded. `get_accounts` returns the accounts it ran for,
+    whose last results are kept on them between runs.
+    """
+
+    def __init__(self, run, get_accounts):
+        self.run = run
+        self.get_accounts = get_accounts
+        self.started_at = time.time()
+        self.next_run = None  # When the next scheduled comparison is due, as a datetime
+        self.last_run = None  # {"trigger", "started", "finished", "succeeded"} of the last comparison
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    def run_comparison(self, trigger: str, wait: bool = True, run=None) -> bool:
+        """Run a comparison and return whether it succeeded. If one is already running, wait for it to finish
+        first, or with wait=False raise ComparisonRunning.
+
+        `run` replaces the usual comparison for this once, e.g. to only resume the accounts that were interrupted.
+        """
+        if not self._lock.acquire(blocking=wait):
+            raise ComparisonRunning()
+        return self._run_locked(trigger, run)
+
+    def _run_locked(self, trigger: str, run=None) -> bool:
+        """Run a comparison with the lock already held, releasing it when done."""
+        try:
+            started = time.time()
+            error = None
+            try:
+                succeeded = bool((run or self.run)())
+            except Exception as e:
+                print(f"Comparison from {trigger} failed. {e}")
+                succeeded = False
+                error = str(e)
+            self.last_run = {"trigger": trigger, "started": started, "finished": time.time(), "succeeded": succeeded,
+                             "error": error}
+            return succeeded
+        finally:
+            self._lock.release()
+
+    def run_poll(self, poll) -> bool:
+        """Run a check of today's usage so far, unless a comparison is running, in which case skip it."""
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            poll()
+        except Exception as e:
+            print(f"Checking today's usage so far failed. {e}")
+        finally:
+            self._lock.release()
+        return True
+
+    def trigger(self) -> bool:
+        """Start a comparison in the background. Returns False if one is already running."""
+        # Taken here and handed to the thread, so two requests at once can't both be told it started
+        if not self._lock.acquire(blocking=False):
+            return False
+        try:
+            threading.Thread(target=self._run_locked, args=("api",), name="api-run", daemon=True).start()
+        except BaseException:
+            self._lock.release()
+            raise
+        return True
+
+    def results(self) -> dict:
+        return {"last_run": self.last_run, "accounts": [{
+            "label": account.label,
+            "outcome": account.outcome,
+            "finished_at": account.finished_at,
+            "result": account.result,
+        } for account in self.get_accounts()]}
+
+    def health(self) -> dict:
+        return {
+            "status": "ok" if self.last_run is None or self.last_run["succeeded"] else "failing",
+            "running": self.running,
+            "uptime": round(time.time() - self.started_at),
+            "last_run": self.last_run,
+            "next_run": self.next_run.isoformat() if self.next_run else None,
+        }
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class _ControlHandler(BaseHTTPRequestHandler):
+    controller: Controller = None
+    token: str = ""  # When set, POST /run and GET /result need it as a bearer token
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, body, status: int = 200, content_type: str = "application/json"):
+        payload = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _authorized(self) -> bool:
+        """Check the request's bearer token, answering 401 if it's wrong."""
+        if not self.token:
+            return True
+        supplied = self.headers.get("Authorization", "")
+        if hmac.compare_digest(supplied.encode(), f"Bearer {self.token}".encode()):
+            return True
+        self._respond({"error": "Unauthorized"}, 401)
+        return False
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip("/")
+        if path == "/health":
+            self._respond(self.controller.health())
+        elif path == "/result":
+            if not self._authorized():
+                return
+            self._respond(self.controller.results())
+        elif path == "/metrics":
+            self._respond(metrics.prometheus(), content_type="text/plain; version=0.0.4")
+        else:
+            self._respond({"error": "Not found"}, 404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.rstrip("/") != "/run":
+            self._respond({"error": "Not found"}, 404)
+            return
+        if not self._authorized():
+            return
+
+        if parse_qs(url.query).get("wait", ["false"])[0] in ["true", "True", "1"]:
+            try:
+                succeeded = self.controller.run_comparison("api", wait=False)
+            except ComparisonRunning:
+                self._respond({"error": "A comparison is already running"}, 409)
+                return
+            if succeeded:
+                self._respond(self.controller.results())
+            else:
+                error = self.controller.last_run["error"] or "The comparison failed, see the accounts' outcomes"
+                self._respond({"error": error, **self.controller.results()}, 500)
+        elif self.controller.trigger():
+            self._respond({"status": "started"}, 202)
+        else:
+            self._respond({"error": "A comparison is already running"}, 409)
+
+
+def serve_control_api(controller: Controller, host: str, port: int, token: str = ""):
+    """Serve the control API in a background thread:
+
+    GET /health, GET /result (the last comparison's costs), GET /metrics,
+    POST /run to start a comparison (add ?wait=true to get its result in the response).
+
+    With a `token`, POST /run and GET /result need an `Authorization: Bearer <token>` header. Without one it only
+    listens on a loopback address, since anyone who can reach POST /run can switch the account's tariff.
+    Returns the server, or None if it refused to start.
+    """
+    if not token and not is_loopback(host):
+        print(f"Not serving the control API on {host}: set CONTROL_TOKEN to listen beyond this machine")
+        return None
+    handler = type("ControlHandler", (_ControlHandler,), {"controller": controller, "token": token})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="control-api", daemon=True).start()
+    print(f"Serving the control API on {host}:{port}")
+    return server
@@ -0,0 +1,154 @@
+from array import array
+from bisect import bisect_right
+from datetime import datetime, timezone
+
+# Flexible has no end time, so default to the end of time
+END_OF_TIME = datetime.fromisoformat("9999-12-31T23:59:59+00:00").timestamp()
+DAY = 24 * 60 * 60
+HALF_HOUR = 30 * 60
+
+
+def to_epoch(timestamp: str) -> float:
+    """Convert an ISO 8601 timestamp from the API (with a `Z` or offset suffix) to epoch seconds."""
+    if timestamp.endswith('Z'):
+        timestamp = timestamp[:-1] + '+00:00'
+    return datetime.fromisoformat(timestamp).timestamp()
+
+
+def parse_night_hours(hours: str):
+    """Parse a window like 00:30-07:30 into (start, end) seconds after midnight."""
+    start, end = (int(hour) * 3600 + int(minute) * 60
+                  for hour, minute in (time.strip().split(":") for time in hours.split("-")))
+    return start, end
+
+
+class RateInterval:
+    """One unit rate, parsed from the API with epoch second timestamps."""
+    __slots__ = ("valid_from", "valid_to", "value_inc_vat")
+
+    def __init__(self, valid_from: float, valid_to: float, value_inc_vat: float):
+        self.valid_from = valid_from
+        self.valid_to = valid_to
+        self.value_inc_vat = value_inc_vat
+
+    @classmethod
+    def from_api(cls, rate):
+        return cls(to_epoch(rate['valid_from']),
+                   to_epoch(rate['valid_to']) if rate.get('valid_to') else END_OF_TIME,
+                   float(rate['value_inc_vat']))
+
+
+class RateSchedule:
+    """Unit rates held in parallel arrays sorted by `valid_from`, for bisect lookups.
+
+    Lookups return exactly what a linear scan of the rates in their original API order would
+    return: the first rate whose inclusive [valid_from, valid_to] window contains the time.
+    """
+
+    def __init__(self, intervals):
+        rates = sorted((interval.valid_from, interval.valid_to, order, interval.value_inc_vat)
+                       for order, interval in enumerate(intervals))
+
+        self.starts = array('d', (rate[0] for rate in rates))
+        self.ends = array('d', (rate[1] for rate in rates))
+        self.order = array('l', (rate[2] for rate in rates))
+        self.values = array('d', (rate[3] for rate in rates))
+
+        # Running maximum of the end times, so a lookup knows when no earlier rate can still match
+        self.max_ends = array('d', self.ends)
+        for i in range(1, len(self.max_ends)):
+            self.max_ends[i] = max(self.max_ends[i - 1], self.max_ends[i])
+
+    @classmethod
+    def from_api(cls, rate_data):
+        """Parse the `results` of a unit rates response."""
+        # DIRECT_DEBIT is for flexible that has different price for direct debit or not
+        return cls(RateInterval.from_api(rate) for rate in rate_data
+                   if rate['payment_method'] in [None, "DIRECT_DEBIT"])
+
+    @classmethod
+    def time_of_use(cls, day_rates, night_rates, night_start: float, night_end: float, start: float, end: float):
+        """Combine a dual-register tariff's day and night rates into one schedule of half-hourly rates.
+
+        Half hours from `start` to `end` (epoch seconds) take the night rate when they start between
+        `night_start` and `night_end`, given in seconds after midnight UTC, and the day rate otherwise. The
+        result prices like any single-register schedule, so every stream goes through the same lookup.
+        """
+        def at_night(epoch: float) -> bool:
+            time_of_day = epoch % DAY
+            if night_start <= night_end:
+                return night_start <= time_of_day < night_end
+            return time_of_day >= night_start or time_of_day < night_end  # The window spans midnight
+
+        intervals = []
+        period_start = start
+        while period_start < end:
+            rates = night_rates if at_night(period_start) else day_rates
+            index = rates.index_of(period_start)
+            if index != -1:
+                intervals.append(RateInterval(period_start, period_start + HALF_HOUR, rates.values[index]))
+            period_start += HALF_HOUR
+        return cls(intervals)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def index_of(self, epoch: float) -> int:
+        """Return the index of the rate in effect at `epoch`, or -1 if no rate covers it."""
+        best = -1
+        i = bisect_right(self.starts, epoch) - 1
+        while i >= 0 and self.max_ends[i] >= epoch:
+            if self.ends[i] >= epoch and (best == -1 or self.order[i] < self.order[best]):
+                best = i
+            i -= 1
+        return best
+
+    def rate_at(self, epoch: float) -> float:
+        index = self.index_of(epoch)
+        if index == -1:
+            raise ValueError(f"No unit rate found for {datetime.fromtimestamp(epoch, timezone.utc).isoformat()}")
+        return self.values[index]
+
+
+class PeriodCost:
+    """The cost of one half-hourly reading on a tariff."""
+    __slots__ = ("read_at", "consumption_kwh", "rate", "calculated_cost")
+
+    def __init__(self, read_at: float, consumption_kwh: float, rate: float, calculated_cost: float):
+        self.read_at = read_at
+        self.consumption_kwh = consumption_kwh
+        self.rate = rate
+        self.calculated_cost = calculated_cost
+
+
+def calculate_costs(readings, schedule: RateSchedule):
+    """Price every half-hourly reading against the unit rates in one pass.
+
+    `readings` is a `consumption_store.Readings`. Returns a tuple of (period_costs, total_cost)
+    with a `PeriodCost` for each reading.
+    """
+    if not isinstance(schedule, RateSchedule):
+        schedule = RateSchedule.from_api(schedule)
+
+    period_costs = []
+    for read_at, consumption_wh in zip(readings.read_at, readings.consumption_wh):
+        rate = schedule.rate_at(read_at)
+        consumption_kwh = consumption_wh / 1000
+        period_costs.append(PeriodCost(read_at, consumption_kwh, rate, round(consumption_kwh * rate, 4)))
+    return period_costs, sum(period.calculated_cost for period in period_costs)
+
+
+def best_combination(import_costs: dict, export_earnings: dict):
+    """Find the import and export tariffs with the lowest net cost, import cost less export earnings.
+
+    Takes dicts of tariff to pence, where None means it couldn't be priced. The two are chosen independently,
+    since any import tariff can be paired with any export tariff. Returns (import tariff, export tariff,
+    net cost), or None if either side has nothing priced.
+    """
+    import_costs = {tariff: cost for tariff, cost in import_costs.items() if cost is not None}
+    export_earnings = {tariff: earnings for tariff, earnings in export_earnings.items() if earnings is not None}
+    if not import_costs or not export_earnings:
+        return None
+    import_tariff = min(import_costs, key=import_costs.get)
+    export_tariff = max(export_earnings, key=export_earnings.get)
+    return import_tariff, export_tariff, import_costs[import_tariff] - export_earnings[export_tariff]
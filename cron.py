@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+
+# (lowest, highest) value allowed in each field of a cron expression
+FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+# How far ahead to look for the next matching time before giving up (covers leap days)
+SEARCH_LIMIT = timedelta(days=366 * 5)
+
+
+def parse_field(field: str, lowest: int, highest: int) -> set:
+    """Parse one cron field such as `*`, `*/15`, `1-5`, `0,30` or `8-18/2` into the set of values it allows."""
+    values = set()
+    for part in field.split(','):
+        value_range, _, step = part.partition('/')
+        step = int(step) if step else 1
+
+        if value_range == '*':
+            start, end = lowest, highest
+        elif '-' in value_range:
+            start, end = (int(value) for value in value_range.split('-'))
+        else:
+            start = end = int(value_range)
+            if step != 1:
+                end = highest
+
+        if start < lowest or end > highest or start > end or step < 1:
+            raise ValueError(f"Invalid cron field '{field}', values must be between {lowest} and {highest}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """A standard five field cron expression: minute hour day-of-month month day-of-week (0 is Sunday)."""
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Invalid cron expression '{expression}', expected 5 fields")
+
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            parse_field(field, lowest, highest) for field, (lowest, highest) in zip(fields, FIELD_RANGES))
+        # Cron allows 7 for Sunday as well as 0
+        if 7 in self.weekdays:
+            self.weekdays = (self.weekdays - {7}) | {0}
+        # As in cron, if both day fields are restricted a day matching either one is enough
+        self.any_day = fields[2] == '*' or fields[4] == '*'
+
+    def matches_day(self, moment: datetime) -> bool:
+        day_match = moment.day in self.days
+        weekday_match = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.any_day:
+            return day_match and weekday_match
+        return day_match or weekday_match
+
+    def next_after(self, after: datetime) -> datetime:
+        """Return the first matching minute strictly after `after`."""
+        moment = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = after + SEARCH_LIMIT
+        while moment <= limit:
+            if moment.month not in self.months or not self.matches_day(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"Cron expression '{self.expression}' never matches")
+
+    def __str__(self):
+        return self.expression
+
+
+class Schedule:
+    """When to run, from a comma-separated list of HH:MM times and/or cron expressions separated by `;`.
+
+    For example `23:00`, `12:00,23:00` or `0 23 * * *;30 16 * * 1-5`.
+    """
+
+    def __init__(self, spec: str):
+        self.expressions = []
+        for entry in spec.split(';'):
+            entry = entry.strip()
+            if not entry:
+                continue
+            if len(entry.split()) == 5:
+                self.expressions.append(CronExpression(entry))
+                continue
+            for execution_time in entry.split(','):
+                hour, minute = execution_time.strip().split(':')
+                self.expressions.append(CronExpression(f"{int(minute)} {int(hour)} * * *"))
+
+        if not self.expressions:
+            raise ValueError(f"No execution times found in '{spec}'")
+
+    def next_run(self, after: datetime) -> datetime:
+        return min(expression.next_after(after) for expression in self.expressions)
+
+    def last_run_between(self, start: datetime, end: datetime):
+        """Return the latest scheduled time in (start, end], or None if nothing was due in that window."""
+        latest = None
+        moment = start
+        while True:
+            moment = self.next_run(moment)
+            if moment > end:
+                return latest
+            latest = moment
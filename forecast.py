@@ -0,0 +1,76 @@
+import csv
+from array import array
+from datetime import date
+from statistics import median
+
+from consumption_store import INTERVAL, Readings, day_bounds
+
+# Like the rest of the bot, days are UTC days
+DAY = 24 * 60 * 60
+PERIODS_PER_DAY = DAY // INTERVAL
+
+
+def is_weekend_day(day_number: int) -> bool:
+    """Whether the day `day_number` days after 1970-01-01 (a Thursday) is a Saturday or Sunday."""
+    return (day_number + 3) % 7 >= 5
+
+
+class LoadProfile:
+    """Typical consumption in each half hour of a weekday and of a weekend day, in watt-hours.
+
+    Built from the median of each half hour over recent history, so one unusual day doesn't skew it.
+    """
+
+    def __init__(self, weekday: array, weekend: array, days: int):
+        self.weekday = weekday
+        self.weekend = weekend
+        self.days = days  # How many days of history went into it
+
+    @classmethod
+    def from_readings(cls, readings: Readings):
+        # One pass over the columns, bucketing each reading by (weekend, half hour of the day)
+        buckets = [[[] for _ in range(PERIODS_PER_DAY)] for _ in range(2)]
+        days = set()
+        for read_at, consumption_wh in zip(readings.read_at, readings.consumption_wh):
+            day_number = int(read_at // DAY)
+            days.add(day_number)
+            buckets[is_weekend_day(day_number)][int(read_at % DAY) // INTERVAL].append(consumption_wh)
+
+        weekday, weekend = (array('d', (median(slot) if slot else 0.0 for slot in kind)) for kind in buckets)
+        # Without any history for one kind of day, fall back to the other
+        if not any(buckets[True]):
+            weekend = weekday
+        if not any(buckets[False]):
+            weekday = weekend
+        return cls(weekday, weekend, len(days))
+
+    @classmethod
+    def flat(cls, daily_wh: float):
+        """The same consumption in every half hour of every day."""
+        profile = array('d', [daily_wh / PERIODS_PER_DAY]) * PERIODS_PER_DAY
+        return cls(profile, profile, 0)
+
+    @classmethod
+    def from_csv(cls, path: str):
+        """Read a profile from a CSV file with one row per half hour from midnight, in watt-hours.
+
+        A second column gives the weekend's consumption, otherwise weekends use the first. A header row is skipped.
+        """
+        with open(path, newline="") as file:
+            rows = [row for row in csv.reader(file) if row and row[0].strip()]
+        if rows and not rows[0][0].strip().replace(".", "", 1).isdigit():
+            rows = rows[1:]
+        if len(rows) != PERIODS_PER_DAY:
+            raise ValueError(f"{path} needs {PERIODS_PER_DAY} half-hourly rows, found {len(rows)}")
+
+        weekday = array('d', (float(row[0]) for row in rows))
+        weekend = array('d', (float(row[1]) for row in rows)) if all(len(row) > 1 for row in rows) else weekday
+        return cls(weekday, weekend, 0)
+
+    def readings_for(self, day: date) -> Readings:
+        """The expected readings for `day`, ready to price with `calculate_costs`."""
+        start, _ = day_bounds(day)
+        profile = self.weekend if is_weekend_day(int(start // DAY)) else self.weekday
+        return Readings(array('d', (start + slot * INTERVAL for slot in range(PERIODS_PER_DAY))),
+                        array('d', profile),
+                        array('d', [0.0]) * PERIODS_PER_DAY)
@@ -0,0 +1,101 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+
+import config
+
+# Refresh this many seconds before the token expires, so calls never go out with a stale token
+REFRESH_MARGIN = 5 * 60
+# Kraken tokens last an hour. Only used if the expiry can't be read from the token itself.
+DEFAULT_LIFETIME = 60 * 60
+
+
+def jwt_expiry(token: str):
+    """Read the `exp` claim from a JWT without verifying it. Returns None if the token can't be decoded."""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class KrakenToken:
+    def __init__(self, token: str, expires_at: float, refresh_token: str = None, refresh_expires_at: float = None):
+        self.token = token
+        self.expires_at = expires_at
+        self.refresh_token = refresh_token
+        self.refresh_expires_at = refresh_expires_at
+
+    @classmethod
+    def from_response(cls, result):
+        """Build a token from the data of an obtainKrakenToken mutation."""
+        data = result.get("obtainKrakenToken") or {}
+        token = data.get("token")
+        if not token:
+            raise Exception("Failed to obtain authentication token")
+
+        expires_at = jwt_expiry(token) or time.time() + DEFAULT_LIFETIME
+        return cls(token, expires_at, data.get("refreshToken"), data.get("refreshExpiresIn"))
+
+    def expires_soon(self) -> bool:
+        return time.time() >= self.expires_at - REFRESH_MARGIN
+
+    def can_refresh(self) -> bool:
+        return self.refresh_token is not None and \
+            (self.refresh_expires_at is None or time.time() < self.refresh_expires_at - REFRESH_MARGIN)
+
+
+# Tokens are cached per API key so every QueryService for an account reuses the same one
+_tokens = {}
+_tokens_lock = threading.Lock()
+
+
+def _token_path(api_key: str) -> str:
+    key_hash = hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    return os.path.join(config.DATA_DIR, f"token-{key_hash}.json")
+
+
+def load_token(api_key: str):
+    """Return the cached token for an API key from memory, or from disk if PERSIST_TOKEN is on."""
+    with _tokens_lock:
+        token = _tokens.get(api_key)
+    if token is not None or not config.PERSIST_TOKEN:
+        return token
+
+    try:
+        with open(_token_path(api_key)) as file:
+            token = KrakenToken(**json.load(file))
+    except (OSError, TypeError, ValueError):
+        return None
+
+    with _tokens_lock:
+        _tokens.setdefault(api_key, token)
+    return token
+
+
+def save_token(api_key: str, token: KrakenToken):
+    with _tokens_lock:
+        _tokens[api_key] = token
+    if not config.PERSIST_TOKEN:
+        return
+
+    path = _token_path(api_key)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # Only the owner should be able to read the token
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as file:
+        json.dump(vars(token), file)
+
+
+def forget_token(api_key: str):
+    with _tokens_lock:
+        _tokens.pop(api_key, None)
+    if config.PERSIST_TOKEN:
+        try:
+            os.remove(_token_path(api_key))
+        except OSError:
+            pass
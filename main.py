@@ -1,41 +1,73 @@
+import copy
 import time
 import traceback
-from datetime import date, datetime
-import requests
+from datetime import date, datetime, timedelta, timezone
 import config
-from account_info import AccountInfo
+from account_info import Account, AccountInfo, ExportInfo
+from async_pricing import get_all_tariff_rates
+from cache import CATALOGUE_TTL, get_cache, ttl_for
+from consumption_store import Readings, day_bounds, get_consumption_store
+from cost_engine import best_combination, calculate_costs
+from forecast import LoadProfile
+from products import ProductCatalogue, cached_catalogue, catalogue_url, store_catalogue
+from metrics import metrics, span
 from notification import send_notification, send_batch_notification
 from queries import *
-from tariff import TARIFFS
-from query_service import QueryService
-
-query_service: QueryService
-tariffs = []
+from switch_state import SwitchState, STARTING, REQUESTED, ACCEPTED
+from tariff import get_registry
+from query_service import HttpClient, QueryService, rate_limiter
+from running_totals import RunningTotals
+from run_journal import JournalRun, get_journal
+
+# Shared by every account, so the public product and rate lookups reuse one connection pool
+http_client = HttpClient(rate_limiter)
+# The account from the environment variables, kept between runs
+default_account: Account = None
+
+# How often to check on a switch: the first check after SWITCH_POLL_INITIAL seconds, backing off to SWITCH_POLL_MAX
+SWITCH_POLL_INITIAL = 5
+SWITCH_POLL_MAX = 60
+SWITCH_POLL_TIMEOUT = 15 * 60
+ENROLMENT_FAILED_STATUSES = {"FAILED", "CANCELLED", "WITHDRAWN"}
+# How many days a switch that hasn't finished is resumed on later runs before giving up on it
+SWITCH_RESUME_DAYS = 7
+# How many days before the compared one to look for a complete day of export readings
+EXPORT_LOOKBACK_DAYS = 3
 
 # The version of the terms and conditions is required to accept the new tariff
-def get_terms_version(product_code):
-    query = get_terms_version_query.format(product_code=product_code)
-    result = query_service.execute_gql_query(query)
+def get_terms_version(account: Account, product_code):
+    result = account.query_service.execute_gql_query(get_terms_version_query, {"productCode": product_code})
     terms_version = result.get('termsAndConditionsForProduct', {}).get('version', "1.0").split('.')
 
     return({'major': int(terms_version[0]), 'minor': int(terms_version[1])})
 
-def accept_new_agreement(product_code, enrolment_id):
+def accept_new_agreement(account: Account, product_code, enrolment_id):
     # get terms and conditions version
-    version = get_terms_version(product_code)
+    version = get_terms_version(account, product_code)
     # accept terms and conditions
-    query = accept_terms_query.format(account_number=config.ACC_NUMBER,
-                                          enrolment_id=enrolment_id,
-                                          version_major=version['major'],
-                                          version_minor=version['minor'])
-    result = query_service.execute_gql_query(query)
+    result = account.query_service.execute_gql_query(accept_terms_query, {"accountNumber": account.acc_number,
+                                                                          "enrolmentId": enrolment_id,
+                                                                          "versionMajor": version['major'],
+                                                                          "versionMinor": version['minor']})
     return result.get('acceptTermsAndConditions', {}).get('acceptedVersion', "unknown version")
 
 
 
-def get_acc_info() -> AccountInfo:
-    query = account_query.format(acc_number=config.ACC_NUMBER)
-    result = query_service.execute_gql_query(query)
+def get_acc_info(account: Account, day: date = None) -> AccountInfo:
+    day = day or date.today()
+
+    # Once we know the meter's device ID, fetch the account and any consumption we haven't stored in one request
+    store = get_consumption_store()
+    known_device_id = account.device_id
+    missing_from = store.missing_from(known_device_id, day) if known_device_id else None
+    with span("account"):
+        if missing_from is not None:
+            variables = {"accountNumber": account.acc_number, "deviceId": known_device_id,
+                         **consumption_period(day, missing_from)}
+            result = account.query_service.execute_gql_query(account_with_consumption_query, variables)
+        else:
+            result = account.query_service.execute_gql_query(account_query, {"accountNumber": account.acc_number})
+
     import_agreement = None
     for agreement in result.get("account", {}).get("electricityAgreements", []):
         meter_point = agreement.get("meterPoint", {})
@@ -76,116 +108,189 @@ def get_acc_info() -> AccountInfo:
     if not device_id:
         raise Exception("ERROR: No device ID found for the IMPORT meter")
     
-    matching_tariff = next((tariff for tariff in tariffs if tariff.is_tariff(tariff_code)), None)
+    matching_tariff = find_account_tariff(account, tariff_code)
     if matching_tariff is None:
         raise Exception(f"ERROR: Found no supported tariff for {tariff_code}")
 
-    # Get consumption for today
-    query = consumption_query.format(device_id=device_id, start_date=f"{date.today()}T00:00:00Z",
-                                     end_date=f"{date.today()}T23:59:59Z")
-    result = query_service.execute_gql_query(query)
-    consumption = result['smartMeterTelemetry']
-
-    return AccountInfo(matching_tariff, curr_stdn_charge, region_code, consumption, mpan)
-
-
-def get_potential_tariff_rates(tariff, region_code):
-    all_products = rest_query(f"{config.BASE_URL}/products/?brand=OCTOPUS_ENERGY&is_business=false")
-    product = next((
-        product for product in all_products['results']
-        if product['display_name'] == tariff
-           and product['direction'] == "IMPORT"
-    ), None)
-
-    product_code = product.get('code')
-
-    if product_code is None:
-        raise ValueError(f"No matching tariff found for {tariff}")
-
-    # Use the self links to navigate to the tariff details
-    product_link = next((
-        item.get('href') for item in product.get('links', [])
-        if item.get('rel', '').lower() == 'self'
-    ), None)
-
-    if not product_link:
-        raise ValueError(f"Self link not found for tariff {product_code}.")
-
-    tariff_details = rest_query(product_link)
+    if device_id == known_device_id:
+        if missing_from is not None:
+            store.append(device_id, Readings.from_telemetry(result['smartMeterTelemetry']))
+        consumption = store.day_readings(device_id, day)
+    else:
+        consumption = get_consumption(account, device_id, day)
+        account.device_id = device_id
 
-    # Get the standing charge including VAT
-    region_code_key = f'_{region_code}'
-    filtered_region = tariff_details.get('single_register_electricity_tariffs', {}).get(region_code_key)
+    export = None
+    export_agreement = next((agreement for agreement in result.get("account", {}).get("electricityAgreements", [])
+                             if agreement.get("meterPoint", {}).get("direction") == "EXPORT"), None)
+    if export_agreement is not None and account.export_tariffs:
+        try:
+            export = get_export_info(account, export_agreement, day)
+        except Exception as e:
+            print(f"Error reading the export meter. {e}")
+
+    return AccountInfo(matching_tariff, curr_stdn_charge, region_code, consumption, mpan, device_id, tariff_code,
+                       export)
+
+
+def get_export_info(account: Account, export_agreement, day: date) -> ExportInfo:
+    meter_point = export_agreement.get("meterPoint", {})
+    tariff_code = (export_agreement.get("tariff") or {}).get("tariffCode")
+    mpan = meter_point.get("mpan")
+    serial_number = next((meter["serialNumber"] for meter in meter_point.get("meters", [])
+                          if meter.get("serialNumber")), None)
+    if not tariff_code or not mpan or not serial_number:
+        raise Exception("ERROR: No tariff code, MPAN or serial number found for the EXPORT meter")
+
+    # The account's own copy if it's one of the export tariffs being compared
+    candidates = [tariff for tariff in get_registry().for_tariff_code(tariff_code) if tariff.direction == "EXPORT"]
+    current_tariff = next((tariff for tariff in account.export_tariffs if tariff in candidates), None)
+    if current_tariff is None and candidates:
+        current_tariff = copy.copy(candidates[0])
+
+    # The consumption endpoint lags, so the day being compared usually has few or no exports yet. Price the latest
+    # complete day instead, rather than reporting a part day as all that was exported
+    for export_day in (day - timedelta(days=days_back) for days_back in range(EXPORT_LOOKBACK_DAYS + 1)):
+        readings = get_export_readings(account, mpan, serial_number, export_day)
+        if get_consumption_store().missing_from(f"export-{mpan}", export_day) is None:
+            return ExportInfo(tariff_code, mpan, serial_number, readings, current_tariff, export_day)
+    raise Exception(f"ERROR: No complete day of export readings since {day - timedelta(days=EXPORT_LOOKBACK_DAYS)}")
+
+
+def get_export_readings(account: Account, mpan: str, serial_number: str, day: date) -> Readings:
+    """Return a day's half-hourly exports, only fetching the intervals that aren't stored yet.
+
+    Exports come from the meter's REST consumption endpoint, which usually lags a day behind, rather than the
+    Home Mini's telemetry.
+    """
+    store = get_consumption_store()
+    meter_id = f"export-{mpan}"
+    missing_from = store.missing_from(meter_id, day)
+    if missing_from is not None:
+        period = consumption_period(day, missing_from)
+        url = (f"{config.BASE_URL}/electricity-meter-points/{mpan}/meters/{serial_number}/consumption/"
+               f"?period_from={period['start']}&period_to={period['end']}&page_size=100&order_by=period")
+        results = []
+        with span("export_telemetry"):
+            while url:
+                page = account.query_service.execute_rest_query(url, authenticated=True)
+                results.extend(page.get('results', []))
+                url = page.get('next')
+        store.append(meter_id, Readings.from_consumption(results))
+    return store.day_readings(meter_id, day)
+
+
+def find_account_tariff(account: Account, tariff_code: str):
+    """Find which of the account's tariffs a tariff code belongs to, by its product code if the catalogue lists it."""
+    registry = get_registry()
+    catalogue = cached_catalogue()
+    if catalogue is not None:
+        registry.index_catalogue(catalogue)
+    # Products that have been withdrawn aren't in the catalogue, so these fall back to matching the code
+    candidates = registry.for_tariff_code(tariff_code)
+    return next((tariff for tariff in account.tariffs if tariff in candidates), None)
+
+
+def consumption_period(day: date, start: float = None):
+    """The query period for `day`, optionally starting part way through it at epoch seconds `start`."""
+    if start is None:
+        return {"start": f"{day}T00:00:00Z", "end": f"{day}T23:59:59Z"}
+    start_time = datetime.fromtimestamp(start, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return {"start": start_time, "end": f"{day}T23:59:59Z"}
+
+
+def get_consumption(account: Account, device_id, day: date) -> Readings:
+    """Return a day's half-hourly readings, only fetching the intervals that aren't stored yet."""
+    store = get_consumption_store()
+    missing_from = store.missing_from(device_id, day)
+    if missing_from is not None:
+        variables = {"deviceId": device_id, **consumption_period(day, missing_from)}
+        with span("telemetry"):
+            result = account.query_service.execute_gql_query(consumption_query, variables)
+        store.append(device_id, Readings.from_telemetry(result['smartMeterTelemetry']))
+    return store.day_readings(device_id, day)
+
+
+def load_profile(account: Account, device_id, days: int) -> LoadProfile:
+    """Build the load profile from the `days` before today, fetching any of them that aren't stored yet."""
+    today = date.today()
+    for days_ago in range(days, 0, -1):
+        get_consumption(account, device_id, today - timedelta(days=days_ago))
+    start, _ = day_bounds(today - timedelta(days=days))
+    end, _ = day_bounds(today)
+    return LoadProfile.from_readings(get_consumption_store().readings(device_id, start, end))
+
+
+def forecast_costs(account: Account, account_info: AccountInfo):
+    """Price the load profile against tomorrow's rates for every tariff.
+
+    Returns (profile, dict of tariff to expected cost in pence). Tariffs whose rates for tomorrow
+    aren't published yet are left out.
+    """
+    tomorrow = date.today() + timedelta(days=1)
+    tariffs = list(account.tariffs)
+    if account_info.current_tariff not in tariffs:
+        tariffs.append(account_info.current_tariff)
+
+    with span("forecast"):
+        profile = load_profile(account, account_info.device_id, config.FORECAST_DAYS)
+        expected_readings = profile.readings_for(tomorrow)
+        all_tariff_rates = get_all_tariff_rates(tariffs, account_info.region_code, tomorrow,
+                                                account_info.dual_register)
+
+    expected = {}
+    for tariff, tariff_rates in all_tariff_rates.items():
+        if isinstance(tariff_rates, Exception):
+            print(f"Error finding tomorrow's prices for tariff: {tariff.id}. {tariff_rates}")
+            continue
+        standing_charge, schedule, _ = tariff_rates
+        try:
+            _, expected_cost = calculate_costs(expected_readings, schedule)
+        except ValueError:
+            continue  # Not all of tomorrow's rates are out yet
+        expected[tariff] = expected_cost + standing_charge
+    return profile, expected
 
-    if filtered_region is None:
-        raise ValueError(f"Region code not found {region_code_key}.")
 
-    region_tariffs = filtered_region.get('direct_debit_monthly') or filtered_region.get('varying')
-    standing_charge_inc_vat = region_tariffs.get('standing_charge_inc_vat')
+def get_catalogue() -> ProductCatalogue:
+    catalogue = cached_catalogue()
+    if catalogue is None:
+        catalogue = store_catalogue(list(rest_query_paged(catalogue_url(config.BASE_URL))), CATALOGUE_TTL)
+    return catalogue
 
-    if standing_charge_inc_vat is None:
-        raise ValueError(f"Standing charge including VAT not found for region {region_code_key}.")
 
-    # Find the link for standard unit rates
-    region_links = region_tariffs.get('links', [])
-    unit_rates_link = next((
-        item.get('href') for item in region_links
-        if item.get('rel', '').lower() == 'standard_unit_rates'
-    ), None)
+def rest_query(url):
+    cache = get_cache()
+    if cache is not None:
+        data = cache.get(url)
+        if data is not None:
+            return data
 
-    if not unit_rates_link:
-        raise ValueError(f"Standard unit rates link not found for region: {region_code_key}")
+    data = http_client.get_json(url)
+    if cache is not None:
+        cache.set(url, data, ttl_for(url))
+    return data
 
-    # Get today's rates
-    today = date.today()
-    unit_rates_link_with_time = f"{unit_rates_link}?period_from={today}T00:00:00Z&period_to={today}T23:59:59Z"
-    unit_rates = rest_query(unit_rates_link_with_time)
 
-    return standing_charge_inc_vat, unit_rates.get('results', []), product_code
+def rest_query_paged(url):
+    """Yield the results of a paginated REST endpoint one page at a time, following the `next` links."""
+    while url:
+        page = rest_query(url)
+        yield from page.get('results', [])
+        url = page.get('next')
 
 
-def rest_query(url):
-    response = requests.get(url)
-    if response.ok:
-        data = response.json()
-        return data
-    else:
-        raise Exception(f"ERROR: rest_query failed querying `{url}` with {response.status_code}")
-
-
-def calculate_potential_costs(consumption_data, rate_data):
-    period_costs = []
-    for consumption in consumption_data:
-        read_time = consumption['readAt'].replace('+00:00', 'Z')
-        matching_rate = next(
-            rate for rate in rate_data
-            # Flexible has no end time, so default to the end of time
-            if rate['valid_from'] <= read_time <= (rate.get('valid_to') or "9999-12-31T23:59:59Z")
-            # DIRECT_DEBIT is for flexible that has different price for direct debit or not
-            and rate['payment_method'] in [None, "DIRECT_DEBIT"]
-        )
-
-        consumption_kwh = float(consumption['consumptionDelta']) / 1000
-        cost = float("{:.4f}".format(consumption_kwh * matching_rate['value_inc_vat']))
-
-        period_costs.append({
-            'period_end': read_time,
-            'consumption_kwh': consumption_kwh,
-            'rate': matching_rate['value_inc_vat'],
-            'calculated_cost': cost,
-        })
-    return period_costs
-
-def switch_tariff(target_product_code, mpan):
+def switch_tariff(account: Account, target_product_code, mpan):
     change_date = date.today()
-    query = switch_query.format(account_number=config.ACC_NUMBER, mpan=mpan, product_code=target_product_code, change_date=change_date)
-    result = query_service.execute_gql_query(query)
+    result = account.query_service.execute_gql_query(switch_query, {"accountNumber": account.acc_number, "mpan": mpan,
+                                                                    "productCode": target_product_code,
+                                                                    "changeDate": str(change_date)})
     return result.get("startOnboardingProcess", {}).get("productEnrolment", {}).get("id")
 
-def verify_new_agreement():
-    query = account_query.format(acc_number=config.ACC_NUMBER)
-    result = query_service.execute_gql_query(query)
-    today = datetime.now().date()
+def verify_new_agreement(account: Account, day: date = None):
+    """Check the account's agreement started on `day`, the day the switch was asked for, by default today."""
+    result = account.query_service.execute_gql_query(agreements_query, {"accountNumber": account.acc_number})
+    today = day or datetime.now().date()
     valid_from = next((datetime.fromisoformat(agreement['validFrom']).date()
                       for agreement in result['account']['electricityAgreements']
                       if 'validFrom' in agreement),None)
@@ -195,20 +300,154 @@ def verify_new_agreement():
     # next_year = valid_from.replace(year=valid_from.year + 1)
     return valid_from == today
 
-def compare_and_switch():
-    welcome_message = "DRY RUN: " if config.DRY_RUN else ""
-    welcome_message += "Starting comparison of today's costs..."
-    send_notification(welcome_message)
+def poll(check, description: str):
+    """Call `check` with growing gaps until it returns something truthy, giving up after SWITCH_POLL_TIMEOUT.
+
+    An exception from `check` counts as not ready yet. Returns the result of `check`, or None on timeout.
+    """
+    delay = SWITCH_POLL_INITIAL
+    deadline = time.monotonic() + SWITCH_POLL_TIMEOUT
+    while time.monotonic() + delay <= deadline:
+        time.sleep(delay)
+        try:
+            result = check()
+            if result:
+                return result
+        except Exception as e:
+            print(f"{description} not ready yet. {e}")
+        delay = min(delay * 1.5, SWITCH_POLL_MAX)
+    return None
+
+
+def get_enrolments(account: Account):
+    result = account.query_service.execute_gql_query(enrolment_query, {"accountNumber": account.acc_number})
+    return result.get("productEnrolments") or []
+
+
+def find_enrolment_id(account: Account, product_code):
+    """Find the enrolment for a switch to `product_code`, for when we restarted before its ID was saved."""
+    return next((enrolment["id"] for enrolment in reversed(get_enrolments(account))
+                 if enrolment.get("product", {}).get("code") == product_code
+                 and enrolment.get("status") not in ENROLMENT_FAILED_STATUSES), None)
+
+
+def enrolment_status(account: Account, enrolment_id):
+    """Return "COMPLETED" or a failed status once the enrolment has finished, otherwise None."""
+    enrolment = next((enrolment for enrolment in get_enrolments(account) if enrolment.get("id") == enrolment_id), None)
+    if enrolment is None:
+        return None
+
+    status = enrolment.get("status")
+    if status in ENROLMENT_FAILED_STATUSES:
+        return status
+    stages = enrolment.get("stages") or []
+    if status == "COMPLETED" or (stages and all(stage.get("status") == "COMPLETED" for stage in stages)):
+        return "COMPLETED"
+    return None
+
+
+def continue_switch(account: Account, switch: SwitchState, run: JournalRun = None):
+    """Take a switch from whatever step it reached to the end, saving each step as it completes.
+
+    With a `run`, each step is recorded in its journal too.
+    """
+    def advance(state: str, **changes):
+        switch.advance(state, **changes)
+        if run is not None:
+            run.record("switch", vars(switch))
+
+    with span("switch_completion"):
+        _continue_switch(account, switch, advance)
+    if run is not None and switch.state == ACCEPTED:
+        run.record("switch", {**vars(switch), "finished": True})
+
+
+def _continue_switch(account: Account, switch: SwitchState, advance):
+    if switch.state != STARTING and not switch.is_today():
+        # Left over from an earlier run, so the enrolment may have finished or been cancelled since
+        status = enrolment_status(account, switch.enrolment_id)
+        if status is not None:
+            switch.clear()
+            if status == "COMPLETED":
+                account.outcome = f"Switched to {switch.display_name}"
+                send_notification(f"The switch to {switch.display_name} from {switch.day} has finished.")
+            else:
+                send_notification(f"The switch to {switch.display_name} from {switch.day} was {status.lower()}. "
+                                  f"Please check your account and emails.\n"
+                                  f"https://octopus.energy/dashboard/new/accounts/{account.acc_number}/messages")
+            return
+
+    if switch.state == STARTING:
+        enrolment_id = find_enrolment_id(account, switch.product_code)
+        if enrolment_id is None:
+            switch.clear()
+            send_notification(f"ERROR: couldn't find the enrolment for the switch to {switch.display_name}. "
+                              f"Please check your account and emails.")
+            return
+        advance(REQUESTED, enrolment_id=enrolment_id)
+
+    if switch.state == REQUESTED:
+        # Terms can be accepted as soon as Octopus has generated the new agreement
+        accepted_version = poll(lambda: accept_new_agreement(account, switch.product_code, switch.enrolment_id),
+                                "New agreement")
+        if accepted_version is None:
+            if date.today() - date.fromisoformat(switch.day) >= timedelta(days=SWITCH_RESUME_DAYS):
+                switch.clear()
+                send_notification(f"Octopus still hasn't generated the new agreement for the switch to "
+                                  f"{switch.display_name} from {switch.day}, so I've given up on it. Please check "
+                                  f"your account and emails.\n"
+                                  f"https://octopus.energy/dashboard/new/accounts/{account.acc_number}/messages")
+                return
+            account.outcome = f"Waiting for the new agreement for {switch.display_name}"
+            send_notification(f"Octopus hasn't generated the new agreement yet. I'll try again on the next run.\n" \
+                              f"https://octopus.energy/dashboard/new/accounts/{account.acc_number}/messages")
+            return
+        advance(ACCEPTED, accepted_version=accepted_version)
+        account.outcome = f"Switched to {switch.display_name}"
+        send_notification("Accepted agreement (v.{version}). Switch successful.".format(version=accepted_version))
 
-    account_info = get_acc_info()
+    if switch.state == ACCEPTED:
+        status = poll(lambda: enrolment_status(account, switch.enrolment_id) or
+                              ("COMPLETED" if verify_new_agreement(account, date.fromisoformat(switch.day))
+                               else None),
+                      "Enrolment")
+        switch.clear()
+        if status == "COMPLETED":
+            send_notification("Verified new agreement successfully. Process finished.")
+        else:
+            send_notification(f"Unable to verify new agreement ({status or 'timed out'}). Please check your account and emails.\n" \
+                              f"https://octopus.energy/dashboard/new/accounts/{account.acc_number}/messages")
+
+
+def price_today(account: Account, account_info: AccountInfo):
+    """Price today's readings so far on the current tariff and every other tariff of the account.
+
+    Only the readings that arrived since the account was last priced today are costed, on top of the running
+    totals kept on the account. Returns (costs, summary) where costs is keyed by Tariff, in pence, or None if
+    the tariff couldn't be priced. The same costs are kept in account.result.
+    """
     current_tariff = account_info.current_tariff
+    totals = account.running_totals
+    if totals is None or not totals.is_for(date.today(), current_tariff):
+        totals = account.running_totals = RunningTotals(date.today(), current_tariff)
+
+    # Fetch all of the other tariffs' rates at once
+    other_tariffs = [tariff for tariff in account.tariffs if tariff != current_tariff]  # Skip if you're already on that tariff
+    with span("pricing"):
+        all_tariff_rates = get_all_tariff_rates(other_tariffs, account_info.region_code,
+                                                dual_register=account_info.dual_register)
+
+    schedules = {tariff: tariff_rates[1] for tariff, tariff_rates in all_tariff_rates.items()
+                 if not isinstance(tariff_rates, Exception)}
+    with span("costs"):
+        totals.add(totals.new_readings(account_info.consumption), schedules)
 
     # Total consumption cost
-    total_con_cost = sum(float(entry['costDeltaWithTax'] or 0) for entry in account_info.consumption)
+    total_con_cost = totals.actual_cost
     total_curr_cost = total_con_cost + account_info.standing_charge
 
     # Total consumption
-    total_wh = sum(float(consumption['consumptionDelta']) for consumption in account_info.consumption)
+    total_wh = totals.consumption_wh
     total_kwh = total_wh / 1000  # Convert watt-hours to kilowatt-hours
 
     # Print out consumption on current tariff
@@ -220,22 +459,31 @@ def compare_and_switch():
     # Track costs key: Tariff, value: total cost in pence
     # Add current tariff
     costs = {current_tariff: total_curr_cost}
-
-    # Calculate costs of other tariffs
-    for tariff in tariffs:
-        if tariff == current_tariff:
-            continue  # Skip if you're already on that tariff
-
+    # The same costs split into consumption and standing charge, key: tariff ID
+    breakdown = {current_tariff.id: {"consumption": round(total_con_cost, 4),
+                                     "standing_charge": account_info.standing_charge,
+                                     "total": round(total_curr_cost, 4)}}
+    account.result = {"day": str(date.today()), "current_tariff": current_tariff.id,
+                      "consumption_kwh": round(total_kwh, 4), "costs": breakdown}
+
+    for tariff in other_tariffs:
         try:
-            (potential_std_charge, potential_unit_rates, potential_product_code) = \
-                get_potential_tariff_rates(tariff.api_display_name, account_info.region_code)
-            tariff.product_code = potential_product_code
-            potential_costs = calculate_potential_costs(account_info.consumption, potential_unit_rates)
+            tariff_rates = all_tariff_rates[tariff]
+            if isinstance(tariff_rates, Exception):
+                raise tariff_rates
 
-            total_tariff_consumption_cost = sum(period['calculated_cost'] for period in potential_costs)
+            (potential_std_charge, potential_unit_rates, potential_product_code) = tariff_rates
+            tariff.product_code = potential_product_code
+            if tariff not in totals.costs:
+                # It couldn't be priced earlier today, so price every reading so far and carry on from there
+                with span("costs", tariff=tariff.id):
+                    _, totals.costs[tariff] = calculate_costs(account_info.consumption, potential_unit_rates)
+            total_tariff_consumption_cost = totals.costs[tariff]
             total_tariff_cost = total_tariff_consumption_cost + potential_std_charge
 
             costs[tariff] = total_tariff_cost
+            breakdown[tariff.id] = {"consumption": round(total_tariff_consumption_cost, 4),
+                                    "standing_charge": potential_std_charge, "total": round(total_tariff_cost, 4)}
             summary += f"Potential cost on {tariff.display_name}: £{total_tariff_cost / 100:.2f} " \
                        f"(£{total_tariff_consumption_cost / 100:.2f} con + " \
                        f"£{potential_std_charge / 100:.2f} s/c)\n"
@@ -244,99 +492,369 @@ def compare_and_switch():
             print(f"Error finding prices for tariff: {tariff.id}. {e}")
             summary += f"No cost for {tariff.display_name}\n"
             costs[tariff] = None
+            breakdown[tariff.id] = None
+
+    if account_info.export is not None:
+        earnings, export_summary = price_export(account, account_info)
+        summary += export_summary
+        account.result["export"] = {
+            "day": str(account_info.export.day),
+            "current_tariff": account_info.export.current_tariff.id if account_info.export.current_tariff else None,
+            "export_kwh": round(account_info.export.readings.total_wh() / 1000, 4),
+            "earnings": {tariff.id: None if earned is None else round(earned, 4) for tariff, earned in earnings.items()},
+        }
+        # The net cost nets imports and exports from the same day, so when the exports are from an earlier day
+        # the imports are priced again for that day
+        export_day = account_info.export.day
+        import_costs = costs if export_day == date.today() else price_imports(account, account_info, export_day)
+        best = best_combination(import_costs, earnings)
+        if best is not None:
+            import_tariff, export_tariff, net_cost = best
+            day_label = "" if export_day == date.today() else f" on {export_day}"
+            summary += f"Lowest net cost{day_label}: {import_tariff.display_name} with " \
+                       f"{export_tariff.display_name} at £{net_cost / 100:.2f}\n"
+            account.result["best_combination"] = {"day": str(export_day), "import": import_tariff.id,
+                                                  "export": export_tariff.id, "net_cost": round(net_cost, 4)}
+
+    return costs, summary
+
+
+def price_imports(account: Account, account_info: AccountInfo, day: date) -> dict:
+    """Price a past day's imports on the current tariff and every other tariff of the account.
+
+    The day's readings come from the consumption store, fetching any it doesn't have. Returns the total cost in
+    pence keyed by Tariff, or None if the tariff couldn't be priced.
+    """
+    readings = get_consumption(account, account_info.device_id, day)
+    current_tariff = account_info.current_tariff
+    # What the meter says the day actually cost, like today's cost on the current tariff
+    costs = {current_tariff: readings.total_cost() + account_info.standing_charge}
+    other_tariffs = [tariff for tariff in account.tariffs if tariff != current_tariff]
+    with span("pricing", day=str(day)):
+        all_tariff_rates = get_all_tariff_rates(other_tariffs, account_info.region_code, day,
+                                                account_info.dual_register)
+    for tariff, tariff_rates in all_tariff_rates.items():
+        if isinstance(tariff_rates, Exception):
+            print(f"Error finding prices for tariff: {tariff.id} on {day}. {tariff_rates}")
+            costs[tariff] = None
+            continue
+        standing_charge, unit_rates, _ = tariff_rates
+        costs[tariff] = calculate_costs(readings, unit_rates)[1] + standing_charge
+    return costs
+
+
+def price_export(account: Account, account_info: AccountInfo):
+    """Price the day's exports on the current export tariff and every export tariff of the account.
+
+    Returns (earnings, summary) where earnings is keyed by Tariff, in pence, or None if the tariff couldn't be
+    priced. Exports go through the same rate lookup as imports, one pass over the readings per tariff.
+    """
+    export = account_info.export
+    tariffs = list(account.export_tariffs)
+    if export.current_tariff is not None and export.current_tariff not in tariffs:
+        tariffs.insert(0, export.current_tariff)
+
+    with span("pricing", stream="export"):
+        all_tariff_rates = get_all_tariff_rates(tariffs, account_info.region_code, export.day)
+
+    day_label = "today" if export.day == date.today() else f"on {export.day}"
+    summary = f"\nTotal export {day_label}: {export.readings.total_wh() / 1000:.4f} kWh\n"
+    earnings = {}
+    for tariff in tariffs:
+        try:
+            tariff_rates = all_tariff_rates[tariff]
+            if isinstance(tariff_rates, Exception):
+                raise tariff_rates
+
+            _, earned = calculate_costs(export.readings, tariff_rates[1])
+            earnings[tariff] = earned
+            label = "Current export tariff" if tariff == export.current_tariff else "Potential export on"
+            summary += f"{label} {tariff.display_name}: £{earned / 100:.2f}\n"
+        except Exception as e:
+            print(f"Error finding export prices for tariff: {tariff.id}. {e}")
+            summary += f"No export price for {tariff.display_name}\n"
+            earnings[tariff] = None
 
-    # Filter the dictionary to only include tariffs where the `switchable` attribute is True
+    return earnings, summary
+
+
+def poll_intraday(account: Account = None):
+    """Bring today's running totals up to date with the latest readings, and alert early if another tariff is
+    clearly cheaper so far. Doesn't switch, that's left to the scheduled comparison.
+    """
+    account = account or get_default_account()
+    prepare_account(account)
+    with span("intraday", account=account.label):
+        account_info = get_acc_info(account)
+        costs, summary = price_today(account, account_info)
+
+    current_tariff = account_info.current_tariff
     switchable_tariffs = {t: cost for t, cost in costs.items() if t.switchable and cost is not None}
+    if not switchable_tariffs:
+        return
+    cheapest_tariff = min(switchable_tariffs, key=switchable_tariffs.get)
+    savings = costs[current_tariff] - costs[cheapest_tariff]
+    account.result["cheapest_so_far"] = cheapest_tariff.id
+    print(f"Cheapest so far today: {cheapest_tariff.display_name} at £{costs[cheapest_tariff] / 100:.2f}")
+
+    alerted = account.running_totals.alerted
+    if config.INTRADAY_ALERT_MARGIN and savings > config.INTRADAY_ALERT_MARGIN and cheapest_tariff not in alerted:
+        alerted.add(cheapest_tariff)
+        send_notification(f"{summary}\n{cheapest_tariff.display_name} is £{savings / 100:.2f} cheaper than "
+                          f"{current_tariff.display_name} so far today", batchable=False)
+
+
+def journal_tariff(account: Account, tariff_id: str):
+    """Turn a tariff ID recorded in the run journal back into the account's copy of the tariff."""
+    tariff = next((tariff for tariff in account.tariffs + account.export_tariffs if tariff.id == tariff_id), None)
+    if tariff is None:
+        tariff = get_registry().get(tariff_id)
+        if tariff is None:
+            raise Exception(f"ERROR: Found no tariff for ID '{tariff_id}' from the run journal")
+        tariff = copy.copy(tariff)
+    return tariff
+
+
+def compare_costs(account: Account, account_info: AccountInfo):
+    """Price today, and tomorrow's expected usage if FORECAST_DAYS is set, on every tariff.
+
+    Returns what the switch decision needs as plain data, so it can be recorded in the run journal:
+    the summary, the current tariff and each tariff's cost in pence (None if it couldn't be priced).
+    """
+    current_tariff = account_info.current_tariff
+
+    costs, summary = price_today(account, account_info)
+
+    if config.FORECAST_DAYS:
+        profile, expected = forecast_costs(account, account_info)
+        account.result["expected_tomorrow"] = {tariff.id: round(cost, 4) for tariff, cost in expected.items()}
+        expected_kwh = profile.readings_for(date.today() + timedelta(days=1)).total_wh() / 1000
+        summary += f"\nExpected tomorrow from {profile.days} days of history ({expected_kwh:.1f} kWh):\n"
+        for tariff, expected_cost in sorted(expected.items(), key=lambda item: item[1]):
+            summary += f"{tariff.display_name}: £{expected_cost / 100:.2f}\n"
+
+        # A switch applies from the start of today and stays in place tomorrow unless the next run switches again,
+        # so once tomorrow's rates are out for every tariff, go by today's cost plus tomorrow's expected cost
+        if all(tariff in expected for tariff, cost in costs.items() if cost is not None):
+            costs = {tariff: cost + expected[tariff] if cost is not None else None for tariff, cost in costs.items()}
+            summary += "Deciding on today's cost plus tomorrow's expected cost\n"
+        else:
+            summary += "Tomorrow's rates aren't out for every tariff yet, deciding on today's cost only\n"
+
+    return {
+        "summary": summary,
+        "current_tariff": current_tariff.id,
+        "mpan": account_info.mpan,
+        "result": account.result,
+        # Kept in the order they were priced, so ties go the same way after a restart
+        "tariffs": {tariff.id: {"display_name": tariff.display_name, "switchable": tariff.switchable,
+                                "product_code": tariff.product_code, "cost": cost}
+                    for tariff, cost in costs.items()},
+    }
+
+
+def compare_and_switch(account: Account, run: JournalRun):
+    """Compare today's costs and switch to the cheapest tariff if it's worth it.
+
+    Each phase is recorded in `run` as it completes: the account and readings fetched, the costs worked out
+    and the steps of a switch. A run resumed after a restart picks up from the last of them, so nothing is
+    fetched or priced twice and a switch is never requested twice.
+    """
+    welcome_message = "DRY RUN: " if config.DRY_RUN else ""
+    if run.resumed:
+        welcome_message += f"Resuming the comparison started at {datetime.fromtimestamp(run.started_at):%H:%M}, " \
+                           f"after its last completed phase ({list(run.phases)[-1]})..."
+    else:
+        welcome_message += "Starting comparison of today's costs..."
+    send_notification(welcome_message)
+
+    # Finish a switch that was interrupted or is still waiting on Octopus, rather than starting another. Asking
+    # again would make a second enrolment for the same product.
+    switch = SwitchState.load(account.acc_number)
+    if switch is not None:
+        if switch.is_today():
+            send_notification(f"Resuming today's switch to {switch.display_name}")
+        else:
+            send_notification(f"Resuming the switch to {switch.display_name} from {switch.day}, "
+                              f"instead of comparing today")
+        continue_switch(account, switch, run)
+        return
+
+    if "switch" in run.phases:
+        # The switch this run asked for has already finished or given up, so don't ask for it again
+        account.result = run.phases["priced"]["result"]
+        account.outcome = f"Already requested the switch to {run.phases['switch']['display_name']}"
+        send_notification(f"{account.outcome} before restarting. Please check your account and emails if "
+                          f"you didn't hear that it finished.")
+        return
+
+    priced = run.phases.get("priced")
+    if priced is None:
+        fetched = run.phases.get("fetched")
+        if fetched is None:
+            account_info = get_acc_info(account)
+            run.record("fetched", account_info.as_dict())
+        else:
+            account_info = AccountInfo.from_dict(fetched, lambda tariff_id: journal_tariff(account, tariff_id))
+        priced = compare_costs(account, account_info)
+        run.record("priced", priced)
+    else:
+        account.result = priced["result"]
+
+    tariffs = priced["tariffs"]
+    summary = priced["summary"]
+    current_tariff = tariffs[priced["current_tariff"]]
+
+    # Filter the tariffs to only include the switchable ones that could be priced
+    switchable_tariffs = {tariff_id: tariff["cost"] for tariff_id, tariff in tariffs.items()
+                          if tariff["switchable"] and tariff["cost"] is not None}
+
+    # Decide among the tariffs that were priced, but say which weren't, since one of them might have been cheaper
+    unpriced = [tariff["display_name"] for tariff in tariffs.values() if tariff["switchable"] and tariff["cost"] is None]
+    if unpriced:
+        summary += f"Couldn't price {', '.join(unpriced)}, so only comparing the other tariffs\n"
+    if not switchable_tariffs:
+        account.outcome = "Not switching, couldn't price any of the tariffs"
+        send_notification(f"{summary}\nNot switching today, none of the tariffs could be priced.")
+        return
 
     # Find the cheapest tariffs that is in the list and switchable
-    curr_cost = costs.get(current_tariff, float('inf'))
-    cheapest_tariff = min(switchable_tariffs, key=switchable_tariffs.get)
-    cheapest_cost = costs[cheapest_tariff]
+    curr_cost = current_tariff["cost"] if current_tariff["cost"] is not None else float('inf')
+    cheapest_tariff_id = min(switchable_tariffs, key=switchable_tariffs.get)
+    cheapest_tariff = tariffs[cheapest_tariff_id]
+    cheapest_cost = cheapest_tariff["cost"]
 
-    if cheapest_tariff == current_tariff:
+    if cheapest_tariff_id == priced["current_tariff"]:
+        account.outcome = f"Already on the cheapest tariff: {cheapest_tariff['display_name']} at £{cheapest_cost / 100:.2f}"
         send_notification(
-            f"{summary}\nYou are already on the cheapest tariff: {cheapest_tariff.display_name} at £{cheapest_cost / 100:.2f}")
+            f"{summary}\nYou are already on the cheapest tariff: {cheapest_tariff['display_name']} at £{cheapest_cost / 100:.2f}")
         return
 
     savings = curr_cost - cheapest_cost
 
     # 2p buffer because cba
     if savings > 2:
-        switch_message = f"{summary}\nInitiating Switch to {cheapest_tariff.display_name}"
+        switch_message = f"{summary}\nInitiating Switch to {cheapest_tariff['display_name']}"
         send_notification(switch_message)
 
         if config.DRY_RUN:
+            account.outcome = f"DRY RUN: Would switch to {cheapest_tariff['display_name']}, saving £{savings / 100:.2f}"
             dry_run_message = "DRY RUN: Not going through with switch today."
             send_notification(dry_run_message)
             return None
 
-        if cheapest_tariff.product_code is None:
+        if cheapest_tariff["product_code"] is None:
             send_notification("ERROR: product_code is missing.")
             return 
         
-        if account_info.mpan is None:
+        if priced["mpan"] is None:
             send_notification("ERROR: mpan is missing.")
             return  
         
-        enrolment_id = switch_tariff(cheapest_tariff.product_code, account_info.mpan)
+        # Saved before asking Octopus, so a restart from here on finishes this switch rather than asking again
+        switch = SwitchState(account.acc_number, str(date.today()), cheapest_tariff["product_code"],
+                             cheapest_tariff["display_name"], priced["mpan"])
+        switch.save()
+        run.record("switch", vars(switch))
+        with span("switch"):
+            enrolment_id = switch_tariff(account, cheapest_tariff["product_code"], priced["mpan"])
         if enrolment_id is None:
+            switch.clear()
             send_notification("ERROR: couldn't get enrolment ID")
             return
         else:
+            switch.advance(REQUESTED, enrolment_id=enrolment_id)
+            run.record("switch", vars(switch))
             send_notification("Tariff switch requested successfully.")
-        # Give octopus some time to generate the agreement
-        time.sleep(60)
-        accepted_version = accept_new_agreement(cheapest_tariff.product_code, enrolment_id)
-        send_notification("Accepted agreement (v.{version}). Switch successful.".format(version=accepted_version))
 
-        verified = verify_new_agreement()
-        if not verified:
-            send_notification("Verification failed, waiting 20 seconds and trying again...")
-            time.sleep(20)
-            verified = verify_new_agreement()  # Retry
-            
-            if verified:
-                send_notification("Verified new agreement successfully. Process finished.")
-            else:
-                send_notification(f"Unable to verify new agreement after retry. Please check your account and emails.\n" \
-                 f"https://octopus.energy/dashboard/new/accounts/{config.ACC_NUMBER}/messages")
+        continue_switch(account, switch, run)
     else:
+        account.outcome = f"Not switching, staying on {current_tariff['display_name']}"
         send_notification(f"{summary}\nNot switching today.")
 
 
-def load_tariffs_from_ids(tariff_ids: str):
-    global tariffs
-
+def load_tariffs_from_ids(account: Account, tariff_ids: str, direction: str = "IMPORT"):
     # Convert the input string into a set of lowercase tariff IDs
     requested_ids = set(tariff_ids.lower().split(","))
 
-    # Get all predefined tariffs from the Tariffs class
-    all_tariffs = TARIFFS
+    registry = get_registry()
+    if any(tariff_id not in registry for tariff_id in requested_ids):
+        # Not built in or in TARIFFS_FILE, so look for them among the products in the catalogue
+        try:
+            registry.discover(get_catalogue())
+        except Exception as e:
+            print(f"Error discovering tariffs from the products catalogue. {e}")
 
-    # Match requested tariffs to predefined ones
+    # Match requested tariffs to known ones
     matched_tariffs = []
     for tariff_id in requested_ids:
-        matched = next((t for t in all_tariffs if t.id == tariff_id), None)
+        matched = registry.get(tariff_id)
 
-        if matched is not None:
-            matched_tariffs.append(matched)
+        if matched is not None and matched.direction == direction:
+            # Each account gets its own copy, since product codes are filled in during the comparison
+            matched_tariffs.append(copy.copy(matched))
+        elif matched is not None:
+            send_notification(f"Warning: '{tariff_id}' is an {matched.direction.lower()} tariff")
         else:
             send_notification(f"Warning: No tariff found for ID '{tariff_id}'")
 
-    tariffs = matched_tariffs
-
-
-def run_tariff_compare():
+    if direction == "EXPORT":
+        account.export_tariffs = matched_tariffs
+    else:
+        account.tariffs = matched_tariffs
+
+
+def get_default_account() -> Account:
+    global default_account
+    if default_account is None:
+        default_account = Account(config.ACC_NUMBER, config.API_KEY, config.TARIFFS,
+                                  export_tariff_ids=config.EXPORT_TARIFFS)
+    return default_account
+
+
+def prepare_account(account: Account):
+    # Kept on the account between runs, so a long running process reuses its login and tariffs
+    if account.query_service is None:
+        account.query_service = QueryService(account.api_key, config.BASE_URL, http_client)
+    if not account.tariffs:
+        load_tariffs_from_ids(account, account.tariff_ids)
+    if account.export_tariff_ids and not account.export_tariffs:
+        load_tariffs_from_ids(account, account.export_tariff_ids, "EXPORT")
+
+
+def run_tariff_compare(account: Account = None, standalone: bool = True) -> bool:
+    """Run the comparison for an account, the one from the environment variables by default.
+
+    Pass standalone=False when running as part of several accounts, which report their stats and batch once at the end.
+    Returns whether it finished without an error.
+    """
+    account = account or get_default_account()
+    account.outcome = None
+    account.result = None
+    if standalone:
+        metrics.start_run()
+    succeeded = False
+    run = None
     try:
-        global query_service
-        query_service = QueryService(config.API_KEY, config.BASE_URL)
-        load_tariffs_from_ids(config.TARIFFS)
-        if query_service is not None:
-            compare_and_switch()
-        else:
-            raise Exception("ERROR: setup_gql has failed")
+        with span("run", account=account.label):
+            prepare_account(account)
+            run = get_journal().start(account.acc_number)
+            compare_and_switch(account, run)
+        succeeded = True
+        return True
     except:
+        account.outcome = "Error, see the error notification"
         send_notification(message=traceback.format_exc(), title="Octobot Error", error=True)
+        return False
     finally:
-        if config.BATCH_NOTIFICATIONS:
+        # Only a run cut short by the process stopping is left unfinished, to be resumed on restart
+        if run is not None:
+            run.finish(account.outcome)
+        account.finished_at = time.time()
+        if standalone:
+            metrics.finish_run(succeeded)
+            cache = get_cache()
+            if cache is not None:
+                print(cache.stats())
+        if config.BATCH_NOTIFICATIONS and standalone:
             send_batch_notification()
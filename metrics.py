@@ -0,0 +1,203 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+
+# The span code is running in, so spans started inside it record it as their parent.
+# Context variables follow asyncio tasks, so concurrent rate fetches each see the right parent.
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Timer:
+    """Count, total and maximum of a set of durations, plus how many ended in an error."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, duration: float, error: bool = False):
+        self.count += 1
+        self.errors += error
+        self.total += duration
+        self.max = max(self.max, duration)
+
+
+class RequestStats(Timer):
+    def __init__(self):
+        super().__init__()
+        self.bytes = 0
+        self.retries = 0
+        self.statuses = {}  # key: HTTP status, or the exception name if there was no response
+
+
+class Metrics:
+    """Span timings and API request stats, both since the process started and for the current run."""
+
+    def __init__(self):
+        self.spans = {}  # key: span name, value: Timer
+        self.requests = {}  # key: endpoint name, value: RequestStats
+        self.runs = {"ok": 0, "failed": 0}
+        self.last_run = None  # (finished at, duration) of the last run
+        self._run_started = None
+        self._run_spans = []
+        self._run_requests = {}
+        self._lock = threading.Lock()
+
+    def record_span(self, record: dict):
+        with self._lock:
+            self.spans.setdefault(record["name"], Timer()).record(record["duration"], record["error"] is not None)
+            if self._run_started is not None:
+                self._run_spans.append(record)
+
+    def record_request(self, endpoint: str, latency: float, status, size: int = 0):
+        error = not (isinstance(status, int) and status < 400)
+        with self._lock:
+            for requests in (self.requests, self._run_requests):
+                stats = requests.setdefault(endpoint, RequestStats())
+                stats.record(latency, error)
+                stats.bytes += size
+                stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+    def record_retry(self, endpoint: str):
+        with self._lock:
+            for requests in (self.requests, self._run_requests):
+                requests.setdefault(endpoint, RequestStats()).retries += 1
+
+    def start_run(self):
+        with self._lock:
+            self._run_started = time.time()
+            self._run_spans = []
+            self._run_requests = {}
+
+    def finish_run(self, succeeded: bool):
+        """Close the current run, print its phase timings and append it to RUN_LOG if set."""
+        with self._lock:
+            if self._run_started is None:
+                return
+            finished = time.time()
+            duration = finished - self._run_started
+            self.runs["ok" if succeeded else "failed"] += 1
+            self.last_run = (finished, duration)
+            run = {
+                "started": self._run_started,
+                "duration": round(duration, 4),
+                "succeeded": succeeded,
+                "spans": self._run_spans,
+                "requests": {endpoint: {"calls": stats.count, "errors": stats.errors, "retries": stats.retries,
+                                        "bytes": stats.bytes, "total_seconds": round(stats.total, 4), "max_seconds": round(stats.max, 4),
+                                        "statuses": {str(status): count for status, count in stats.statuses.items()}}
+                             for endpoint, stats in self._run_requests.items()},
+            }
+            self._run_started = None
+
+        phases = {}
+        for span in run["spans"]:
+            phases[span["name"]] = phases.get(span["name"], 0) + span["duration"]
+        print("Timings: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in phases.items()))
+        for endpoint, stats in sorted(run["requests"].items()):
+            average = stats["total_seconds"] / stats["calls"] if stats["calls"] else 0
+            print(f"{endpoint}: {stats['calls']} calls, {stats['retries']} retries, avg {average * 1000:.0f}ms, "
+                  f"max {stats['max_seconds'] * 1000:.0f}ms")
+
+        if config.RUN_LOG:
+            os.makedirs(os.path.dirname(config.RUN_LOG) or ".", exist_ok=True)
+            with open(config.RUN_LOG, "a") as file:
+                file.write(json.dumps(run) + "\n")
+
+    def prometheus(self) -> str:
+        """Render everything recorded so far in the Prometheus text format."""
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{label}"' for key, label in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        with self._lock:
+            spans = sorted(self.spans.items())
+            requests = sorted(self.requests.items())
+            metric("minmax_runs_total", "counter", "Completed runs by result.",
+                   [({"result": result}, count) for result, count in self.runs.items()])
+            if self.last_run is not None:
+                metric("minmax_last_run_timestamp_seconds", "gauge", "When the last run finished.",
+                       [({}, self.last_run[0])])
+                metric("minmax_last_run_duration_seconds", "gauge", "How long the last run took.",
+                       [({}, self.last_run[1])])
+            metric("minmax_span_seconds_total", "counter", "Time spent in each phase of a run.",
+                   [({"span": name}, timer.total) for name, timer in spans])
+            metric("minmax_span_count_total", "counter", "Times each phase has run.",
+                   [({"span": name}, timer.count) for name, timer in spans])
+            metric("minmax_span_max_seconds", "gauge", "Longest time spent in each phase.",
+                   [({"span": name}, timer.max) for name, timer in spans])
+            metric("minmax_span_errors_total", "counter", "Phases that ended in an error.",
+                   [({"span": name}, timer.errors) for name, timer in spans])
+            metric("minmax_http_requests_total", "counter", "API requests by endpoint and status.",
+                   [({"endpoint": endpoint, "status": status}, count)
+                    for endpoint, stats in requests for status, count in sorted(stats.statuses.items(), key=str)])
+            metric("minmax_http_retries_total", "counter", "API requests retried after a transient failure.",
+                   [({"endpoint": endpoint}, stats.retries) for endpoint, stats in requests])
+            metric("minmax_http_request_seconds_total", "counter", "Time spent waiting on API requests.",
+                   [({"endpoint": endpoint}, stats.total) for endpoint, stats in requests])
+            metric("minmax_http_request_max_seconds", "gauge", "Slowest API request.",
+                   [({"endpoint": endpoint}, stats.max) for endpoint, stats in requests])
+            metric("minmax_http_response_bytes_total", "counter", "Bytes received from the API.",
+                   [({"endpoint": endpoint}, stats.bytes) for endpoint, stats in requests])
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block of code as one phase of the run, e.g. `with span("rates", tariff="go"):`."""
+    parent = _current_span.get()
+    token = _current_span.set(name)
+    started = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        record = {"name": name, "parent": parent, "start": started,
+                  "duration": round(time.perf_counter() - start, 4), "error": error}
+        record.update(attributes)
+        metrics.record_span(record)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = metrics.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_metrics(port: int):
+    """Serve the metrics for Prometheus to scrape at http://<host>:<port>/metrics, in a background thread."""
+    server = ThreadingHTTPServer(("", port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Serving metrics on port {port}")
+    return server
@@ -1,18 +1,118 @@
-from apprise import Apprise
+import atexit
+import queue
+import threading
+import time
 import config
+from metrics import span
 from datetime import datetime
 
+# Messages sent within this many seconds of each other with the same title go out as one notification
+COALESCE_WINDOW = 2
+# Attempts per notification service before giving up on a message
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 2  # seconds, doubled after each failed attempt
+# How long to wait for queued notifications to go out when the process exits
+FLUSH_TIMEOUT = 30
+
 notifications = []
+# Label added to messages sent from the current thread, so runs for several accounts can be told apart
+_context = threading.local()
+
+_apprise = None
+_apprise_lock = threading.Lock()
+_queue = queue.Queue()
+_worker = None
+
+def set_notification_label(label):
+    _context.label = label
 
-# FIXME this was existing code (refactored) but do we need to create a new object for each invocation?
 def get_apprise():
-    apprise = Apprise()
+    """Return the Apprise instance for config.NOTIFICATION_URLS, built the first time it's needed.
 
-    if config.NOTIFICATION_URLS:
-        for url in config.NOTIFICATION_URLS.split(','):
-            apprise.add(url.strip())
+    Apprise is imported here rather than at the top, since loading its plugins is most of its import time and
+    only the notification worker needs it.
+    """
+    global _apprise
+    with _apprise_lock:
+        if _apprise is None:
+            from apprise import Apprise
+            apprise = Apprise()
+
+            if config.NOTIFICATION_URLS:
+                for url in config.NOTIFICATION_URLS.split(','):
+                    apprise.add(url.strip())
+
+            _apprise = apprise
+
+    return _apprise
+
+def notify_with_retries(apprise, body, title):
+    """Send to every service separately, so a service that keeps failing doesn't cause repeats on the others."""
+    for server in apprise:
+        delay = RETRY_DELAY
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                if server.notify(body=body, title=title):
+                    break
+            except Exception as e:
+                print(f"Notification to {server.service_name} raised {e}")
+            if attempt < MAX_ATTEMPTS:
+                time.sleep(delay)
+                delay *= 2
+        else:
+            print(f"Giving up on notification to {server.service_name} after {MAX_ATTEMPTS} attempts")
+
+def _send_queued():
+    """Background worker that sends queued messages, joining ones that arrive close together."""
+    while True:
+        title, body = _queue.get()
+        handled = 1
+        deadline = time.monotonic() + COALESCE_WINDOW
+        pending = None
+        while pending is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                next_title, next_body = _queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            handled += 1
+            if next_title == title:
+                body = f"{body}\n\n{next_body}"
+            else:
+                pending = (next_title, next_body)
 
-    return apprise
+        try:
+            with span("notify", messages=handled):
+                notify_with_retries(get_apprise(), body, title)
+                if pending is not None:
+                    notify_with_retries(get_apprise(), pending[1], pending[0])
+        finally:
+            for _ in range(handled):
+                _queue.task_done()
+
+def _enqueue(body, title):
+    global _worker
+    with _apprise_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_send_queued, name="notifications", daemon=True)
+            _worker.start()
+    _queue.put((title, body))
+
+def flush_notifications(timeout=FLUSH_TIMEOUT):
+    """Wait up to `timeout` seconds for queued notifications to be sent. Returns whether they all were."""
+    deadline = time.monotonic() + timeout
+    with _queue.all_tasks_done:
+        while _queue.unfinished_tasks:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f"Timed out sending {_queue.unfinished_tasks} notifications")
+                return False
+            _queue.all_tasks_done.wait(remaining)
+    return True
+
+atexit.register(flush_notifications)
 
 def batch_message():
     return "\n".join(notifications)
@@ -20,17 +120,22 @@ def batch_message():
 def send_notification(message, title="", error=False, batchable=True):
     """Sends a notification using Apprise.
 
+    Messages are sent by a background worker, so a slow service never holds up the caller.
+
     Args:
         message (str): The message to send.
         title (str, optional): The title of the notification.
         error (bool, optional): Whether the message is a stack trace. Defaults to False.
         batchable (bool, optional): Whether the message can be batched.
     """
-    print(message)
+    label = getattr(_context, "label", None)
+    if label:
+        message = f"[{label}] {message}"
 
-    apprise = get_apprise()
+    print(message)
 
-    if not apprise:
+    # Apprise itself is only loaded by the background worker when there's something to send
+    if not config.NOTIFICATION_URLS:
         print("No notification services configured. Check config.NOTIFICATION_URLS.")
         return
 
@@ -40,15 +145,14 @@ def send_notification(message, title="", error=False, batchable=True):
     if config.BATCH_NOTIFICATIONS and batchable:
         notifications.append(message)
     else:
-        apprise.notify(body=message, title=title)
+        _enqueue(message, title)
 
 def send_batch_notification():
     now = datetime.now()
     title = now.strftime(f"Octopus MinMax Results - %a %d %b {config.EXECUTION_TIME if not config.ONE_OFF_RUN else now.strftime('%H:%M:%S')}")
-    get_apprise().notify(body=batch_message(), title=title)
+    if config.NOTIFICATION_URLS:
+        _enqueue(batch_message(), title)
 
     # Clear all notifications
     global notifications
     notifications = []
-
-
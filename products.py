@@ -0,0 +1,175 @@
+import re
+import threading
+import time
+from datetime import date
+
+# Everything here works on responses from the public products API and does no I/O itself,
+# so the same lookups can be shared by the blocking and async fetch paths.
+
+
+def catalogue_url(base_url: str) -> str:
+    return f"{base_url}/products/?brand=OCTOPUS_ENERGY&is_business=false"
+
+
+def get_region_tariff(tariff_details, region_code):
+    """Return the standing charge including VAT and the standard unit rates link for a region."""
+    region_code_key = f'_{region_code}'
+    filtered_region = tariff_details.get('single_register_electricity_tariffs', {}).get(region_code_key)
+
+    if filtered_region is None:
+        raise ValueError(f"Region code not found {region_code_key}.")
+
+    region_tariffs = filtered_region.get('direct_debit_monthly') or filtered_region.get('varying')
+    standing_charge_inc_vat = region_tariffs.get('standing_charge_inc_vat')
+
+    if standing_charge_inc_vat is None:
+        raise ValueError(f"Standing charge including VAT not found for region {region_code_key}.")
+
+    # Find the link for standard unit rates
+    region_links = region_tariffs.get('links', [])
+    unit_rates_link = next((
+        item.get('href') for item in region_links
+        if item.get('rel', '').lower() == 'standard_unit_rates'
+    ), None)
+
+    if not unit_rates_link:
+        raise ValueError(f"Standard unit rates link not found for region: {region_code_key}")
+
+    return standing_charge_inc_vat, unit_rates_link
+
+
+def get_dual_region_tariff(tariff_details, region_code):
+    """Return the standing charge including VAT and the day and night unit rates links of the dual-register
+    (Economy 7) version of a product in a region, or None if it doesn't have one."""
+    region_code_key = f'_{region_code}'
+    filtered_region = tariff_details.get('dual_register_electricity_tariffs', {}).get(region_code_key)
+    if filtered_region is None:
+        return None
+
+    region_tariffs = filtered_region.get('direct_debit_monthly') or filtered_region.get('varying')
+    standing_charge_inc_vat = region_tariffs.get('standing_charge_inc_vat')
+    if standing_charge_inc_vat is None:
+        raise ValueError(f"Standing charge including VAT not found for dual register region {region_code_key}.")
+
+    links = {item.get('rel', '').lower(): item.get('href') for item in region_tariffs.get('links', [])}
+    if not links.get('day_unit_rates') or not links.get('night_unit_rates'):
+        raise ValueError(f"Day and night unit rates links not found for dual register region: {region_code_key}")
+
+    return standing_charge_inc_vat, links['day_unit_rates'], links['night_unit_rates']
+
+
+# Splits a tariff code like E-1R-AGILE-24-10-01-C into its register prefix, product code and region
+TARIFF_CODE = re.compile(r"^[A-Z]-\d+R-(?P<product_code>.+)-(?P<region>[A-Z])$", re.IGNORECASE)
+
+
+class ProductCatalogue:
+    """An index of the products catalogue, so tariffs resolve with dict lookups instead of scanning it.
+
+    Product details fetched later are indexed by region on the same object, so they're parsed once
+    and shared by every tariff, account and day until the catalogue is refreshed.
+    """
+
+    def __init__(self, products):
+        self.by_display_name = {}  # key: display name, value: product, for IMPORT products
+        self.by_export_display_name = {}  # The same for EXPORT products
+        self.by_code = {}  # key: product code, value: product
+        for product in products:
+            self.by_code[product.get('code')] = product
+            # Keep the first match, like a scan of the catalogue would
+            if product.get('direction') == "IMPORT":
+                self.by_display_name.setdefault(product['display_name'], product)
+            elif product.get('direction') == "EXPORT":
+                self.by_export_display_name.setdefault(product['display_name'], product)
+        self._regions = {}  # key: product code, value: {region code: (standing charge, unit rates link) or error}
+        self._dual_regions = {}  # key: product code, value: {region code: (standing charge, day, night link) or error}
+
+    def find_product(self, tariff, direction: str = "IMPORT"):
+        """Return the code and self link of the IMPORT (or EXPORT) product with the given display name."""
+        by_display_name = self.by_export_display_name if direction == "EXPORT" else self.by_display_name
+        product = by_display_name.get(tariff)
+        product_code = product.get('code') if product else None
+
+        if product_code is None:
+            raise ValueError(f"No matching tariff found for {tariff}")
+
+        product_link = next((
+            item.get('href') for item in product.get('links', [])
+            if item.get('rel', '').lower() == 'self'
+        ), None)
+
+        if not product_link:
+            raise ValueError(f"Self link not found for tariff {product_code}.")
+
+        return product_code, product_link
+
+    def has_details(self, product_code: str) -> bool:
+        return product_code in self._regions
+
+    def add_details(self, product_code: str, tariff_details):
+        """Index a product details response by region."""
+        regions = {}
+        for region_key in tariff_details.get('single_register_electricity_tariffs', {}):
+            try:
+                regions[region_key] = get_region_tariff(tariff_details, region_key[1:])
+            except ValueError as e:
+                regions[region_key] = e
+        dual_regions = {}
+        for region_key in tariff_details.get('dual_register_electricity_tariffs', {}):
+            try:
+                dual_regions[region_key] = get_dual_region_tariff(tariff_details, region_key[1:])
+            except ValueError as e:
+                dual_regions[region_key] = e
+        self._regions[product_code] = regions
+        self._dual_regions[product_code] = dual_regions
+
+    def region_tariff(self, product_code: str, region_code: str):
+        """Return (standing charge, unit rates link) for a product whose details have been added."""
+        region_tariff = self._regions[product_code].get(f'_{region_code}')
+        if region_tariff is None:
+            raise ValueError(f"Region code not found _{region_code}.")
+        if isinstance(region_tariff, ValueError):
+            raise region_tariff
+        return region_tariff
+
+    def dual_region_tariff(self, product_code: str, region_code: str):
+        """Return (standing charge, day unit rates link, night unit rates link) for a product whose details have
+        been added, or None if it has no dual-register version in the region."""
+        region_tariff = self._dual_regions[product_code].get(f'_{region_code}')
+        if isinstance(region_tariff, ValueError):
+            raise region_tariff
+        return region_tariff
+
+
+# The catalogue index shared by the whole process, rebuilt after CATALOGUE_TTL
+_catalogue = None
+_catalogue_expires_at = 0.0
+_catalogue_lock = threading.Lock()
+
+
+def cached_catalogue():
+    """Return the current catalogue index, or None if it needs (re)building."""
+    with _catalogue_lock:
+        return _catalogue if time.time() < _catalogue_expires_at else None
+
+
+def store_catalogue(products, ttl: float) -> ProductCatalogue:
+    """Build the index from every page of the catalogue's results and share it for `ttl` seconds."""
+    global _catalogue, _catalogue_expires_at
+    catalogue = ProductCatalogue(products)
+    with _catalogue_lock:
+        _catalogue = catalogue
+        _catalogue_expires_at = time.time() + ttl
+    return catalogue
+
+
+def unit_rates_url(unit_rates_link: str, day: date) -> str:
+    return f"{unit_rates_link}?period_from={day}T00:00:00Z&period_to={day}T23:59:59Z"
+
+
+# The most results the API returns in one page
+MAX_PAGE_SIZE = 1500
+
+
+def unit_rates_range_url(unit_rates_link: str, start: date, end: date) -> str:
+    """The unit rates for every day from `start` to `end` inclusive, in as few pages as possible."""
+    return f"{unit_rates_link}?period_from={start}T00:00:00Z&period_to={end}T23:59:59Z&page_size={MAX_PAGE_SIZE}"
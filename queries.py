@@ -1,104 +1,171 @@
-token_query = """mutation {{
-	obtainKrakenToken(input: {{ APIKey: "{api_key}" }}) {{
+# All documents are static and take GraphQL variables, so the text sent for each operation never changes.
+
+token_query = """mutation ObtainKrakenToken($apiKey: String!) {
+	obtainKrakenToken(input: { APIKey: $apiKey }) {
+	    token
+	    refreshToken
+	    refreshExpiresIn
+	}
+}"""
+
+refresh_token_query = """mutation RefreshKrakenToken($refreshToken: String!) {
+	obtainKrakenToken(input: { refreshToken: $refreshToken }) {
 	    token
-	}}
-}}"""
+	    refreshToken
+	    refreshExpiresIn
+	}
+}"""
 
-accept_terms_query = """mutation {{
-    acceptTermsAndConditions(input: {{
-        accountNumber: "{account_number}",
-        enrolmentId: "{enrolment_id}",
-        termsVersion: {{
-            versionMajor: {version_major},
-            versionMinor: {version_minor}
-        }}
-    }}) 
-    {{
+accept_terms_query = """mutation AcceptTermsAndConditions(
+    $accountNumber: String!, $enrolmentId: String!, $versionMajor: Int!, $versionMinor: Int!
+) {
+    acceptTermsAndConditions(input: {
+        accountNumber: $accountNumber,
+        enrolmentId: $enrolmentId,
+        termsVersion: {
+            versionMajor: $versionMajor,
+            versionMinor: $versionMinor
+        }
+    })
+    {
     acceptedVersion
-  }}
-}}"""
+  }
+}"""
 
-get_terms_version_query = """query {{
-    termsAndConditionsForProduct(productCode: "{product_code}") {{
+get_terms_version_query = """query TermsVersion($productCode: String!) {
+    termsAndConditionsForProduct(productCode: $productCode) {
         name
         version
-    }}
-}}"""
+    }
+}"""
 
-consumption_query = """query {{
+consumption_query = """query Consumption($deviceId: String!, $start: DateTime!, $end: DateTime!) {
     smartMeterTelemetry(
-        deviceId: "{device_id}"
+        deviceId: $deviceId
         grouping: HALF_HOURLY
-        start: "{start_date}"
-        end: "{end_date}"
-    ) {{
+        start: $start
+        end: $end
+    ) {
     readAt
     consumptionDelta
     costDeltaWithTax
-  }}
-}}"""
+  }
+}"""
 
-account_query = """query{{
-    account(
-        accountNumber: "{acc_number}"
-    ) {{
-    electricityAgreements(active: true) {{
+# Economy 7 meters are on a DayNightTariff and fixed rate tariffs a StandardTariff, so every agreement's tariff
+# needs its own fragment to come back with its code and standing charge
+account_fields = """
+    electricityAgreements(active: true) {
         validFrom
         validTo
-        meterPoint {{
-            meters(includeInactive: false) {{
-                smartDevices {{
+        meterPoint {
+            meters(includeInactive: false) {
+                serialNumber
+                smartDevices {
                     deviceId
-                }}
-            }}
+                }
+            }
             mpan
             direction
-        }}
-        tariff {{
-            ... on HalfHourlyTariff {{
+        }
+        tariff {
+            ... on HalfHourlyTariff {
+                id
+                productCode
+                tariffCode
+                standingCharge
+                }
+            ... on DayNightTariff {
                 id
                 productCode
                 tariffCode
+                standingCharge
+                dayRate
+                nightRate
+                }
+            ... on StandardTariff {
+                id
                 productCode
+                tariffCode
                 standingCharge
-                }}
-            }}
-        }}
-    }}
-}}"""
-enrolment_query = """query {{
-    productEnrolments(accountNumber: "{acc_number}") {{
+                unitRate
+                }
+            }
+        }"""
+
+account_query = """query Account($accountNumber: String!) {
+    account(
+        accountNumber: $accountNumber
+    ) {""" + account_fields + """
+    }
+}"""
+
+# The account and consumption lookups in one round trip, for when the device ID is already known
+account_with_consumption_query = """query AccountWithConsumption(
+    $accountNumber: String!, $deviceId: String!, $start: DateTime!, $end: DateTime!
+) {
+    account(
+        accountNumber: $accountNumber
+    ) {""" + account_fields + """
+    }
+    smartMeterTelemetry(
+        deviceId: $deviceId
+        grouping: HALF_HOURLY
+        start: $start
+        end: $end
+    ) {
+    readAt
+    consumptionDelta
+    costDeltaWithTax
+  }
+}"""
+
+# Just enough of the account to check when the current agreements started
+agreements_query = """query Agreements($accountNumber: String!) {
+    account(
+        accountNumber: $accountNumber
+    ) {
+    electricityAgreements(active: true) {
+        validFrom
+        }
+    }
+}"""
+
+enrolment_query = """query ProductEnrolments($accountNumber: String!) {
+    productEnrolments(accountNumber: $accountNumber) {
         id
         status
-        product {{
+        product {
             code
             displayName
-        }}
-    stages {{
+        }
+    stages {
       name
       status
-      steps {{
+      steps {
         displayName
         status
         updatedAt
-      }}
-    }}
-  }}
-}}"""
+      }
+    }
+  }
+}"""
 
-switch_query = """mutation {{
-  startOnboardingProcess(input: {{
-    accountNumber: "{account_number}",
-    mpan: "{mpan}",
-    productCode: "{product_code}",
-    targetAgreementChangeDate: "{change_date}"
-  }})
-  {{
-    onboardingProcess {{
+switch_query = """mutation StartOnboardingProcess(
+    $accountNumber: String!, $mpan: String!, $productCode: String!, $changeDate: Date!
+) {
+  startOnboardingProcess(input: {
+    accountNumber: $accountNumber,
+    mpan: $mpan,
+    productCode: $productCode,
+    targetAgreementChangeDate: $changeDate
+  })
+  {
+    onboardingProcess {
       id
-    }}
-    productEnrolment {{
+    }
+    productEnrolment {
       id
-    }}
-  }}
-}}"""
\ No newline at end of file
+    }
+  }
+}"""
@@ -1,48 +1,254 @@
-import requests
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+import config
+from kraken_token import KrakenToken, load_token, save_token, forget_token
+from metrics import metrics, span
 from queries import *
 
+# Responses worth retrying. 429 means we were rate limited, the rest are usually transient.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 4
+BACKOFF_BASE = 1  # seconds, doubled on each attempt
+BACKOFF_MAX = 60
+# Kraken error codes meaning the token is missing, invalid or expired
+AUTH_ERROR_CODES = {"KT-CT-1111", "KT-CT-1124", "KT-CT-1143"}
+
+
+class AuthenticationError(Exception):
+    pass
+
+
+def retry_after_seconds(response):
+    """Parse a Retry-After header, which is either a number of seconds or an HTTP date."""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(endpoint: str, attempt: int, status: int = None, response=None, error=None,
+                statuses=RETRY_STATUSES, retry_errors: bool = True):
+    """The retry policy shared by HttpClient and the async REST fetches.
+
+    Returns how many seconds to wait before the next attempt, or None to give up. A response is retried when its
+    `status` is in `statuses` and a failure to get one when `retry_errors` is set, up to MAX_RETRIES times, waiting as
+    long as Retry-After asks or otherwise a full jitter exponential backoff.
+    """
+    retryable = retry_errors if status is None else status in statuses
+    if not retryable or attempt >= MAX_RETRIES:
+        return None
+
+    delay = retry_after_seconds(response)
+    if delay is None:
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+    print(f"Retrying {endpoint} in {delay:.1f}s after {error if error is not None else status}")
+    metrics.record_retry(endpoint)
+    return min(delay, BACKOFF_MAX)
+
+
+def rest_endpoint_name(url: str) -> str:
+    """Name a REST endpoint by its path with product and tariff codes and meter IDs swapped for a placeholder."""
+    segments = [segment for segment in urlparse(url).path.split('/') if segment]
+    names = []
+    for segment in segments:
+        if names and names[-1] in ("electricity-meter-points", "meters"):
+            names.append("{id}")  # A meter's MPAN or serial number
+        elif re.search(r"[A-Z0-9]-", segment):
+            names.append("{code}")
+        else:
+            names.append(segment)
+    return "/".join(names)
+
+
+class RateLimiter:
+    """Spaces out requests so no more than `rate` start per second, shared by every thread that holds it."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_slot = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Claim the next free slot and return how many seconds to wait for it."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        return slot - now
+
+    def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+# One limiter for the whole process, so running many accounts can't exceed API_RATE_LIMIT between them
+rate_limiter = RateLimiter(config.API_RATE_LIMIT) if config.API_RATE_LIMIT > 0 else None
+
+
+class HttpClient:
+    """A keep-alive connection pool with retries, shared by GraphQL and REST traffic. Each request is recorded in
+    the metrics under its endpoint."""
+
+    def __init__(self, rate_limiter: RateLimiter = None):
+        self.rate_limiter = rate_limiter
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    @property
+    def session(self):
+        """The pooled session, created by the first request so that importing this module doesn't load requests."""
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+
+                session = requests.Session()
+                session.headers.update({
+                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
+                    'Accept': 'application/json, text/plain, */*',
+                    'Accept-Language': 'en-US,en;q=0.9',
+                    'Content-Type': 'application/json'
+                })
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+        return self._session
+
+    def request(self, endpoint: str, method: str, url: str, idempotent: bool = True, **kwargs):
+        """Send a request on the pooled session, retrying transient failures with exponential backoff and jitter.
+
+        Requests that aren't idempotent (mutations) are only retried when the server can't have acted on them:
+        a 429 or a failure to connect.
+        """
+        import requests
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+
+            response = None
+            error = None
+            start = time.monotonic()
+            try:
+                response = self.session.request(method, url, timeout=60, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            latency = time.monotonic() - start
+            if response is not None:
+                metrics.record_request(endpoint, latency, response.status_code, len(response.content))
+            else:
+                metrics.record_request(endpoint, latency, type(error).__name__)
+
+            # Mutations are only retried when the server can't have acted on them
+            delay = retry_delay(endpoint, attempt, response.status_code if response is not None else None,
+                                response, error, statuses=RETRY_STATUSES if idempotent else {429},
+                                retry_errors=idempotent or isinstance(error, requests.ConnectTimeout))
+            if delay is None:
+                if error is not None:
+                    raise error
+                return response
+
+            attempt += 1
+            time.sleep(delay)
+
+    def get_json(self, url: str, auth=None):
+        response = self.request(rest_endpoint_name(url), "GET", url, auth=auth)
+        if response.ok:
+            return response.json()
+        else:
+            raise Exception(f"ERROR: rest_query failed querying `{url}` with {response.status_code}")
+
+
 class QueryService:
-    def __init__(self, api_key: str, base_url: str):
+    def __init__(self, api_key: str, base_url: str, http_client: HttpClient = None):
         self.base_url = base_url
         self.api_key = api_key
-        self.headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36',
-            'Accept': 'application/json, text/plain, */*',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Content-Type': 'application/json'
-        }
         self.graphql_endpoint = f"{self.base_url}/graphql/"
 
-        self.token = None
-        self.token = self._get_token()
+        # Accounts can share one client, so all their traffic goes through the same pool and rate limit
+        self.http = http_client or HttpClient()
+
+        # Reuse a token from an earlier run if there is one, so we don't log in every time
+        self.kraken_token = load_token(api_key)
+        if self.kraken_token is None:
+            self._login()
+
+    @property
+    def token(self):
+        return self.kraken_token.token if self.kraken_token else None
 
-    def _get_token(self):
-        formatted_token_query = token_query.format(api_key=self.api_key)
+    def _login(self):
+        with span("token"):
+            self._set_token(self._execute_gql_query(token_query, {"apiKey": self.api_key}, authenticated=False))
 
-        res = self.execute_gql_query(formatted_token_query)
-        token = res.get("obtainKrakenToken", {}).get("token")
+    def _refresh(self):
+        variables = {"refreshToken": self.kraken_token.refresh_token}
+        with span("token_refresh"):
+            self._set_token(self._execute_gql_query(refresh_token_query, variables, authenticated=False))
 
-        if not token:
-            raise Exception("Failed to obtain authentication token")
+    def _set_token(self, result):
+        self.kraken_token = KrakenToken.from_response(result)
+        save_token(self.api_key, self.kraken_token)
 
-        return token
+    def _ensure_token(self):
+        """Refresh the token ahead of its expiry, using the refresh token rather than the API key where possible."""
+        if not self.kraken_token.expires_soon():
+            return
+        if self.kraken_token.can_refresh():
+            try:
+                self._refresh()
+                return
+            except Exception as e:
+                print(f"Token refresh failed, logging in again. {e}")
+        self._login()
 
-    def execute_gql_query(self, query: str):
-        headers = self.headers.copy()
-        if self.token:
+    def execute_gql_query(self, query: str, variables: dict = None):
+        self._ensure_token()
+        try:
+            return self._execute_gql_query(query, variables)
+        except AuthenticationError as e:
+            # The token was rejected before it was due to expire. Log in again and retry once.
+            print(f"Authentication failed, logging in again. {e}")
+            forget_token(self.api_key)
+            self._login()
+            return self._execute_gql_query(query, variables)
+
+    def _execute_gql_query(self, query: str, variables: dict = None, authenticated: bool = True):
+        headers = {}
+        if authenticated and self.token:
            headers["Authorization"] = self.token
 
+        operation = re.match(r"\s*(query|mutation)\s+(\w+)", query)
+        operation_name = operation.group(2) if operation else None
+        is_mutation = operation is not None and operation.group(1) == "mutation"
+
         payload = {
             "query": query,
-            "variables": {}
+            "operationName": operation_name,
+            "variables": variables or {}
         }
+        endpoint = f"graphql:{operation_name or 'unknown'}"
 
-        response = requests.post(
-            self.graphql_endpoint,
-            headers=headers,
-            json=payload,
-            timeout=60
-        )
+        response = self.http.request(endpoint, "POST", self.graphql_endpoint,
+                                     idempotent=not is_mutation, headers=headers, json=payload)
+
+        if response.status_code == 401:
+            raise AuthenticationError(f"GQL query failed: {response.status_code}: {response.text}")
 
         if not response.ok:
             raise Exception(f"GQL query failed: {response.status_code}: {response.text}")
@@ -50,6 +256,12 @@ class QueryService:
         result = response.json()
 
         if "errors" in result:
+            if any(error.get("extensions", {}).get("errorCode") in AUTH_ERROR_CODES for error in result["errors"]):
+                raise AuthenticationError(f"GQL errors: {result['errors']}")
             raise Exception(f"GQL errors: {result['errors']}")
 
-        return result.get("data", {})
\ No newline at end of file
+        return result.get("data", {})
+
+    def execute_rest_query(self, url: str, authenticated: bool = False):
+        """GET a REST endpoint. Endpoints for the account's own meters authenticate with the API key."""
+        return self.http.get_json(url, auth=(self.api_key, "") if authenticated else None)
@@ -0,0 +1,99 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+from cache import CURRENT_RATES_TTL
+
+# The 14 GSP regions, as used in the last letter of a tariff code
+REGIONS = "ABCDEFGHJKLMNP"
+# Enough for every region of a dozen tariffs over a week
+MAX_ENTRIES = 14 * 12 * 7
+
+
+class SingleFlight:
+    """Runs one fetch per key at a time. Callers asking for a key already being fetched wait for that result.
+
+    Works across threads, so accounts running on different event loops still share a fetch.
+    """
+
+    def __init__(self):
+        self._in_flight = {}  # key: concurrent.futures.Future
+        self._lock = threading.Lock()
+
+    async def do(self, key, fetch):
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = concurrent.futures.Future()
+
+        if not owner:
+            # Shielded, since cancelling a wrapped future cancels the shared one under every other caller too
+            return await asyncio.shield(asyncio.wrap_future(future))
+
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            # A BaseException on 3.8+, so it needs its own handler or the callers waiting on this fetch never wake
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+
+class RateStore:
+    """Public tariff rates shared by every account, keyed by (product_code, region, day).
+
+    Rates don't depend on the account, only on the product, the region and the day, so accounts in
+    the same region reuse one fetch. Rates for days that haven't finished are refetched after a while.
+    """
+
+    def __init__(self, max_entries: int = MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._rates = OrderedDict()  # key: (product_code, region, day), value: (fetched_at, rates)
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._rates.get(key)
+            if entry is None:
+                return None
+            fetched_at, rates = entry
+            if key[2] >= date.today() and time.time() - fetched_at > CURRENT_RATES_TTL:
+                del self._rates[key]
+                return None
+            self._rates.move_to_end(key)
+            return rates
+
+    def put(self, key, rates):
+        with self._lock:
+            self._rates[key] = (time.time(), rates)
+            self._rates.move_to_end(key)
+            while len(self._rates) > self.max_entries:
+                self._rates.popitem(last=False)
+
+    async def get_or_fetch(self, key, fetch):
+        rates = self.get(key)
+        if rates is not None:
+            return rates
+
+        async def fetch_and_store():
+            fetched = await fetch()
+            self.put(key, fetched)
+            return fetched
+
+        return await self._flight.do(key, fetch_and_store)
+
+
+rate_store = RateStore()
@@ -0,0 +1,131 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+
+import config
+
+# Finished runs are kept this long, as a record of what each run saw and decided
+KEEP_DAYS = 30
+
+
+class JournalRun:
+    """One comparison for one account, and the phases it has completed so far.
+
+    Each phase is saved as it completes, with the data the later phases need, so a run cut short by a restart
+    carries on from the last completed phase instead of starting again.
+    """
+
+    def __init__(self, journal, run_id: int, acc_number: str, started_at: float, phases: dict):
+        self.journal = journal
+        self.run_id = run_id
+        self.acc_number = acc_number
+        self.started_at = started_at
+        self.phases = phases  # key: phase name, value: what it recorded
+
+    @property
+    def resumed(self) -> bool:
+        return bool(self.phases)
+
+    def record(self, phase: str, data):
+        """Save a phase's data, replacing anything it recorded before."""
+        self.journal.record(self.run_id, phase, data)
+        self.phases[phase] = data
+
+    def finish(self, outcome: str):
+        self.journal.finish(self.run_id, outcome)
+
+
+class RunJournal:
+    """SQLite journal of comparison runs, so a restart part way through one resumes it rather than repeating it."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            acc_number TEXT NOT NULL,
+            day TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            finished_at REAL,
+            outcome TEXT
+        )""")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS phases (
+            run_id INTEGER NOT NULL,
+            phase TEXT NOT NULL,
+            data TEXT NOT NULL,
+            recorded_at REAL NOT NULL,
+            PRIMARY KEY (run_id, phase)
+        )""")
+        self._conn.commit()
+
+    def start(self, acc_number: str) -> JournalRun:
+        """Return the account's run from today that never finished, or start a new one.
+
+        Unfinished runs from earlier days are closed, since a comparison only applies to the day it ran on.
+        """
+        today = str(date.today())
+        with self._lock:
+            self._conn.execute("UPDATE runs SET finished_at = ?, outcome = 'abandoned' "
+                               "WHERE acc_number = ? AND finished_at IS NULL AND day < ?",
+                               (time.time(), acc_number, today))
+            row = self._conn.execute("SELECT run_id, started_at FROM runs "
+                                     "WHERE acc_number = ? AND day = ? AND finished_at IS NULL "
+                                     "ORDER BY run_id DESC LIMIT 1", (acc_number, today)).fetchone()
+            if row is None:
+                started_at = time.time()
+                run_id = self._conn.execute("INSERT INTO runs (acc_number, day, started_at) VALUES (?, ?, ?)",
+                                            (acc_number, today, started_at)).lastrowid
+                phases = {}
+            else:
+                run_id, started_at = row
+                phases = {phase: json.loads(data) for phase, data in self._conn.execute(
+                    "SELECT phase, data FROM phases WHERE run_id = ? ORDER BY recorded_at", (run_id,))}
+            self._conn.commit()
+        return JournalRun(self, run_id, acc_number, started_at, phases)
+
+    def record(self, run_id: int, phase: str, data):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO phases (run_id, phase, data, recorded_at) VALUES (?, ?, ?, ?)",
+                               (run_id, phase, json.dumps(data), time.time()))
+            self._conn.commit()
+
+    def finish(self, run_id: int, outcome: str):
+        cutoff = time.time() - KEEP_DAYS * 24 * 3600
+        with self._lock:
+            self._conn.execute("UPDATE runs SET finished_at = ?, outcome = ? WHERE run_id = ?",
+                               (time.time(), outcome, run_id))
+            self._conn.execute("DELETE FROM phases WHERE run_id IN (SELECT run_id FROM runs WHERE started_at < ?)",
+                               (cutoff,))
+            self._conn.execute("DELETE FROM runs WHERE started_at < ?", (cutoff,))
+            self._conn.commit()
+
+    def interrupted(self) -> dict:
+        """Return the accounts with a run from today that never finished, key: account number, value: when it
+        started as epoch seconds."""
+        with self._lock:
+            rows = self._conn.execute("SELECT acc_number, MIN(started_at) FROM runs "
+                                      "WHERE day = ? AND finished_at IS NULL GROUP BY acc_number",
+                                      (str(date.today()),)).fetchall()
+        return dict(rows)
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal() -> RunJournal:
+    """Return the shared run journal."""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = RunJournal(os.path.join(config.DATA_DIR, "journal.sqlite"))
+    return _journal
@@ -0,0 +1,55 @@
+from bisect import bisect_right
+from datetime import date
+
+from consumption_store import Readings
+from cost_engine import calculate_costs
+
+
+class RunningTotals:
+    """Today's consumption cost on each tariff, updated with only the readings that arrived since the last update.
+
+    A day's readings are only ever appended to, so the cost of the readings already priced never changes.
+    """
+
+    def __init__(self, day: date, current_tariff):
+        self.day = day
+        self.current_tariff = current_tariff
+        self.priced_until = None  # read_at of the last reading priced
+        self.consumption_wh = 0.0
+        self.actual_cost = 0.0  # What Octopus says the readings cost on the current tariff, in pence
+        self.costs = {}  # key: Tariff, value: consumption cost in pence of the readings priced so far
+        self.alerted = set()  # Tariffs we've already sent an early alert about today
+
+    def is_for(self, day: date, current_tariff) -> bool:
+        return self.day == day and self.current_tariff == current_tariff
+
+    def new_readings(self, readings: Readings) -> Readings:
+        """The readings after the last one priced."""
+        start = 0 if self.priced_until is None else bisect_right(readings.read_at, self.priced_until)
+        return Readings(readings.read_at[start:], readings.consumption_wh[start:], readings.cost[start:])
+
+    def add(self, readings: Readings, schedules: dict):
+        """Price new readings on each tariff in `schedules`, a dict of Tariff to RateSchedule.
+
+        A tariff without a schedule this time is dropped, since its total would no longer cover every reading.
+        """
+        first = self.priced_until is None
+        for tariff in list(self.costs):
+            if tariff not in schedules:
+                del self.costs[tariff]
+
+        for tariff, schedule in schedules.items():
+            if not first and tariff not in self.costs:
+                continue
+            try:
+                _, cost = calculate_costs(readings, schedule)
+            except ValueError as e:
+                print(f"Error pricing new readings on {tariff.id}. {e}")
+                self.costs.pop(tariff, None)
+                continue
+            self.costs[tariff] = self.costs.get(tariff, 0.0) + cost
+
+        self.consumption_wh += readings.total_wh()
+        self.actual_cost += readings.total_cost()
+        if len(readings):
+            self.priced_until = readings.read_at[-1]
@@ -1,30 +1,160 @@
+import os
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import random
 import config
-from main import run_tariff_compare
+from control_api import Controller, serve_control_api
+from cron import Schedule
+from metrics import serve_metrics
 from notification import send_notification
+from run_journal import get_journal
 
-# Track last execution date to ensure we only run once per day
-last_execution_date = None
+# The comparison itself (main, accounts and the HTTP clients they pull in) is only imported when it first runs,
+# so starting up and sending the welcome notification don't wait on it
 
-if config.ONE_OFF_RUN:
-    send_notification(message=f"Octobot {config.BOT_VERSION} on. Running a one off comparison.")
-    run_tariff_compare()
-else:
-    send_notification(message=f"Welcome to Octobot {config.BOT_VERSION}. I will run your comparisons at {config.EXECUTION_TIME}", batchable=False)
 
+def run() -> bool:
+    """Run every account in ACCOUNTS_FILE if there is one, otherwise just the one from the environment variables."""
+    if config.ACCOUNTS_FILE:
+        from accounts import run_all_accounts
+        return run_all_accounts()
+    from main import run_tariff_compare
+    return run_tariff_compare()
+
+
+def poll():
+    if config.ACCOUNTS_FILE:
+        from accounts import poll_all_accounts
+        return poll_all_accounts()
+    from main import poll_intraday
+    return poll_intraday()
+
+
+def get_accounts():
+    if config.ACCOUNTS_FILE:
+        import accounts
+        return accounts.accounts
+    from main import get_default_account
+    return [get_default_account()]
+
+
+# Scheduled runs and ones asked for through the control API go through here, so only one runs at a time
+controller = Controller(run, get_accounts)
+
+LAST_RUN_FILE = os.path.join(config.DATA_DIR, "last_run")
+# Never sleep longer than this in one go, so clock changes and suspends can't make us oversleep
+MAX_SLEEP = 15 * 60
+
+
+def load_last_run():
+    try:
+        with open(LAST_RUN_FILE) as file:
+            return datetime.fromisoformat(file.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def save_last_run(run_time: datetime):
+    os.makedirs(os.path.dirname(LAST_RUN_FILE) or ".", exist_ok=True)
+    with open(LAST_RUN_FILE, "w") as file:
+        file.write(run_time.isoformat())
+
+
+def sleep_until(moment: datetime):
+    while True:
+        remaining = (moment - datetime.now()).total_seconds()
+        if remaining <= 0:
+            return
+        time.sleep(min(remaining, MAX_SLEEP))
+
+
+def wait_until(moment: datetime):
+    """Sleep until `moment`, checking today's usage so far every INTRADAY_POLL_MINUTES on the way if it's set."""
+    if not config.INTRADAY_POLL_MINUTES:
+        sleep_until(moment)
+        return
+    interval = timedelta(minutes=config.INTRADAY_POLL_MINUTES)
     while True:
-        now = datetime.now()
-        current_time = now.strftime("%H:%M")
-        current_date = now.date()
+        next_poll = datetime.now() + interval
+        if next_poll >= moment:
+            sleep_until(moment)
+            return
+        sleep_until(next_poll)
+        controller.run_poll(poll)
+
+
+def missed_run(schedule: Schedule, now: datetime):
+    """Return a scheduled time from earlier today that hasn't been run yet, e.g. because we were restarted."""
+    last_run = load_last_run()
+    if last_run is None:
+        return None  # First start, nothing was missed
+
+    # A run is only worth catching up on the same day, since a switch applies to the whole of that day
+    start_of_day = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return schedule.last_run_between(max(last_run, start_of_day), now)
+
+
+def interrupted_run():
+    """Return the comparison that a restart cut short earlier today, as (when it started, what runs it), or None."""
+    interrupted = get_journal().interrupted()
+    if config.ACCOUNTS_FILE:
+        if not interrupted:
+            return None
+
+        def resume():
+            from accounts import run_all_accounts
+            return run_all_accounts(set(interrupted))
+        return datetime.fromtimestamp(min(interrupted.values())), resume
+    started = interrupted.get(config.ACC_NUMBER)
+    if started is None:
+        return None
+    return datetime.fromtimestamp(started), run
+
 
-        if current_time == config.EXECUTION_TIME and last_execution_date != current_date:
-            last_execution_date = current_date
+def run_comparison(scheduled_time: datetime):
+    save_last_run(scheduled_time)
+    started = time.monotonic()
+    controller.run_comparison("schedule")
+    print(f"Comparison for {scheduled_time:%a %d %b %H:%M} took {time.monotonic() - started:.1f}s")
+
+
+def main():
+    if config.METRICS_PORT:
+        serve_metrics(config.METRICS_PORT)
+    if config.CONTROL_PORT:
+        serve_control_api(controller, config.CONTROL_HOST, config.CONTROL_PORT, config.CONTROL_TOKEN)
+
+    if config.ONE_OFF_RUN:
+        send_notification(message=f"Octobot {config.BOT_VERSION} on. Running a one off comparison.")
+        controller.run_comparison("one off")
+    else:
+        schedule = Schedule(config.EXECUTION_TIME)
+        send_notification(message=f"Welcome to Octobot {config.BOT_VERSION}. I will run your comparisons at {config.EXECUTION_TIME}", batchable=False)
+
+        missed = missed_run(schedule, datetime.now())
+        if missed is not None:
+            send_notification(message=f"Octobot {config.BOT_VERSION} on. Catching up on the comparison missed at {missed:%H:%M}")
+            run_comparison(missed)
+        else:
+            # A missed run resumes any interrupted one on its own, otherwise carry on from where it stopped
+            interrupted = interrupted_run()
+            if interrupted is not None:
+                started, resume = interrupted
+                send_notification(message=f"Octobot {config.BOT_VERSION} on. Resuming the comparison interrupted at {started:%H:%M}")
+                controller.run_comparison("resume", run=resume)
+
+        while True:
+            next_run = schedule.next_run(datetime.now())
             # 10 Sec - 15 Min Random Delay to prevent all users attempting to access API at same time
-            delay = random.randint(10,900)
-            send_notification(message=f"Octobot {config.BOT_VERSION} on. Initiating comparison in {delay/60:.1f} minutes")
-            delay = time.sleep(delay)
-            run_tariff_compare()
+            delay = random.randint(10, 900)
+            run_at = next_run + timedelta(seconds=delay)
+            print(f"Next comparison at {run_at:%a %d %b %H:%M:%S} ({next_run:%H:%M} + {delay / 60:.1f} minutes delay)")
+            controller.next_run = run_at
+
+            wait_until(run_at)
+            send_notification(message=f"Octobot {config.BOT_VERSION} on. Initiating comparison")
+            run_comparison(next_run)
+
 
-        time.sleep(30)  # Check time every 30 seconds
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Price reference load profiles on every tariff, in every region, for every day of a date range.
+
+Answers questions like "which tariff would have been cheapest in each region on each of the last 365 days".
+Doesn't need an account, only the public product and rate APIs. Run from the repository root:
+    python sweep.py --days 365
+    python sweep.py --start 2025-01-01 --end 2025-12-31 --regions A,C --profile home.csv --output year.sweep
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import aiohttp
+
+import config
+from async_pricing import fetch_catalogue, fetch_rate_range, load_catalogue
+from consumption_store import INTERVAL, day_bounds
+from cost_engine import RateSchedule
+from forecast import DAY, PERIODS_PER_DAY, LoadProfile, is_weekend_day
+from metrics import span
+from rate_store import REGIONS
+from tariff import get_registry
+
+# Typical daily consumption of a UK home, used when no profile is given
+DEFAULT_DAILY_KWH = 8
+FORMAT_VERSION = 1
+
+
+def price_series(unit_rates, standing_charge: float, profiles, first_day: int, days: int) -> array:
+    """Price every profile on one tariff in one region, for `days` days from the ordinal `first_day`.
+
+    Runs in a worker process. Returns the daily costs in pence, profile by profile, with NaN for the days
+    that aren't fully covered by the unit rates.
+    """
+    schedule = RateSchedule.from_api(unit_rates)
+    costs = array('d', [math.nan]) * (len(profiles) * days)
+    for offset in range(days):
+        start, _ = day_bounds(date.fromordinal(first_day + offset))
+        try:
+            rates = [schedule.rate_at(start + slot * INTERVAL) for slot in range(PERIODS_PER_DAY)]
+        except ValueError:
+            continue
+        weekend = is_weekend_day(int(start // DAY))
+
+        # The rates are looked up once per day and shared by every profile. Each half hour is rounded the way
+        # calculate_costs rounds it, so the costs match what a comparison would have reported.
+        for index, profile in enumerate(profiles):
+            consumption = profile.weekend if weekend else profile.weekday
+            costs[index * days + offset] = standing_charge + sum(
+                round(consumption_wh / 1000 * rate, 4) for consumption_wh, rate in zip(consumption, rates))
+    return costs
+
+
+class SweepResult:
+    """Daily costs in pence for each tariff, region, profile and day, held in one flat column.
+
+    The column is ordered by tariff, then region, then profile, then day, so each dimension's labels are only
+    stored once. Days a tariff couldn't be priced are NaN.
+    """
+
+    def __init__(self, tariffs, regions, profiles, start: date, days: int, costs: array):
+        self.tariffs = list(tariffs)  # Tariff IDs
+        self.regions = list(regions)
+        self.profiles = list(profiles)  # Profile names
+        self.start = start
+        self.days = days
+        self.costs = costs
+
+    def index(self, tariff: str, region: str, profile: str, day: date) -> int:
+        offset = (day - self.start).days
+        if not 0 <= offset < self.days:
+            raise IndexError(f"{day} is outside the sweep")
+        return ((self.tariffs.index(tariff) * len(self.regions) + self.regions.index(region))
+                * len(self.profiles) + self.profiles.index(profile)) * self.days + offset
+
+    def cost(self, tariff: str, region: str, profile: str, day: date) -> float:
+        return self.costs[self.index(tariff, region, profile, day)]
+
+    def daily_costs(self, tariff: str, region: str, profile: str) -> array:
+        first = self.index(tariff, region, profile, self.start)
+        return self.costs[first:first + self.days]
+
+    def save(self, path: str):
+        """Write a one line JSON header followed by the costs as little-endian doubles."""
+        header = {"format": FORMAT_VERSION, "tariffs": self.tariffs, "regions": self.regions,
+                  "profiles": self.profiles, "start": str(self.start), "days": self.days, "unit": "pence"}
+        costs = array('d', self.costs)
+        if sys.byteorder == "big":
+            costs.byteswap()
+        with open(path, "wb") as file:
+            file.write(json.dumps(header).encode() + b"\n")
+            costs.tofile(file)
+
+    @classmethod
+    def load(cls, path: str):
+        with open(path, "rb") as file:
+            header = json.loads(file.readline())
+            if header.get("format") != FORMAT_VERSION:
+                raise ValueError(f"{path} isn't a sweep this version can read")
+            costs = array('d')
+            costs.frombytes(file.read())
+        if sys.byteorder == "big":
+            costs.byteswap()
+        return cls(header["tariffs"], header["regions"], header["profiles"], date.fromisoformat(header["start"]),
+                   header["days"], costs)
+
+    def summary(self) -> str:
+        end = self.start + timedelta(days=self.days - 1)
+        summary = f"Sweep {self.start} to {end} ({self.days} days), total cost (days cheapest) per region:\n"
+        width = 18
+        for profile in self.profiles:
+            summary += f"\n{profile}\n{'Region':<8}" + "".join(f"{tariff:>{width}}" for tariff in self.tariffs) + "\n"
+            for region in self.regions:
+                series = [self.daily_costs(tariff, region, profile) for tariff in self.tariffs]
+                cheapest = [0] * len(self.tariffs)
+                for day_costs in zip(*series):
+                    if not any(math.isnan(cost) for cost in day_costs):
+                        cheapest[day_costs.index(min(day_costs))] += 1
+
+                summary += f"{region:<8}"
+                for costs, days_cheapest in zip(series, cheapest):
+                    total = sum(cost for cost in costs if not math.isnan(cost))
+                    summary += f"{f'£{total / 100:.2f} ({days_cheapest})':>{width}}"
+                summary += "\n"
+
+        missing = sum(math.isnan(cost) for cost in self.costs)
+        if missing:
+            summary += f"\n{missing} of {len(self.costs)} daily costs are missing rates and left out\n"
+        return summary
+
+
+async def sweep_async(tariffs, regions, start: date, end: date, profiles: dict, executor, workers: int) -> SweepResult:
+    days = (end - start).days + 1
+    profile_list = list(profiles.values())
+    semaphore = asyncio.Semaphore(config.PRICING_CONCURRENCY)
+    # Bounds how many series of raw rates wait for a worker at once, so a year of rates for every region
+    # never has to sit in memory together
+    pricing_slots = asyncio.Semaphore(max(2 * workers, config.PRICING_CONCURRENCY))
+    loop = asyncio.get_running_loop()
+
+    async def fetch_and_price(catalogue, tariff, region_code):
+        async with pricing_slots:
+            try:
+                standing_charge, unit_rates = await fetch_rate_range(session, semaphore, catalogue, tariff,
+                                                                     region_code, start, end)
+            except Exception as e:
+                print(f"Error fetching rates for {tariff.id} in region {region_code}. {e}")
+                return array('d', [math.nan]) * (len(profile_list) * days)
+            return await loop.run_in_executor(executor, price_series, unit_rates, standing_charge, profile_list,
+                                              start.toordinal(), days)
+
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=60)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        catalogue = await fetch_catalogue(session, semaphore)
+        series = await asyncio.gather(*(fetch_and_price(catalogue, tariff, region_code)
+                                        for tariff in tariffs for region_code in regions))
+
+    costs = array('d')
+    for tariff_region_costs in series:
+        costs.extend(tariff_region_costs)
+    return SweepResult([tariff.id for tariff in tariffs], regions, profiles, start, days, costs)
+
+
+def run_sweep(tariffs, regions, start: date, end: date, profiles: dict, workers: int = None) -> SweepResult:
+    """Price each of `profiles`, a dict of name to LoadProfile, on every tariff in every region from `start` to
+    `end`. Rates are fetched concurrently (and cached like any other rates) while a pool of `workers`
+    processes, one per CPU by default, parses and prices them.
+    """
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(max_workers=workers) as executor, span("sweep"):
+        return asyncio.run(sweep_async(tariffs, regions, start, end, profiles, executor, workers))
+
+
+def load_profiles(paths, daily_kwh: float) -> dict:
+    profiles = {os.path.splitext(os.path.basename(path))[0]: LoadProfile.from_csv(path) for path in paths}
+    if not profiles:
+        profiles[f"flat {daily_kwh:g} kWh/day"] = LoadProfile.flat(daily_kwh * 1000)
+    return profiles
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Price load profiles on every tariff, region and day.")
+    parser.add_argument("--days", type=int, default=365, help="Number of days to sweep, ending yesterday")
+    parser.add_argument("--start", type=date.fromisoformat, help="First day to sweep (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="Last day to sweep (YYYY-MM-DD)")
+    parser.add_argument("--tariffs", default=",".join(tariff.id for tariff in get_registry().tariffs
+                                                      if tariff.direction == "IMPORT"),
+                        help="Comma-separated tariff IDs to price, including ones discovered from the products "
+                             "catalogue. Defaults to every built in tariff and any in TARIFFS_FILE")
+    parser.add_argument("--regions", default=",".join(REGIONS),
+                        help="Comma-separated region letters. Defaults to all 14 regions")
+    parser.add_argument("--profile", action="append", default=[],
+                        help="CSV of 48 half-hourly watt-hour values, with an optional second column for weekends. "
+                             "Can be given more than once")
+    parser.add_argument("--daily-kwh", type=float, default=DEFAULT_DAILY_KWH,
+                        help="Daily consumption of the flat profile used when no --profile is given")
+    parser.add_argument("--workers", type=int, help="Worker processes. Defaults to one per CPU")
+    parser.add_argument("--output", help="Write the daily costs to this file, see SweepResult.save")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    end_date = args.end or date.today() - timedelta(days=1)
+    start_date = args.start or end_date - timedelta(days=args.days - 1)
+
+    tariff_ids = [tariff_id.strip().lower() for tariff_id in args.tariffs.split(",")]
+    registry = get_registry()
+    if any(tariff_id not in registry for tariff_id in tariff_ids):
+        # Not built in or in TARIFFS_FILE, so look for them among the products in the catalogue
+        registry.discover(load_catalogue())
+    sweep_tariffs = [registry.get(tariff_id) for tariff_id in tariff_ids if tariff_id in registry]
+    sweep_regions = [region.strip().upper() for region in args.regions.split(",")]
+
+    started = time.perf_counter()
+    result = run_sweep(sweep_tariffs, sweep_regions, start_date, end_date,
+                       load_profiles(args.profile, args.daily_kwh), args.workers)
+    print(result.summary())
+    print(f"Priced {len(result.costs)} daily costs in {time.perf_counter() - started:.1f}s")
+    if args.output:
+        result.save(args.output)
+        print(f"Saved to {args.output}")
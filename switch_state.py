@@ -0,0 +1,61 @@
+import json
+import os
+from datetime import date
+
+import config
+
+# The steps of a switch, in order. The state is saved after each one so a restart carries on where it left off,
+# and the file is removed once the switch has finished.
+STARTING = "starting"  # About to ask Octopus to switch. If we restart here the enrolment may or may not exist.
+REQUESTED = "requested"  # Octopus has an enrolment for the switch, waiting for the new agreement to accept
+ACCEPTED = "accepted"  # Terms accepted, waiting for the enrolment to complete
+
+
+class SwitchState:
+    def __init__(self, acc_number: str, day: str, product_code: str, display_name: str, mpan: str,
+                 state: str = STARTING, enrolment_id: str = None, accepted_version: str = None):
+        self.acc_number = acc_number
+        self.day = day
+        self.product_code = product_code
+        self.display_name = display_name
+        self.mpan = mpan
+        self.state = state
+        self.enrolment_id = enrolment_id
+        self.accepted_version = accepted_version
+
+    @staticmethod
+    def path(acc_number: str) -> str:
+        return os.path.join(config.DATA_DIR, f"switch-{acc_number}.json")
+
+    @classmethod
+    def load(cls, acc_number: str):
+        """Return the saved switch for an account, or None if there isn't one."""
+        try:
+            with open(cls.path(acc_number)) as file:
+                return cls(**json.load(file))
+        except (OSError, TypeError, ValueError):
+            return None
+
+    def is_today(self) -> bool:
+        return self.day == str(date.today())
+
+    def advance(self, state: str, **changes):
+        """Move to the next step and save, so it survives a restart."""
+        self.state = state
+        for name, value in changes.items():
+            setattr(self, name, value)
+        self.save()
+
+    def save(self):
+        path = self.path(self.acc_number)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Write then rename, so a crash mid-write can't leave a half written file behind
+        with open(path + ".tmp", "w") as file:
+            json.dump(vars(self), file)
+        os.replace(path + ".tmp", path)
+
+    def clear(self):
+        try:
+            os.remove(self.path(self.acc_number))
+        except OSError:
+            pass
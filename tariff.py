@@ -1,9 +1,14 @@
+import json
 import re
+import threading
+
+import config
+from products import TARIFF_CODE
 
 class Tariff:
     def __init__(self,
                  id: str, display_name: str, api_display_name: str, tariff_code_matcher: str,
-                 url_tariff_name: str, switchable: bool, product_code: str = None):
+                 url_tariff_name: str, switchable: bool, product_code: str = None, direction: str = "IMPORT"):
         self.id = id  # Represents the unique identifier for the tariff.
         self.display_name = display_name  # The user-friendly name of the tariff for display purposes.
         self.api_display_name = api_display_name  # The name used for API interactions with the tariff.
@@ -11,10 +16,12 @@ class Tariff:
         self.url_tariff_name = url_tariff_name  # The tariff name formatted for use in URLs.
         self.switchable = switchable  # Whether this tariff can be switched to or not
         self.product_code = product_code # Product code used in API e.g. "GO-VAR-22-10-14"
+        self.direction = direction  # IMPORT, or EXPORT for tariffs that pay for electricity exported
+        self._matcher = re.compile(tariff_code_matcher, re.IGNORECASE) if tariff_code_matcher else None
 
     def is_tariff(self, current_tariff_name: str) -> bool:
         """Check if the given tariff name matches the tariff code matcher using regex."""
-        return re.search(self.tariff_code_matcher, current_tariff_name,  re.IGNORECASE) is not None
+        return self._matcher is not None and self._matcher.search(current_tariff_name) is not None
 
     def __eq__(self, other):
         """Compare two tariffs based on their ID."""
@@ -26,12 +33,165 @@ class Tariff:
         return hash(self.id)
 
     def __str__(self):
-        return f"Tariff(id={self.id}, display_name={self.display_name}, api_display_name={self.api_display_name}, tariff_code_matcher={self.tariff_code_matcher}, url_tariff_name={self.url_tariff_name}, switchable={self.switchable}, product_code={self.product_code})"
+        return f"Tariff(id={self.id}, display_name={self.display_name}, api_display_name={self.api_display_name}, tariff_code_matcher={self.tariff_code_matcher}, url_tariff_name={self.url_tariff_name}, switchable={self.switchable}, product_code={self.product_code}, direction={self.direction})"
 
 
 TARIFFS = [
     Tariff("go", "Octopus Go", "Octopus Go", r"-go-", "go", True), # Octopus Go
     Tariff("agile", "Agile Octopus", "Agile Octopus", r"-agile-", "agile", True), # Octopus Agile
     Tariff("cosy", "Cosy Octopus", "Cosy Octopus", r"-cosy-", r"cosy-octopus", True), # Octopus Cosy
-    Tariff("flexible", "Flexible Octopus", "Flexible Octopus", r"(?<!go-)var", "", False) # Flexible Octopus
+    Tariff("flexible", "Flexible Octopus", "Flexible Octopus", r"(?<!go-)var", "", False), # Flexible Octopus
+    # Export tariffs are priced against exported electricity, but never switched to
+    Tariff("outgoing", "Outgoing Octopus", "Outgoing Octopus", r"(?<!agile-)outgoing-", "", False,
+           direction="EXPORT"), # Outgoing Octopus
+    Tariff("agile-outgoing", "Agile Outgoing Octopus", "Agile Outgoing Octopus", r"-agile-outgoing-", "", False,
+           direction="EXPORT"), # Agile Outgoing Octopus
 ]
+
+
+def tariff_id_for(display_name: str) -> str:
+    """The ID a discovered product gets, e.g. intelligent-octopus-go for Intelligent Octopus Go."""
+    return re.sub(r"[^a-z0-9]+", "-", display_name.lower()).strip("-")
+
+
+class TariffRegistry:
+    """Every tariff the bot knows about, indexed by ID and product code.
+
+    Starts from the built in TARIFFS, can take overrides and extra tariffs from a file, and can discover
+    the rest from the products catalogue. All of the code matchers are combined into one pattern, so finding
+    which tariffs a tariff code belongs to is one regex match however many tariffs there are.
+    """
+
+    def __init__(self, tariffs):
+        self._tariffs = {}  # key: ID, value: Tariff, in the order they were added
+        self._by_product_code = {}  # key: product code, value: Tariff
+        self._indexed_catalogue = None
+        self._pending_overrides = []  # Overrides of tariffs not known yet
+        self._pattern = None
+        self._lock = threading.Lock()
+        for tariff in tariffs:
+            self.add(tariff)
+
+    @property
+    def tariffs(self):
+        return list(self._tariffs.values())
+
+    def __contains__(self, tariff_id: str) -> bool:
+        return tariff_id in self._tariffs
+
+    def get(self, tariff_id: str):
+        return self._tariffs.get(tariff_id)
+
+    def for_product_code(self, product_code: str):
+        return self._by_product_code.get(product_code.upper())
+
+    def add(self, tariff: Tariff):
+        """Add a tariff, replacing any with the same ID."""
+        with self._lock:
+            self._tariffs[tariff.id] = tariff
+            if tariff.product_code:
+                self._by_product_code[tariff.product_code.upper()] = tariff
+            self._pattern = None
+
+    def matching(self, tariff_code: str):
+        """Return every tariff whose code matcher matches `tariff_code`, in the order they were added."""
+        with self._lock:
+            if self._pattern is None:
+                # One optional lookahead per tariff, each from the start of the code, so every matcher gets
+                # its chance to match anywhere in it and records which ones did
+                tariffs = [tariff for tariff in self._tariffs.values() if tariff.tariff_code_matcher]
+                self._pattern = (re.compile("".join(f"(?:(?=.*?(?P<_{index}>{tariff.tariff_code_matcher})))?"
+                                                    for index, tariff in enumerate(tariffs)), re.IGNORECASE),
+                                 tariffs)
+            pattern, tariffs = self._pattern
+
+        # By name, since a matcher's own capturing groups would shift the positions of the later ones
+        groups = pattern.match(tariff_code).groupdict()
+        return [tariff for index, tariff in enumerate(tariffs) if groups[f"_{index}"] is not None]
+
+    def for_tariff_code(self, tariff_code: str):
+        """Return the tariffs a tariff code could belong to: the one its product code is indexed under if there
+        is one, otherwise every tariff whose code matcher matches it."""
+        match = TARIFF_CODE.match(tariff_code)
+        tariff = self.for_product_code(match.group('product_code')) if match else None
+        return [tariff] if tariff is not None else self.matching(tariff_code)
+
+    def index_catalogue(self, catalogue):
+        """Index the code of every product in a products catalogue that has a registered tariff's display name."""
+        if catalogue is self._indexed_catalogue:
+            return
+        by_display_name = {tariff.api_display_name: tariff for tariff in reversed(self.tariffs)}
+        with self._lock:
+            for product_code, product in catalogue.by_code.items():
+                tariff = by_display_name.get(product.get('display_name'))
+                if tariff is not None and product_code:
+                    self._by_product_code[product_code.upper()] = tariff
+            self._indexed_catalogue = catalogue
+
+    def discover(self, catalogue):
+        """Add every import and export product in the catalogue that isn't already a tariff here.
+
+        Discovered tariffs are for price comparison only, unless a tariffs file marks them as switchable.
+        """
+        known = {tariff.api_display_name for tariff in self.tariffs}
+        for direction, by_display_name in (("IMPORT", catalogue.by_display_name),
+                                           ("EXPORT", catalogue.by_export_display_name)):
+            for display_name, product in by_display_name.items():
+                tariff_id = tariff_id_for(display_name)
+                if display_name in known or tariff_id in self:
+                    continue
+                self.add(Tariff(tariff_id, display_name, display_name, f"-{re.escape(product['code'])}-", "", False,
+                                product['code'], direction))
+
+        # Overrides for tariffs that had to be discovered first
+        self._pending_overrides = [entry for entry in self._pending_overrides if not self._override(entry)]
+        self._indexed_catalogue = None
+        self.index_catalogue(catalogue)
+
+    def load_overrides(self, path: str):
+        """Merge tariffs from a JSON list of objects with the same fields as Tariff.
+
+        An entry with the ID of a known tariff only changes the fields it gives. A new one needs an
+        api_display_name, the product's name in the catalogue, unless it's for a tariff that will be discovered.
+        """
+        with open(path) as file:
+            entries = json.load(file)
+
+        for entry in entries:
+            if not str(entry.get("id", "")).strip():
+                raise ValueError(f"Each tariff in {path} needs an id")
+            if not self._override(entry):
+                self._pending_overrides.append(entry)
+
+    def _override(self, entry) -> bool:
+        tariff_id = str(entry["id"]).strip().lower()
+        existing = self.get(tariff_id)
+        if existing is None and not entry.get("api_display_name"):
+            return False
+
+        fields = {
+            "display_name": None, "api_display_name": None, "tariff_code_matcher": None,
+            "url_tariff_name": "", "switchable": False, "product_code": None, "direction": "IMPORT",
+        }
+        if existing is not None:
+            fields = {name: getattr(existing, name) for name in fields}
+        fields.update({name: value for name, value in entry.items() if name in fields})
+        fields["display_name"] = fields["display_name"] or fields["api_display_name"]
+        self.add(Tariff(tariff_id, **fields))
+        return True
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> TariffRegistry:
+    """Return the shared registry: the built in tariffs plus any from TARIFFS_FILE."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            registry = TariffRegistry(TARIFFS)
+            if config.TARIFFS_FILE:
+                registry.load_overrides(config.TARIFFS_FILE)
+            _registry = registry
+    return _registry
@@ -0,0 +1,56 @@
+import os
+import sys
+import time
+from array import array
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from consumption_store import INTERVAL, ConsumptionStore, Readings, day_bounds  # noqa: E402
+
+DAY = date(2024, 3, 1)
+
+
+def readings(*slots):
+    """Readings of 100Wh for the given half hours of DAY."""
+    start, _ = day_bounds(DAY)
+    return Readings(array('d', (start + slot * INTERVAL for slot in slots)), array('d', [100.0] * len(slots)),
+                    array('d', [5.0] * len(slots)))
+
+
+def test_missing_from_an_empty_day(tmp_path):
+    store = ConsumptionStore(str(tmp_path / "consumption.sqlite"))
+    assert store.missing_from("meter", DAY) == day_bounds(DAY)[0]
+
+
+def test_missing_from_after_the_stored_readings(tmp_path):
+    store = ConsumptionStore(str(tmp_path / "consumption.sqlite"))
+    store.append("meter", readings(0, 1, 2))
+    assert store.missing_from("meter", DAY) == day_bounds(DAY)[0] + 3 * INTERVAL
+
+
+def test_missing_from_a_gap(tmp_path):
+    store = ConsumptionStore(str(tmp_path / "consumption.sqlite"))
+    store.append("meter", readings(0, 1, 3, 4))
+    assert store.missing_from("meter", DAY) == day_bounds(DAY)[0] + 2 * INTERVAL
+
+    store.append("meter", readings(2))
+    assert store.missing_from("meter", DAY) == day_bounds(DAY)[0] + 5 * INTERVAL
+
+
+def test_a_complete_day_has_nothing_missing(tmp_path):
+    store = ConsumptionStore(str(tmp_path / "consumption.sqlite"))
+    store.append("meter", readings(*range(48)))
+    assert store.missing_from("meter", DAY) is None
+    assert len(store.day_readings("meter", DAY)) == 48
+
+
+def test_the_half_hour_in_progress_is_not_stored(tmp_path):
+    store = ConsumptionStore(str(tmp_path / "consumption.sqlite"))
+    now = time.time()
+    in_progress = now - now % INTERVAL
+    store.append("meter", Readings(array('d', [in_progress - INTERVAL, in_progress]), array('d', [100.0, 20.0]),
+                                   array('d', [5.0, 1.0])))
+
+    stored = store.readings("meter", in_progress - INTERVAL, in_progress + INTERVAL)
+    assert list(stored.read_at) == [in_progress - INTERVAL]
@@ -0,0 +1,114 @@
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from cron import CronExpression, Schedule, parse_field  # noqa: E402
+
+
+@pytest.mark.parametrize("field, expected", [
+    ("*", set(range(0, 24))),
+    ("5", {5}),
+    ("1-4", {1, 2, 3, 4}),
+    ("0,12", {0, 12}),
+    ("*/6", {0, 6, 12, 18}),
+    ("8-18/5", {8, 13, 18}),
+    ("20/2", {20, 22}),
+    ("1-2,22", {1, 2, 22}),
+])
+def test_parse_field(field, expected):
+    assert parse_field(field, 0, 23) == expected
+
+
+@pytest.mark.parametrize("field", ["24", "5-2", "*/0", "-1", "a"])
+def test_parse_field_rejects_invalid(field):
+    with pytest.raises(ValueError):
+        parse_field(field, 0, 23)
+
+
+@pytest.mark.parametrize("expression", ["0 23 * *", "0 23 * * * *", "60 23 * * *", "0 0 32 * *", "0 0 * 13 *"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        CronExpression(expression)
+
+
+def test_next_after_later_the_same_day():
+    assert CronExpression("0 23 * * *").next_after(datetime(2024, 3, 1, 12, 0)) == datetime(2024, 3, 1, 23, 0)
+
+
+def test_next_after_is_strictly_after():
+    assert CronExpression("0 23 * * *").next_after(datetime(2024, 3, 1, 23, 0)) == datetime(2024, 3, 2, 23, 0)
+
+
+def test_next_after_ignores_seconds():
+    assert CronExpression("*/15 * * * *").next_after(datetime(2024, 3, 1, 12, 14, 59)) == \
+           datetime(2024, 3, 1, 12, 15)
+
+
+def test_next_after_rolls_over_month_and_year():
+    assert CronExpression("30 1 * * *").next_after(datetime(2024, 1, 31, 2, 0)) == datetime(2024, 2, 1, 1, 30)
+    assert CronExpression("0 0 1 1 *").next_after(datetime(2024, 6, 1)) == datetime(2025, 1, 1, 0, 0)
+
+
+def test_next_after_leap_day():
+    assert CronExpression("0 12 29 2 *").next_after(datetime(2024, 3, 1)) == datetime(2028, 2, 29, 12, 0)
+
+
+def test_weekdays():
+    # 2024-03-01 is a Friday
+    weekdays = CronExpression("30 16 * * 1-5")
+    assert weekdays.next_after(datetime(2024, 3, 1, 17, 0)) == datetime(2024, 3, 4, 16, 30)
+    sunday = CronExpression("0 9 * * 0")
+    assert sunday.next_after(datetime(2024, 3, 1)) == datetime(2024, 3, 3, 9, 0)
+    assert CronExpression("0 9 * * 7").next_after(datetime(2024, 3, 1)) == datetime(2024, 3, 3, 9, 0)
+
+
+def test_day_of_month_or_day_of_week():
+    # Both restricted, so either is enough: the 10th, or any Monday
+    expression = CronExpression("0 0 10 * 1")
+    assert expression.next_after(datetime(2024, 3, 1)) == datetime(2024, 3, 4, 0, 0)
+    assert expression.next_after(datetime(2024, 3, 5)) == datetime(2024, 3, 10, 0, 0)
+
+
+def test_day_of_month_with_any_weekday():
+    assert CronExpression("0 0 10 * *").next_after(datetime(2024, 3, 1)) == datetime(2024, 3, 10, 0, 0)
+
+
+def test_never_matches():
+    with pytest.raises(ValueError):
+        CronExpression("0 0 31 2 *").next_after(datetime(2024, 1, 1))
+
+
+def test_schedule_from_times():
+    schedule = Schedule("12:00, 23:00")
+    assert schedule.next_run(datetime(2024, 3, 1, 9, 0)) == datetime(2024, 3, 1, 12, 0)
+    assert schedule.next_run(datetime(2024, 3, 1, 12, 0)) == datetime(2024, 3, 1, 23, 0)
+    assert schedule.next_run(datetime(2024, 3, 1, 23, 30)) == datetime(2024, 3, 2, 12, 0)
+
+
+def test_schedule_mixing_times_and_cron():
+    schedule = Schedule("23:00;30 16 * * 1-5")
+    assert schedule.next_run(datetime(2024, 3, 1, 9, 0)) == datetime(2024, 3, 1, 16, 30)
+    # Saturday, so only the daily time
+    assert schedule.next_run(datetime(2024, 3, 2, 9, 0)) == datetime(2024, 3, 2, 23, 0)
+
+
+def test_empty_schedule():
+    with pytest.raises(ValueError):
+        Schedule(" ; ")
+
+
+def test_last_run_between():
+    schedule = Schedule("12:00,23:00")
+    assert schedule.last_run_between(datetime(2024, 3, 1, 9, 0), datetime(2024, 3, 2, 13, 0)) == \
+           datetime(2024, 3, 2, 12, 0)
+
+
+def test_last_run_between_includes_the_end_but_not_the_start():
+    schedule = Schedule("23:00")
+    assert schedule.last_run_between(datetime(2024, 3, 1, 22, 0), datetime(2024, 3, 1, 23, 0)) == \
+           datetime(2024, 3, 1, 23, 0)
+    assert schedule.last_run_between(datetime(2024, 3, 1, 23, 0), datetime(2024, 3, 2, 22, 59)) is None
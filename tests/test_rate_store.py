@@ -0,0 +1,148 @@
+import asyncio
+import os
+import sys
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import rate_store  # noqa: E402
+from cache import CURRENT_RATES_TTL  # noqa: E402
+from rate_store import RateStore, SingleFlight  # noqa: E402
+
+TODAY = date.today()
+YESTERDAY = TODAY - timedelta(days=1)
+
+
+def counting_fetch(result="rates", delay=0.01):
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return result
+    return fetch, calls
+
+
+def test_concurrent_callers_share_one_fetch():
+    flight = SingleFlight()
+    fetch, calls = counting_fetch()
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["rates"] * 5
+    assert len(calls) == 1
+
+
+def test_each_key_gets_its_own_fetch():
+    flight = SingleFlight()
+    fetch, calls = counting_fetch()
+
+    async def run():
+        return await asyncio.gather(flight.do("a", fetch), flight.do("b", fetch))
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_exception_reaches_every_waiter():
+    flight = SingleFlight()
+
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise ValueError("503")
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", fetch) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert [type(result) for result in results] == [ValueError] * 3
+
+    # The failed fetch isn't remembered, so the next caller tries again
+    fetch_again, calls = counting_fetch()
+    assert asyncio.run(flight.do("key", fetch_again)) == "rates"
+    assert len(calls) == 1
+
+
+def test_cancelled_owner_wakes_the_waiters():
+    flight = SingleFlight()
+
+    async def run():
+        async def slow():
+            await asyncio.sleep(10)
+
+        owner = asyncio.ensure_future(flight.do("key", slow))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do("key", slow))
+        await asyncio.sleep(0)
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await asyncio.wait_for(waiter, 1)
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_leaves_the_fetch_running():
+    flight = SingleFlight()
+    fetch, calls = counting_fetch(delay=0.05)
+
+    async def run():
+        owner = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        return await owner
+
+    assert asyncio.run(run()) == "rates"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Stands in for time.time, starting at 1000 and moved on by setting clock.now."""
+    class Clock:
+        now = 1000.0
+    monkeypatch.setattr(rate_store, "time", SimpleNamespace(time=lambda: Clock.now))
+    return Clock
+
+
+def test_past_days_never_expire(clock):
+    store = RateStore()
+    store.put(("GO", "C", YESTERDAY), "rates")
+    clock.now += CURRENT_RATES_TTL * 10
+    assert store.get(("GO", "C", YESTERDAY)) == "rates"
+
+
+def test_current_day_expires_after_ttl(clock):
+    store = RateStore()
+    store.put(("GO", "C", TODAY), "rates")
+    clock.now += CURRENT_RATES_TTL - 1
+    assert store.get(("GO", "C", TODAY)) == "rates"
+    clock.now += 2
+    assert store.get(("GO", "C", TODAY)) is None
+
+
+def test_least_recently_used_is_evicted():
+    store = RateStore(max_entries=2)
+    store.put(("A", "C", YESTERDAY), "a")
+    store.put(("B", "C", YESTERDAY), "b")
+    assert store.get(("A", "C", YESTERDAY)) == "a"  # Now B is the least recently used
+    store.put(("C", "C", YESTERDAY), "c")
+
+    assert store.get(("B", "C", YESTERDAY)) is None
+    assert store.get(("A", "C", YESTERDAY)) == "a"
+    assert store.get(("C", "C", YESTERDAY)) == "c"
+
+
+def test_get_or_fetch_stores_the_result():
+    store = RateStore()
+    fetch, calls = counting_fetch()
+    key = ("GO", "C", YESTERDAY)
+
+    assert asyncio.run(store.get_or_fetch(key, fetch)) == "rates"
+    assert asyncio.run(store.get_or_fetch(key, fetch)) == "rates"
+    assert len(calls) == 1
+
@@ -0,0 +1,157 @@
+import copy
+import os
+import sys
+from array import array
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import config  # noqa: E402
+import main  # noqa: E402
+from account_info import Account, AccountInfo  # noqa: E402
+from consumption_store import Readings  # noqa: E402
+from run_journal import KEEP_DAYS, RunJournal  # noqa: E402
+from switch_state import STARTING, SwitchState  # noqa: E402
+from tariff import TARIFFS  # noqa: E402
+
+ACC_NUMBER = "A-TEST"
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "DRY_RUN", False)
+    monkeypatch.setattr(config, "BATCH_NOTIFICATIONS", False)
+    return RunJournal(str(tmp_path / "journal.sqlite"))
+
+
+@pytest.fixture
+def account():
+    account = Account(ACC_NUMBER, "sk_test", "go,agile")
+    account.tariffs = [copy.copy(tariff) for tariff in TARIFFS if tariff.id in ("go", "agile")]
+    return account
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Record the calls to everything that fetches, prices or switches, failing the ones a resume mustn't make."""
+    calls = []
+
+    def forbidden(name):
+        def call(*args, **kwargs):
+            calls.append(name)
+            raise AssertionError(f"{name} called on a resumed run")
+        return call
+
+    monkeypatch.setattr(main, "get_acc_info", forbidden("get_acc_info"))
+    monkeypatch.setattr(main, "compare_costs", forbidden("compare_costs"))
+    monkeypatch.setattr(main, "switch_tariff", forbidden("switch_tariff"))
+    monkeypatch.setattr(main, "continue_switch", lambda *args: calls.append("continue_switch"))
+    return calls
+
+
+def account_info(account) -> AccountInfo:
+    agile = next(tariff for tariff in account.tariffs if tariff.id == "agile")
+    readings = Readings(array('d', [1709251200.0, 1709253000.0]), array('d', [250.0, 300.0]), array('d', [6.0, 7.0]))
+    return AccountInfo(agile, 45.0, "C", readings, "1000000000000", "00-00", "E-1R-AGILE-24-10-01-C")
+
+
+def priced() -> dict:
+    """Go £1 cheaper than the current tariff, Agile."""
+    return {
+        "summary": "Costs\n",
+        "current_tariff": "agile",
+        "mpan": "1000000000000",
+        "result": {"current_tariff": "agile"},
+        "tariffs": {"agile": {"display_name": "Agile Octopus", "switchable": True, "product_code": "AGILE-24-10-01",
+                              "cost": 500.0},
+                    "go": {"display_name": "Octopus Go", "switchable": True, "product_code": "GO-VAR-22-10-14",
+                           "cost": 400.0}},
+    }
+
+
+def interrupted_run(journal, phases: dict):
+    """A run that recorded `phases` then stopped, as the next run finds it."""
+    run = journal.start(ACC_NUMBER)
+    for phase, data in phases.items():
+        run.record(phase, data)
+    return journal.start(ACC_NUMBER)
+
+
+def test_resumed_after_switch_phase_does_not_switch_again(journal, account, calls):
+    run = interrupted_run(journal, {"fetched": account_info(account).as_dict(), "priced": priced(),
+                                    "switch": {"display_name": "Octopus Go", "state": "accepted"}})
+    assert run.resumed
+
+    main.compare_and_switch(account, run)
+
+    assert calls == []
+    assert account.outcome == "Already requested the switch to Octopus Go"
+
+
+def test_resumed_mid_switch_continues_it_instead_of_switching_again(journal, account, calls):
+    switch = SwitchState(ACC_NUMBER, str(main.date.today()), "GO-VAR-22-10-14", "Octopus Go", "1000000000000")
+    switch.save()
+    run = interrupted_run(journal, {"fetched": account_info(account).as_dict(), "priced": priced(),
+                                    "switch": vars(switch)})
+
+    main.compare_and_switch(account, run)
+
+    assert calls == ["continue_switch"]
+    assert SwitchState.load(ACC_NUMBER).state == STARTING
+
+
+def test_resumed_after_fetched_prices_the_stored_data(journal, account, calls, monkeypatch):
+    monkeypatch.setattr(config, "DRY_RUN", True)
+    fetched = account_info(account)
+    run = interrupted_run(journal, {"fetched": fetched.as_dict()})
+    priced_with = []
+
+    def compare_costs(account, info):
+        priced_with.append(info)
+        return priced()
+    monkeypatch.setattr(main, "compare_costs", compare_costs)
+
+    main.compare_and_switch(account, run)
+
+    assert calls == []
+    assert len(priced_with) == 1
+    assert priced_with[0].as_dict() == fetched.as_dict()
+    assert run.phases["priced"] == priced()
+    assert account.outcome.startswith("DRY RUN: Would switch to Octopus Go")
+
+
+def test_resumed_after_priced_decides_from_the_stored_costs(journal, account, calls, monkeypatch):
+    monkeypatch.setattr(config, "DRY_RUN", True)
+    run = interrupted_run(journal, {"fetched": account_info(account).as_dict(), "priced": priced()})
+
+    main.compare_and_switch(account, run)
+
+    assert calls == []
+    assert account.result == priced()["result"]
+    assert account.outcome.startswith("DRY RUN: Would switch to Octopus Go")
+
+
+def test_finished_run_is_not_resumed(journal):
+    run = journal.start(ACC_NUMBER)
+    run.record("fetched", {"a": 1})
+    run.finish("done")
+
+    assert not journal.start(ACC_NUMBER).resumed
+
+
+def test_old_runs_are_pruned(journal):
+    old = journal.start(ACC_NUMBER)
+    old.record("fetched", {"a": 1})
+    old.finish("done")
+    journal._conn.execute("UPDATE runs SET started_at = started_at - ? WHERE run_id = ?",
+                          ((KEEP_DAYS + 1) * 24 * 3600, old.run_id))
+    recent = journal.start(ACC_NUMBER)
+    recent.record("fetched", {"a": 2})
+    recent.finish("done")
+
+    run_ids = [row[0] for row in journal._conn.execute("SELECT run_id FROM runs")]
+    phase_run_ids = [row[0] for row in journal._conn.execute("SELECT run_id FROM phases")]
+    assert run_ids == [recent.run_id]
+    assert phase_run_ids == [recent.run_id]
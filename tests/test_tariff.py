@@ -0,0 +1,23 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from tariff import TARIFFS, Tariff, TariffRegistry  # noqa: E402
+
+
+def test_matching_finds_every_matching_tariff():
+    registry = TariffRegistry(TARIFFS)
+    assert [tariff.id for tariff in registry.matching("E-1R-AGILE-OUTGOING-19-05-13-C")] == \
+           ["agile", "agile-outgoing"]
+    assert [tariff.id for tariff in registry.matching("E-1R-GO-VAR-22-10-14-C")] == ["go"]
+    assert registry.matching("E-1R-UNKNOWN-22-C") == []
+
+
+def test_matching_with_capturing_group_in_a_matcher():
+    # A matcher's own group mustn't shift which tariff each of the later matches belongs to
+    registry = TariffRegistry([Tariff("silver", "Octopus Silver", "Octopus Silver", r"-(silver|tracker)-", "", False),
+                               *TARIFFS])
+    assert [tariff.id for tariff in registry.matching("E-1R-ZZ-22-C")] == []
+    assert [tariff.id for tariff in registry.matching("E-1R-VAR-22-11-01-C")] == ["flexible"]
+    assert [tariff.id for tariff in registry.matching("E-1R-SILVER-24-12-31-C")] == ["silver"]